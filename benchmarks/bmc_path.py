@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the BMC path, against a simulated fleet of BMCs.
+
+Starts a fleet of fake RMCP+ BMCs (tests/ipmi/fakebmc.py) - one per plain
+machine, plus Moonshot chassis BMCs with a number of bridged cartridges each
+- with the given latency and failure rate, and points the ipmitool backend
+at a stand-in ipmitool (tests/ipmi/fake_ipmitool.py) that talks to them.
+Then, for each backend, it measures:
+
+  ops    PlainBMC/MoonshotBMC get_power, set_power, set_bootdev and
+         boot_and_reset, one at a time
+  fleet  power state queries for every machine at once, through the BMC
+         scheduler as in a machine listing or poll_power
+
+and reports throughput and latency percentiles.
+
+Every BMC listens on the same port on its own loopback address
+(127.0.1.x for plain BMCs, 127.0.2.x for Moonshot chassis), which needs
+Linux's 127.0.0.0/8 loopback routing.
+
+    python benchmarks/bmc_path.py [--plain N] [--moonshot N] [--latency S] [--failure-rate F] ...
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import threading
+import time
+from concurrent.futures import wait
+from types import SimpleNamespace
+
+_basedir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, _basedir)
+
+from mr_provisioner import ipmi, ipmi_lanplus  # noqa: E402
+from mr_provisioner.bmc_scheduler import scheduler  # noqa: E402
+from mr_provisioner.bmc_types import BMCError, resolve_bmc_type  # noqa: E402
+from mr_provisioner.power import query_power, power_state_of  # noqa: E402
+from tests.ipmi.fakebmc import FakeBMC  # noqa: E402
+
+
+FAKE_IPMITOOL = os.path.join(_basedir, 'tests', 'ipmi', 'fake_ipmitool.py')
+BACKENDS = ipmi.BACKENDS
+
+
+def start_fleet(args):
+    """Start the fake BMCs; returns them and machine snapshots (as bmc_scheduler.snapshot makes) for them."""
+    bmcs = []
+    machines = []
+
+    def add_bmc(host, bmc_type, respond=True):
+        fake = FakeBMC(host=host, port=args.port, respond=respond, latency=args.latency, jitter=args.jitter,
+                       failure_rate=args.failure_rate).start()
+        bmcs.append(fake)
+        return SimpleNamespace(id=len(bmcs), ip=host, username='admin', password='password',
+                               privilege_level=None, bmc_type=bmc_type)
+
+    def add_machine(bmc, bmc_info=None):
+        machines.append(SimpleNamespace(id=len(machines) + 1, bmc_info=bmc_info, bmc=bmc,
+                                        subarch=SimpleNamespace(efiboot=False)))
+
+    for i in range(args.plain):
+        add_machine(add_bmc('127.0.1.%d' % (i + 1), 'plain', respond=i >= args.dead))
+
+    for i in range(args.moonshot):
+        chassis = add_bmc('127.0.2.%d' % (i + 1), 'moonshot')
+        for cartridge in range(1, args.cartridges + 1):
+            add_machine(chassis, str(cartridge))
+
+    return bmcs, machines
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))]
+
+
+def report(backend, name, latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    ms = [percentile(latencies, p) * 1000 for p in (50, 95, 99, 100)]
+    return ('%-8s %-28s %6d ops %8.1f ops/s  p50 %7.1f  p95 %7.1f  p99 %7.1f  max %7.1f ms  errors %d' %
+            ((backend, name, len(latencies), len(latencies) / elapsed if elapsed else 0.0) + tuple(ms) + (errors,)))
+
+
+OPERATIONS = [
+    ('get_power', lambda bmc_type, m: bmc_type.get_power(m)),
+    ('set_power on', lambda bmc_type, m: bmc_type.set_power(m, 'on')),
+    ('set_bootdev pxe', lambda bmc_type, m: bmc_type.set_bootdev(m, 'pxe')),
+    ('boot_and_reset pxe', lambda bmc_type, m: bmc_type.boot_and_reset(m, 'pxe')),
+]
+
+
+def bench_ops(backend, machines, args):
+    lines = []
+    for type_name in ('plain', 'moonshot'):
+        bmc_type = resolve_bmc_type(type_name)
+        targets = [m for m in machines if m.bmc.bmc_type == type_name and m.id > args.dead]
+        if not targets:
+            continue
+
+        for name, op in OPERATIONS:
+            latencies = []
+            errors = 0
+            start = time.monotonic()
+            for i in range(args.ops):
+                op_start = time.monotonic()
+                try:
+                    op(bmc_type, targets[i % len(targets)])
+                except BMCError:
+                    errors += 1
+                latencies.append(time.monotonic() - op_start)
+            lines.append(report(backend, '%s %s' % (type_name, name), latencies, errors, time.monotonic() - start))
+    return lines
+
+
+def bench_fleet(backend, machines, args):
+    lines = []
+    for i in range(args.rounds):
+        scheduler.health.clear()
+        lock = threading.Lock()
+        latencies = []
+        states = {}
+
+        start = time.monotonic()
+        futures = []
+        for machine in machines:
+            def done(future, machine=machine):
+                with lock:
+                    latencies.append(time.monotonic() - start)
+                    states[machine.id] = power_state_of(machine.id, future.result)
+
+            future = scheduler.submit(query_power, machine, coalesce='get_power', deadline=start + args.timeout)
+            future.add_done_callback(done)
+            futures.append(future)
+        wait(futures)
+        elapsed = time.monotonic() - start
+
+        errors = sum(1 for state in states.values() if state not in ('on', 'off'))
+        lines.append(report(backend, 'fleet get_power (round %d)' % (i + 1), latencies, errors, elapsed))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--plain', type=int, default=32, help='plain BMCs, one machine each')
+    parser.add_argument('--moonshot', type=int, default=2, help='Moonshot chassis BMCs')
+    parser.add_argument('--cartridges', type=int, default=45, help='cartridges per Moonshot chassis')
+    parser.add_argument('--dead', type=int, default=0, help='plain BMCs that never answer')
+    parser.add_argument('--latency', type=float, default=0.002, help='seconds each BMC takes per request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many seconds more')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests not answered')
+    parser.add_argument('--port', type=int, default=16230)
+    parser.add_argument('--backend', choices=BACKENDS, action='append',
+                        help='backend to benchmark, repeatable (default: all)')
+    parser.add_argument('--scenario', choices=['ops', 'fleet'], action='append',
+                        help='scenario to run, repeatable (default: all)')
+    parser.add_argument('--ops', type=int, default=20, help='runs of each operation per BMC type')
+    parser.add_argument('--rounds', type=int, default=3, help='fleet-wide queries')
+    parser.add_argument('--workers', type=int, default=32, help='scheduler threads ([power] max_workers)')
+    parser.add_argument('--per-bmc-concurrency', type=int, default=2)
+    parser.add_argument('--timeout', type=float, default=10.0, help='fleet query timeout ([power] state_timeout)')
+    parser.add_argument('--ipmi-timeout', type=float, default=1.0, help='seconds to wait for each BMC answer')
+    args = parser.parse_args()
+
+    bmcs, machines = start_fleet(args)
+
+    os.environ.update(FAKE_IPMITOOL_PORT=str(args.port), FAKE_IPMITOOL_TIMEOUT=str(args.ipmi_timeout))
+    ipmi.set_ipmitool(FAKE_IPMITOOL)
+    ipmi.set_ipmitool_timeout(30)
+    ipmi_lanplus.configure(port=args.port, timeout=args.ipmi_timeout, retries=1,
+                           cipher_suite=3 if ipmi_lanplus.Cipher is not None else 2)
+
+    resolve_bmc_type('plain').max_concurrency = args.per_bmc_concurrency
+    resolve_bmc_type('moonshot').max_concurrency = 1
+    scheduler.start(args.workers)
+
+    print('%d machines on %d BMCs, %.1f ms latency, %.0f%% failures' %
+          (len(machines), len(bmcs), args.latency * 1000, args.failure_rate * 100))
+    for backend in args.backend or BACKENDS:
+        for bmc_type in ('plain', 'moonshot'):
+            resolve_bmc_type(bmc_type).ipmi_backend = backend
+        ipmi_lanplus.pool.clear()
+
+        for scenario in args.scenario or ['ops', 'fleet']:
+            # ipmi.run_command prints every ipmitool command line
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                lines = (bench_ops if scenario == 'ops' else bench_fleet)(backend, machines, args)
+            print('\n'.join(lines))
+
+    for bmc in bmcs:
+        bmc.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for /dhcp/ipv4/subnet matching.
+
+Compares mr_provisioner.dhcp.networks.match_subnet, on the integer ranges
+of the network index, against the ipaddress-based matching it replaced,
+for a Kea subnet selection request listing hundreds of subnets. The
+interface's network is the last one listed, so every subnet is looked at.
+
+    python benchmarks/dhcp_subnet.py [-s SUBNETS] [-p POOLS] [-n ITERATIONS]
+"""
+
+import argparse
+import ipaddress
+import os
+import sys
+import timeit
+from functools import reduce
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from mr_provisioner.dhcp.networks import NetworkIndex, match_subnet  # noqa: E402
+
+
+NETWORK_SUBNET = '10.255.0.0/16'
+NETWORK_RESERVED = '10.255.128.0/24'
+
+
+def legacy_match(subnet, reserved_net, subnets):
+    expected_pool = ipaddress.IPv4Network(reserved_net)
+    for s in subnets:
+        net = ipaddress.IPv4Network((s['prefix'], s['prefixLen']), strict=False)
+        if not net.overlaps(ipaddress.IPv4Network(subnet)):
+            continue
+
+        pool_matches = reduce(lambda r, p: r or p['firstIP'] in expected_pool, s['pools'], False)
+        if pool_matches:
+            return s
+
+    return None
+
+
+def kea_subnets(count, pools):
+    """count subnets as subnet_schema returns them, with the interface's network last."""
+    subnets = []
+    for i in range(count - 1):
+        prefix = ipaddress.IPv4Address('10.%d.%d.0' % (i // 256, i % 256))
+        subnets.append({
+            'subnetId': i + 1,
+            'prefix': prefix,
+            'prefixLen': 24,
+            'pools': [{'poolId': j, 'capacity': 8, 'firstIP': prefix + 8 * j + 1, 'lastIP': prefix + 8 * j + 8}
+                      for j in range(pools)],
+        })
+
+    # Same network, but only the last pool is in the reserved range
+    subnets.append({
+        'subnetId': count,
+        'prefix': ipaddress.IPv4Address('10.255.0.0'),
+        'prefixLen': 16,
+        'pools': [{'poolId': j, 'capacity': 8, 'firstIP': ipaddress.IPv4Address('10.255.%d.1' % j),
+                   'lastIP': ipaddress.IPv4Address('10.255.%d.8' % j)} for j in range(pools - 1)] +
+                 [{'poolId': pools, 'capacity': 8, 'firstIP': ipaddress.IPv4Address('10.255.128.1'),
+                   'lastIP': ipaddress.IPv4Address('10.255.128.8')}],
+    })
+    return subnets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-s', '--subnets', type=int, default=500, help='Kea subnets per request')
+    parser.add_argument('-p', '--pools', type=int, default=2, help='pools per Kea subnet')
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    subnets = kea_subnets(args.subnets, args.pools)
+    network = NetworkIndex([(1, NETWORK_SUBNET, NETWORK_RESERVED)]).get(1)
+
+    candidates = (
+        ('legacy ipaddress', lambda: legacy_match(NETWORK_SUBNET, NETWORK_RESERVED, subnets)),
+        ('network index', lambda: match_subnet(network, subnets)),
+    )
+    for name, fn in candidates:
+        assert fn()['subnetId'] == args.subnets
+        best = min(timeit.repeat(fn, number=args.iterations, repeat=5))
+        per_request = best / args.iterations * 1e6
+        print('%-20s %8.1f us/request (%d subnets)' % (name, per_request, args.subnets))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for validating the payloads of the Kea hook.
+
+Compares mr_provisioner.dhcp.validation against the `schema` schemas it
+replaced, for a lease, a seen payload with a typical list of DHCP options
+and a subnet selection payload listing hundreds of Kea subnets.
+
+    python benchmarks/dhcp_validation.py [-s SUBNETS] [-n ITERATIONS]
+"""
+
+import argparse
+import ipaddress
+import os
+import re
+import sys
+import timeit
+
+from schema import Schema, And, Or, Use
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from mr_provisioner.dhcp import validation  # noqa: E402
+from mr_provisioner.util import MAC_REGEX  # noqa: E402
+
+
+legacy_lease_schema = Schema({
+    'mac': And(str, lambda s: re.match(MAC_REGEX, s) is not None),
+    'ipv4': Use(ipaddress.IPv4Address),
+    'duration': And(int, lambda i: i >= 0)
+})
+
+legacy_seen_schema = Schema({
+    'discover': bool,
+    'mac': And(str, lambda s: re.match(MAC_REGEX, s) is not None),
+    'options': [{
+        'option': And(int, lambda i: i >= 0),
+        'value': Or(int, str)
+    }]
+})
+
+legacy_subnet_schema = Schema({
+    'mac': And(str, lambda s: re.match(MAC_REGEX, s) is not None),
+    'subnets': [{
+        'subnetId': int,
+        'prefix': Use(ipaddress.IPv4Address),
+        'prefixLen': And(int, lambda i: i >= 0 and i <= 32),
+        'pools': [{
+            'poolId': int,
+            'capacity': int,
+            'firstIP': Use(ipaddress.IPv4Address),
+            'lastIP': Use(ipaddress.IPv4Address),
+        }]
+    }]
+})
+
+
+LEASE = {'mac': '00:11:22:33:44:55', 'ipv4': '10.0.0.10', 'duration': 3600}
+
+# What a PXE client's DHCPDISCOVER carries
+SEEN = {
+    'discover': True,
+    'mac': '00:11:22:33:44:55',
+    'options': [
+        {'option': 53, 'value': 1},
+        {'option': 57, 'value': 1464},
+        {'option': 93, 'value': 11},
+        {'option': 94, 'value': '010300'},
+        {'option': 97, 'value': '00564d5f9c7a1a3b1c2d3e4f5a6b7c8d9e'},
+        {'option': 60, 'value': 'PXEClient:Arch:00011:UNDI:003000'},
+        {'option': 12, 'value': 'ubuntu'},
+        {'option': 55, 'value': '0102030405060c0d0f111216171c28292a2b3233363a3b3c4243618081'},
+    ],
+}
+
+
+def subnet_payload(count):
+    subnets = []
+    for i in range(count):
+        prefix = '10.%d.%d.' % (i // 256, i % 256)
+        subnets.append({
+            'subnetId': i + 1,
+            'prefix': prefix + '0',
+            'prefixLen': 24,
+            'pools': [{'poolId': i * 2 + j, 'capacity': 100, 'firstIP': prefix + str(j * 100 + 1),
+                       'lastIP': prefix + str(j * 100 + 100)} for j in range(2)],
+        })
+    return {'mac': '00:11:22:33:44:55', 'subnets': subnets}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-s', '--subnets', type=int, default=500, help='Kea subnets in the subnet payload')
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    payloads = (
+        ('lease', LEASE, legacy_lease_schema.validate, validation.validate_lease, 50),
+        ('seen', SEEN, legacy_seen_schema.validate, validation.validate_seen, 10),
+        ('subnet', subnet_payload(args.subnets), legacy_subnet_schema.validate, validation.validate_subnet, 1),
+    )
+    for payload_name, payload, *validators, scale in payloads:
+        for name, validate in zip(('schema', 'validation'), validators):
+            number = args.iterations * scale
+            best = min(timeit.repeat(lambda: validate(payload), number=number, repeat=5))
+            print('%-8s %-12s %10.1f us/payload' % (payload_name, name, best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for classifying requested TFTP paths.
+
+Compares mr_provisioner.tftp.paths.classify_path against the per-request
+re.search() approach it replaced, over a mix of paths resembling what
+pxelinux/GRUB probe while netbooting.
+
+    python benchmarks/tftp_paths.py [-n ITERATIONS]
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from mr_provisioner.tftp.paths import classify_path  # noqa: E402
+
+
+LEGACY_MAC_FILE_REGEX = r"/01-([\da-fA-F]{2}-[\da-fA-F]{2}-[\da-fA-F]{2}-[\da-fA-F]{2}-[\da-fA-F]{2}-[\da-fA-F]{2})"
+LEGACY_DEFAULT_FILE_REGEXES = ["/pxelinux.cfg/default", "/efidefault"]
+
+
+def legacy_classify(filename):
+    m = re.search(LEGACY_MAC_FILE_REGEX, filename)
+    mac = m.group(1).replace('-', ':').lower() if m else None
+    use_def_config = any(re.search(regex, filename) for regex in LEGACY_DEFAULT_FILE_REGEXES)
+    return mac, use_def_config, filename.find("pxelinux.cfg") >= 0
+
+
+PATHS = [
+    'pxelinux.cfg/01-00-11-22-33-44-55',
+    'pxelinux.cfg/C0A8000A',
+    'pxelinux.cfg/C0A800',
+    'pxelinux.cfg/C0A',
+    'pxelinux.cfg/default',
+    'grub/grub.cfg-01-00-11-22-33-44-55',
+    'grub/grub.cfg-C0A8000A',
+    'grub/grub.cfg',
+    'grub/efidefault',
+    'grub/x86_64-efi/command.lst',
+    'images/ubuntu/xenial/arm64/linux',
+    'images/ubuntu/xenial/arm64/initrd.gz',
+    'ipxe/mac-001122334455.ipxe',
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    for name, fn in (('legacy re.search', legacy_classify), ('classify_path', classify_path)):
+        def run():
+            for path in PATHS:
+                fn(path)
+
+        best = min(timeit.repeat(run, number=args.iterations, repeat=5))
+        per_path = best / (args.iterations * len(PATHS)) * 1e9
+        print('%-20s %8.0f ns/path' % (name, per_path))
+
+
+if __name__ == '__main__':
+    main()
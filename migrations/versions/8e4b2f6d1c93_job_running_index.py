@@ -0,0 +1,25 @@
+"""job running index
+
+Revision ID: 8e4b2f6d1c93
+Revises: c3f19a6d2e87
+Create Date: 2026-10-18 23:12:05.318842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4b2f6d1c93'
+down_revision = 'c3f19a6d2e87'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('job_running_idx', 'job', ['machine_id'], unique=False,
+                    postgresql_where=sa.text("status = 'running'"))
+
+
+def downgrade():
+    op.drop_index('job_running_idx', table_name='job')
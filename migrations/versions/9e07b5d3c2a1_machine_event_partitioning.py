@@ -0,0 +1,108 @@
+"""machine event partitioning
+
+Optional: this migration only changes anything when run with
+`db upgrade -x event_partitions=daily` (or `weekly`), turning machine_event
+into a table partitioned by date. Without it, it is a no-op; to opt in later,
+downgrade to 4c1d8e2a9f60 and upgrade again with the argument.
+
+Requires PostgreSQL 11 or later.
+
+Revision ID: 9e07b5d3c2a1
+Revises: 4c1d8e2a9f60
+Create Date: 2026-10-18 13:40:02.551310
+
+"""
+from datetime import datetime, timedelta
+
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '9e07b5d3c2a1'
+down_revision = '4c1d8e2a9f60'
+branch_labels = None
+depends_on = None
+
+
+from mr_provisioner.event_partitions import create_partitions, is_partitioned, INTERVALS
+
+
+def upgrade():
+    interval = context.get_x_argument(as_dictionary=True).get('event_partitions')
+    if not interval:
+        return
+
+    if interval not in INTERVALS:
+        raise ValueError('event_partitions must be one of: %s' % ', '.join(INTERVALS))
+
+    bind = op.get_bind()
+    if is_partitioned(bind):
+        return
+
+    op.execute('ALTER TABLE machine_event RENAME TO machine_event_unpartitioned')
+    op.execute('ALTER TABLE machine_event_unpartitioned RENAME CONSTRAINT machine_event_pkey '
+               'TO machine_event_unpartitioned_pkey')
+    op.drop_index('machine_event_machine_id_date_idx', table_name='machine_event_unpartitioned')
+    op.drop_index('machine_event_date_idx', table_name='machine_event_unpartitioned')
+    op.execute('ALTER SEQUENCE machine_event_id_seq OWNED BY NONE')
+
+    # The partition key has to be part of the primary key.
+    op.execute("""
+        CREATE TABLE machine_event (
+            id INTEGER NOT NULL DEFAULT nextval('machine_event_id_seq'),
+            machine_id INTEGER REFERENCES machine (id) ON DELETE CASCADE,
+            user_id INTEGER REFERENCES "user" (id) ON DELETE SET NULL,
+            username VARCHAR,
+            date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            event_type INTEGER NOT NULL,
+            info JSONB,
+            PRIMARY KEY (id, date)
+        ) PARTITION BY RANGE (date)
+    """)
+    op.execute('CREATE TABLE machine_event_default PARTITION OF machine_event DEFAULT')
+    op.create_index('machine_event_date_idx', 'machine_event', ['date'], unique=False)
+    op.create_index('machine_event_machine_id_date_idx', 'machine_event', ['machine_id', 'date'], unique=False)
+    op.execute('ALTER SEQUENCE machine_event_id_seq OWNED BY machine_event.id')
+
+    oldest = bind.execute(sa.text('SELECT min(date) FROM machine_event_unpartitioned')).scalar()
+    today = datetime.utcnow()
+    create_partitions(bind, interval, oldest or today, today + timedelta(days=7))
+
+    op.execute('INSERT INTO machine_event SELECT id, machine_id, user_id, username, date, event_type, info '
+               'FROM machine_event_unpartitioned')
+    op.drop_table('machine_event_unpartitioned')
+
+
+def downgrade():
+    bind = op.get_bind()
+    if not is_partitioned(bind):
+        return
+
+    op.execute('ALTER TABLE machine_event RENAME TO machine_event_partitioned')
+    op.drop_index('machine_event_machine_id_date_idx', table_name='machine_event_partitioned')
+    op.drop_index('machine_event_date_idx', table_name='machine_event_partitioned')
+    op.execute('ALTER TABLE machine_event_partitioned RENAME CONSTRAINT machine_event_pkey '
+               'TO machine_event_partitioned_pkey')
+    op.execute('ALTER SEQUENCE machine_event_id_seq OWNED BY NONE')
+
+    op.create_table('machine_event',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('machine_event_id_seq')"), nullable=False),
+    sa.Column('machine_id', sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('username', sa.String(), nullable=True),
+    sa.Column('date', sa.DateTime(), nullable=False),
+    sa.Column('event_type', sa.Integer(), nullable=False),
+    sa.Column('info', postgresql.JSONB(), nullable=True),
+    sa.ForeignKeyConstraint(['machine_id'], ['machine.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('machine_event_date_idx', 'machine_event', ['date'], unique=False)
+    op.create_index('machine_event_machine_id_date_idx', 'machine_event', ['machine_id', 'date'], unique=False)
+    op.execute('ALTER SEQUENCE machine_event_id_seq OWNED BY machine_event.id')
+
+    op.execute('INSERT INTO machine_event SELECT id, machine_id, user_id, username, date, event_type, info '
+               'FROM machine_event_partitioned')
+    op.drop_table('machine_event_partitioned')
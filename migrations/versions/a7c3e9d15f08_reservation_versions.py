@@ -0,0 +1,39 @@
+"""reservation versions
+
+Revision ID: a7c3e9d15f08
+Revises: 5b8e1f3c7a24
+Create Date: 2026-10-18 20:11:46.082614
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9d15f08'
+down_revision = '5b8e1f3c7a24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(sa.schema.CreateSequence(sa.Sequence('reservation_version_seq')))
+    # Existing interfaces get versions of their own through the default
+    op.add_column('interface', sa.Column('version', sa.BigInteger(), nullable=False,
+                                         server_default=sa.text("nextval('reservation_version_seq')")))
+    op.alter_column('interface', 'version', server_default=None)
+    op.create_index(op.f('ix_interface_version'), 'interface', ['version'], unique=False)
+
+    op.create_table('reservation_tombstone',
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.Column('mac', postgresql.MACADDR(), nullable=False),
+    sa.PrimaryKeyConstraint('version')
+    )
+
+
+def downgrade():
+    op.drop_table('reservation_tombstone')
+    op.drop_index(op.f('ix_interface_version'), table_name='interface')
+    op.drop_column('interface', 'version')
+    op.execute(sa.schema.DropSequence(sa.Sequence('reservation_version_seq')))
@@ -0,0 +1,27 @@
+"""tombstone retention
+
+Revision ID: b91e4d7a3c60
+Revises: 5a7c3e9d1b24
+Create Date: 2026-10-19 12:17:43.902518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b91e4d7a3c60'
+down_revision = '5a7c3e9d1b24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing tombstones count as deleted now.
+    op.add_column('reservation_tombstone',
+                  sa.Column('deleted_at', sa.DateTime(), nullable=False,
+                            server_default=sa.text("(now() at time zone 'utc')")))
+
+
+def downgrade():
+    op.drop_column('reservation_tombstone', 'deleted_at')
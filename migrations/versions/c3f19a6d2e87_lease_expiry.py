@@ -0,0 +1,34 @@
+"""lease expiry
+
+Revision ID: c3f19a6d2e87
+Revises: a7c3e9d15f08
+Create Date: 2026-10-18 22:04:37.519204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f19a6d2e87'
+down_revision = 'a7c3e9d15f08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The duration of existing leases is unknown: treat them as expired,
+    # until the DHCP server renews them.
+    op.add_column('lease', sa.Column('expires_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE lease SET expires_at = last_seen')
+    op.alter_column('lease', 'expires_at', nullable=False)
+    op.add_column('lease', sa.Column('expired', sa.Boolean(), nullable=False, server_default=sa.false()))
+    op.alter_column('lease', 'expired', server_default=None)
+    op.create_index('lease_active_idx', 'lease', ['mac', 'expires_at'], unique=False,
+                    postgresql_where=sa.text('NOT expired'))
+
+
+def downgrade():
+    op.drop_index('lease_active_idx', table_name='lease')
+    op.drop_column('lease', 'expired')
+    op.drop_column('lease', 'expires_at')
@@ -32,6 +32,7 @@ def create_app(config_path=None):
     from mr_provisioner.preseed.controllers import mod as preseed_module
     from mr_provisioner.tftp.controllers import mod as tftp_module
     from mr_provisioner.dhcp.controllers import mod as dhcp_module
+    from mr_provisioner.httpboot.controllers import mod as httpboot_module
     from mr_provisioner.api.v1.controllers import mod as api_v1_module
 
     app.register_blueprint(admin_module, url_prefix='/admin')
@@ -39,6 +40,7 @@ def create_app(config_path=None):
     app.register_blueprint(preseed_module, url_prefix='/preseed')
     app.register_blueprint(tftp_module, url_prefix='/tftp')
     app.register_blueprint(dhcp_module, url_prefix='/dhcp')
+    app.register_blueprint(httpboot_module, url_prefix='/boot')
     app.register_blueprint(api_v1_module, url_prefix='/api/v1')
 
     @app.route('/')
@@ -71,12 +73,195 @@ def tornado(host, port):
     from tornado.wsgi import WSGIContainer
     from tornado.httpserver import HTTPServer
     from tornado.ioloop import IOLoop
+    from tornado.web import Application, FallbackHandler
+    from mr_provisioner.httpboot.static_handler import BootFileHandler
 
-    http_server = HTTPServer(WSGIContainer(manager.app))
+    application = Application([
+        (r"/boot/(.*)", BootFileHandler, {"path": manager.app.config['TFTP_ROOT']}),
+        (r".*", FallbackHandler, {"fallback": WSGIContainer(manager.app)}),
+    ])
+
+    http_server = HTTPServer(application)
     http_server.listen(port, address=host)
     IOLoop.instance().start()
 
 
+@manager.option("-h", "--host", dest="host", default="0.0.0.0")
+@manager.option("-p", "--port", dest="port", type=int, default=69)
+def tftp(host, port):
+    "Runs the built-in TFTP server"
+
+    from mr_provisioner.tftp.server import serve
+    serve(manager.app, host, port)
+
+
+@manager.option("-i", "--interval", dest="interval", type=int, default=3600,
+                help="prune every INTERVAL seconds")
+@manager.option("-o", "--once", dest="once", action="store_true", default=False,
+                help="prune once and exit")
+def prune_events(interval, once):
+    "Deletes machine events older than the configured retention window"
+
+    import time
+    import logging
+    from mr_provisioner.models import MachineEvent
+    from mr_provisioner import event_partitions
+
+    logger = logging.getLogger('events')
+    app = manager.app
+    while True:
+        with db.engine.begin() as connection:
+            if event_partitions.is_partitioned(connection):
+                for name in event_partitions.drop_expired_partitions(connection,
+                                                                     app.config['EVENTS_RETENTION_DAYS']):
+                    logger.info('dropped event partition %s' % name)
+
+        deleted = MachineEvent.prune(app.config['EVENTS_RETENTION_DAYS'],
+                                     app.config['EVENTS_PRUNE_BATCH_SIZE'])
+        logger.info('pruned %d machine events' % deleted)
+
+        if once:
+            break
+        time.sleep(interval)
+
+
+@manager.option("-i", "--interval", dest="interval", type=int, default=900,
+                help="sweep every INTERVAL seconds")
+@manager.option("-o", "--once", dest="once", action="store_true", default=False,
+                help="sweep once and exit")
+def sweep_leases(interval, once):
+    "Marks expired DHCP leases, deletes those and reservation tombstones past their retention window"
+
+    import time
+    import logging
+    from mr_provisioner.models import Lease, ReservationTombstone
+
+    logger = logging.getLogger('dhcp')
+    app = manager.app
+    while True:
+        expired, deleted = Lease.sweep(app.config['DHCP_LEASE_RETENTION_DAYS'],
+                                       app.config['DHCP_LEASE_SWEEP_BATCH_SIZE'])
+        logger.info('expired %d leases, deleted %d' % (expired, deleted))
+
+        pruned = ReservationTombstone.prune(app.config['DHCP_TOMBSTONE_RETENTION_DAYS'])
+        logger.info('pruned %d reservation tombstones' % pruned)
+
+        if once:
+            break
+        time.sleep(interval)
+
+
+@manager.option("-f", "--file", dest="path", default=None,
+                help="Kea lease file (default: [dhcp] kea_lease_file)")
+@manager.option("-s", "--state", dest="state_path", default=None,
+                help="where to keep the position in it (default: [dhcp] kea_lease_state_file)")
+@manager.option("-b", "--batch-size", dest="batch_size", type=int, default=5000,
+                help="leases per transaction")
+@manager.option("-i", "--interval", dest="interval", type=float, default=1.0,
+                help="seconds between checks for new leases")
+@manager.option("-o", "--once", dest="once", action="store_true", default=False,
+                help="read new leases once and exit")
+def tail_kea_leases(path, state_path, batch_size, interval, once):
+    "Stores leases appended to Kea's memfile lease file"
+
+    from mr_provisioner.dhcp.kea_leases import LeaseFileTailer
+
+    app = manager.app
+    tailer = LeaseFileTailer(path or app.config['DHCP_KEA_LEASE_FILE'],
+                             state_path or app.config['DHCP_KEA_LEASE_STATE_FILE'],
+                             batch_size=batch_size)
+    tailer.run(interval, once=once)
+
+
+@manager.option("-i", "--interval", dest="interval", type=float, default=5.0,
+                help="seconds between syncs")
+@manager.option("-o", "--once", dest="once", action="store_true", default=False,
+                help="sync once and exit")
+def sync_dnsmasq(interval, once):
+    "Writes host reservations to dnsmasq's dhcp-hostsdir and dhcp-optsdir"
+
+    import os
+    from mr_provisioner.dhcp.dnsmasq import DnsmasqSync
+
+    app = manager.app
+    for directory in (app.config['DNSMASQ_HOSTSDIR'], app.config['DNSMASQ_OPTSDIR']):
+        os.makedirs(directory, exist_ok=True)
+
+    DnsmasqSync(app.config['DNSMASQ_HOSTSDIR'],
+                app.config['DNSMASQ_OPTSDIR'],
+                pid_file=app.config['DNSMASQ_PID_FILE'] or None).run(interval, once=once)
+
+
+@manager.option("-i", "--interval", dest="interval", type=int, default=3600,
+                help="maintain partitions every INTERVAL seconds")
+@manager.option("-o", "--once", dest="once", action="store_true", default=False,
+                help="maintain partitions once and exit")
+def partition_events(interval, once):
+    "Creates upcoming machine event partitions and drops expired ones"
+
+    import time
+    from mr_provisioner import event_partitions
+
+    app = manager.app
+    while True:
+        with db.engine.begin() as connection:
+            if not event_partitions.is_partitioned(connection):
+                raise SystemExit('machine_event is not partitioned, see `db upgrade -x event_partitions=...`')
+
+            event_partitions.maintain(connection,
+                                      app.config['EVENTS_PARTITION_INTERVAL'],
+                                      app.config['EVENTS_PARTITIONS_AHEAD'],
+                                      app.config['EVENTS_RETENTION_DAYS'])
+
+        if once:
+            break
+        time.sleep(interval)
+
+
+@manager.option("-i", "--interval", dest="interval", type=int, default=None,
+                help="refresh every INTERVAL seconds (default: [power] poll_interval)")
+@manager.option("-o", "--once", dest="once", action="store_true", default=False,
+                help="refresh once and exit")
+def poll_power(interval, once):
+    "Periodically stores the power state of every machine with a BMC"
+
+    import time
+    import logging
+    from mr_provisioner.power import poll_power_states
+
+    logger = logging.getLogger('power')
+    app = manager.app
+    if interval is None:
+        interval = app.config['POWER_POLL_INTERVAL']
+
+    while True:
+        start = time.monotonic()
+        states = poll_power_states(timeout=max(interval, app.config['POWER_STATE_TIMEOUT']))
+        logger.info('refreshed power state of %d machines in %.1fs' % (len(states), time.monotonic() - start))
+
+        if once:
+            break
+        time.sleep(max(0, interval - (time.monotonic() - start)))
+
+
+@manager.option("-w", "--workers", dest="workers", type=int, default=None,
+                help="run up to WORKERS jobs at a time (default: [jobs] workers)")
+@manager.option("-i", "--interval", dest="interval", type=float, default=0.5,
+                help="check for new jobs every INTERVAL seconds when idle")
+@manager.option("-o", "--once", dest="once", action="store_true", default=False,
+                help="run the jobs queued right now and exit")
+def bmc_worker(workers, interval, once):
+    "Runs queued BMC jobs (power changes, provisioning) submitted through the API"
+
+    from mr_provisioner.jobs import JobWorker
+
+    app = manager.app
+    if workers is None:
+        workers = app.config['JOBS_WORKERS']
+
+    JobWorker(app, workers).run(interval, once=once)
+
+
 def main():
     manager.run()
 
@@ -12,8 +12,12 @@ from sqlalchemy.exc import IntegrityError
 from mr_provisioner import db
 from sqlalchemy.exc import DatabaseError
 from mr_provisioner.models import User, Token, Machine, Image, Preseed, BMC, MachineUsers, \
-    ConsoleToken, Interface, Network, DiscoveredMAC, Arch, Subarch, MachineEvent
+    ConsoleToken, Interface, Network, DiscoveredMAC, Arch, Subarch, MachineEvent, Job, BMCHealthState
 from mr_provisioner.bmc_types import BMCError
+from mr_provisioner.bmc_health import BMCHealth
+from mr_provisioner.bmc_scheduler import scheduler
+from mr_provisioner.power import PowerStateBatch, get_power_state, POWER_CHANGES
+from mr_provisioner.jobs import enqueue, enqueue_power_changes
 from mr_provisioner.util import trim_to_none
 
 from flask import current_app as app
@@ -123,6 +127,15 @@ def get_ws_subprocess_command():
     return Response(sol_token.command_response, mimetype='application/json')
 
 
+class BMCHealthType(graphene.ObjectType):
+    state = graphene.String()
+    consecutive_failures = graphene.Int()
+    last_success = graphene.types.datetime.DateTime()
+    last_failure = graphene.types.datetime.DateTime()
+    last_error = graphene.String()
+    latency = graphene.Float()
+
+
 class BMCType(graphene.ObjectType):
     id = graphene.ID()
     ip = graphene.String()
@@ -131,6 +144,11 @@ class BMCType(graphene.ObjectType):
     username = graphene.String()
     password = graphene.String()
     machines = graphene.Dynamic(lambda: graphene.List(MachineType))
+    health = graphene.Field(BMCHealthType)
+
+    def resolve_health(self, args, context, info):
+        # As stored by poll_power and bmc_worker; closed if they never saw it fail.
+        return BMCHealthState.query.get(self.id) or BMCHealth(self.id)
 
     def resolve_username(self, args, context, info):
         return self.username if self.check_permission(g.user, 'admin') else ""
@@ -153,6 +171,26 @@ class AvailableIPsType(graphene.ObjectType):
     reserved_ips = graphene.List(graphene.String)
 
 
+class JobType(graphene.ObjectType):
+    id = graphene.ID()
+    machine_id = graphene.Int()
+    action = graphene.String()
+    params = graphene.types.json.JSONString()
+    status = graphene.String()
+    result = graphene.types.json.JSONString()
+    error = graphene.String()
+    created_at = graphene.types.datetime.DateTime()
+    started_at = graphene.types.datetime.DateTime()
+    finished_at = graphene.types.datetime.DateTime()
+
+
+class MachinePowerResultType(graphene.ObjectType):
+    id = graphene.Int()
+    ok = graphene.Boolean()
+    error = graphene.String()
+    job_id = graphene.Int()
+
+
 class DiscoveredMACType(graphene.ObjectType):
     id = graphene.ID()
     mac = graphene.String()
@@ -201,6 +239,7 @@ class LeaseType(graphene.ObjectType):
     mac = graphene.String()
     ipv4 = graphene.String()
     last_seen = graphene.types.datetime.DateTime()
+    expires_at = graphene.types.datetime.DateTime()
 
 
 class InterfaceType(graphene.ObjectType):
@@ -265,10 +304,19 @@ class MachineType(graphene.ObjectType):
     netboot_enabled = graphene.Boolean()
     bmc = graphene.Field(BMCType)
     bmc_info = graphene.String()
-    power_state = graphene.String()
+    power_state = graphene.String(fresh=graphene.Boolean())
     arch = graphene.Dynamic(lambda: graphene.Field(ArchType))
     subarch = graphene.Dynamic(lambda: graphene.Field(SubarchType))
 
+    def resolve_power_state(self, args, context, info):
+        fresh = args.get('fresh', False)
+        # Machines listed by the `machines` query have their power state
+        # looked up all at once.
+        batch = getattr(g, 'power_state_batch', None)
+        if batch is not None and self in batch:
+            return batch.get(self, fresh)
+        return get_power_state(self, fresh=fresh)
+
 
 class SubarchType(graphene.ObjectType):
     id = graphene.ID()
@@ -701,6 +749,10 @@ class ChangeBMC(graphene.Mutation):
                 db.session.rollback()
                 return ChangeBMC(bmc=None, ok=False, errors=['A BMC with that name already exists'])
 
+            # It may well answer now.
+            scheduler.health.forget(bmc.id)
+            BMCHealthState.forget(bmc.id)
+
             return ChangeBMC(bmc=bmc, ok=True, errors=errors)
         else:
             return ChangeBMC(bmc=None, ok=False, errors=errors)
@@ -1053,12 +1105,13 @@ class MachineChangePower(graphene.Mutation):
     ok = graphene.Boolean()
     errors = graphene.List(graphene.String)
     machine = graphene.Field(MachineType)
+    job = graphene.Field(JobType)
 
     @staticmethod
     def validate(args, machine):
         errors = []
 
-        if not args.get('power_state') in ['on', 'off', 'reboot', 'pxe_reboot', 'disk_reboot', 'bios_reboot']:
+        if not args.get('power_state') in POWER_CHANGES:
             errors.append('Unknown power state: %s' % args.get('power_state'))
 
         if not machine.bmc:
@@ -1076,21 +1129,56 @@ class MachineChangePower(graphene.Mutation):
 
         ok, errors = MachineChangePower.validate(args, machine)
         if ok:
-            try:
-                if args.get('power_state') == 'reboot':
-                    machine.reboot()
-                else:
-                    machine.set_power(args.get('power_state'))
+            # Done by the bmc_worker; the job's status tells how it went.
+            job = enqueue(machine, g.user, 'power', {'state': args.get('power_state')})
+            return MachineChangePower(machine=machine, job=job, ok=True, errors=errors)
+        else:
+            return MachineChangePower(machine=machine, ok=False, errors=errors)
 
-                MachineEvent.power_changed(machine.id, g.user, args.get('power_state'))
 
-                return MachineChangePower(machine=machine, ok=True, errors=errors)
-            except BMCError as e:
-                errors.append('could not change power state: %s' % str(e))
-                return MachineChangePower(machine=machine, ok=False, errors=errors)
+class MachinesChangePower(graphene.Mutation):
+    class Input:
+        ids = graphene.List(graphene.Int)
+        query = graphene.String()
+        power_state = graphene.String()
 
+    ok = graphene.Boolean()
+    errors = graphene.List(graphene.String)
+    results = graphene.List(MachinePowerResultType)
+
+    @staticmethod
+    def validate(args):
+        errors = []
+
+        if not args.get('power_state') in POWER_CHANGES:
+            errors.append('Unknown power state: %s' % args.get('power_state'))
+
+        if (args.get('ids') is None) == (args.get('query') is None):
+            errors.append('exactly one of ids or query is required')
+
+        return (len(errors) == 0, errors)
+
+    @staticmethod
+    def mutate(root, args, context, info):
+        ok, errors = MachinesChangePower.validate(args)
+        if not ok:
+            return MachinesChangePower(results=[], ok=False, errors=errors)
+
+        if args.get('query') is not None:
+            machines = Machine.query_by_criteria(args.get('query')).all()
+        elif args.get('ids'):
+            machines = Machine.query.filter(Machine.id.in_(args.get('ids'))).all()
         else:
-            return MachineChangePower(machine=machine, ok=False, errors=errors)
+            machines = []
+
+        results = enqueue_power_changes(machines, g.user, args.get('power_state'))
+        errors = ['machine %d: %s' % (machine_id, error)
+                  for machine_id, (job, error) in sorted(results.items()) if error]
+
+        return MachinesChangePower(results=[MachinePowerResultType(id=machine_id, ok=error is None, error=error,
+                                                                   job_id=job.id if job else None)
+                                            for machine_id, (job, error) in sorted(results.items())],
+                                   ok=len(errors) == 0, errors=errors)
 
 
 class AddMachineInterface(graphene.Mutation):
@@ -2251,6 +2339,8 @@ class Query(graphene.ObjectType):
 
     available_ips = graphene.Field(AvailableIPsType, network_id=graphene.Int(), limit=graphene.Int())
 
+    job = graphene.Field(JobType, id=graphene.Int())
+
     def resolve_own_user(self, args, context, info):
         return g.user
 
@@ -2261,7 +2351,9 @@ class Query(graphene.ObjectType):
         return User.query.get(args['id'])
 
     def resolve_machines(self, args, context, info):
-        return Machine.query.all()
+        machines = Machine.query.all()
+        g.power_state_batch = PowerStateBatch(machines)
+        return machines
 
     def resolve_machine(self, args, context, info):
         return Machine.query.get(args['id'])
@@ -2335,6 +2427,13 @@ class Query(graphene.ObjectType):
 
         return AvailableIPsType(static_ips=static_ips, reserved_ips=reserved_ips)
 
+    def resolve_job(self, args, context, info):
+        job = Job.query.get(args['id'])
+        if not job or not job.check_permission(g.user):
+            # XXX: abort 403?
+            return None
+        return job
+
 
 class CreateUser(graphene.Mutation):
     class Input:
@@ -2561,6 +2660,7 @@ class Mutation(graphene.ObjectType):
     delete_machine_assignee = DeleteMachineAssignee.Field()
     machine_reset_console = MachineResetConsole.Field()
     machine_change_power = MachineChangePower.Field()
+    machines_change_power = MachinesChangePower.Field()
 
     create_bmc = CreateBMC.Field()
     change_bmc = ChangeBMC.Field()
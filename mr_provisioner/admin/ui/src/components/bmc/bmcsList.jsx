@@ -17,6 +17,12 @@ import * as comparators from '../../util/comparators'
 const sortByName = comparators.string(['name'])
 const sortByIp = comparators.string(['ip'])
 const sortByType = comparators.string(['bmcType'])
+const sortByHealth = comparators.string(['health', 'state'])
+
+const healthText = b =>
+  b.health.state === 'closed'
+    ? b.health.consecutiveFailures > 0 ? `OK (${b.health.lastError})` : 'OK'
+    : `Unreachable (${b.health.lastError})`
 
 class BmcsList_ extends React.Component {
   render() {
@@ -47,6 +53,11 @@ class BmcsList_ extends React.Component {
             sortFn={sortByType}
             cell={<TextCell col="bmcType" />}
           />
+          <TableColumn
+            label="Health"
+            sortFn={sortByHealth}
+            cell={<TextCell textFn={healthText} />}
+          />
         </Table>
 
         <Button icon={<AddIcon />} label="Add a BMC" onClick={props.openForm} />
@@ -30,7 +30,7 @@ import { Table, TableColumn, LinkCell, TextCell, AnyCell } from '../table'
 import Layer from '../layer'
 import { NetworkLoading, NetworkError } from '../network'
 import { withApolloStatus } from '../../hoc/apollo'
-import { graphql } from 'react-apollo'
+import { graphql, withApollo } from 'react-apollo'
 import { withState, withHandlers, withProps, compose } from 'recompose'
 import { parse } from 'query-string'
 import { connect } from 'react-redux'
@@ -42,6 +42,7 @@ import {
   machineChangePowerGQL,
   machineEventLogGQL,
 } from '../../graphql/machine'
+import { jobGQL } from '../../graphql/job'
 import * as messageActions from '../../actions/message'
 import MachineEditOverview from './machineEditOverview'
 import MachineEditProvisioning from './machineEditProvisioning'
@@ -58,6 +59,10 @@ import withLayerState from '../../hoc/withLayerState'
 import { BMCInfo } from './bmcInfoField'
 import * as comparators from '../../util/comparators'
 
+const jobPollInterval = 2000
+// Give up waiting for a power change job after this long
+const jobMaxWait = 60000
+
 function MachineOverview({ machine, onEdit }) {
   return (
     <Section>
@@ -558,6 +563,19 @@ class Machine_ extends React.Component {
       })
   }
 
+  // Power changes are run by the bmc_worker; poll the job until it is done.
+  waitForJob = (id, deadline = Date.now() + jobMaxWait) =>
+    this.props.client
+      .query({ query: jobGQL, variables: { id }, fetchPolicy: 'network-only' })
+      .then(({ data: { job } }) => {
+        if (!job) return { status: 'failed', error: 'job not found' }
+        if (job.status === 'done' || job.status === 'failed') return job
+        if (Date.now() >= deadline) return job
+        return new Promise(resolve =>
+          setTimeout(resolve, jobPollInterval)
+        ).then(() => this.waitForJob(id, deadline))
+      })
+
   handleChangePower = powerState => {
     const { actions, data } = this.props
 
@@ -568,23 +586,37 @@ class Machine_ extends React.Component {
           powerState,
         },
       })
-      .then(({ data: { machineChangePower: { ok, machine, errors } } }) => {
-        if (ok && errors.length > 0)
-          actions.showWarningMessage(
-            `Power state for ${machine.name} changed, but: ${errors.join(
-              ', '
-            )}.`
-          )
-        else if (ok)
-          actions.showOkMessage(
-            `Power state for ${machine.name} changed successfully.`
-          )
-        else
+      .then(({ data: { machineChangePower } }) => {
+        const { ok, machine, job, errors } = machineChangePower
+        if (!ok) {
           actions.showErrorMessage(
             `Error changing power state for machine ${machine.name}: ${errors.join(
               ', '
             )}.`
           )
+          return
+        }
+
+        actions.showOkMessage(`Power state change for ${machine.name} queued.`)
+        return this.waitForJob(job.id).then(({ status, error }) => {
+          if (status === 'done')
+            actions.showOkMessage(
+              `Power state for ${machine.name} changed successfully.`
+            )
+          else if (status === 'queued')
+            actions.showWarningMessage(
+              `Power state change for ${machine.name} still queued - is bmc_worker running?`
+            )
+          else if (status === 'running')
+            actions.showWarningMessage(
+              `Power state change for ${machine.name} still running.`
+            )
+          else
+            actions.showErrorMessage(
+              `Error changing power state for machine ${machine.name}: ${error}.`
+            )
+          data.refetch()
+        })
       })
       .catch(error => {
         actions.showErrorMessage(error.message || error)
@@ -887,6 +919,7 @@ export const Machine = compose(
       ],
     }),
   }),
+  withApollo,
   connect(null, mapDispatchToProps),
   withOwnUser(),
   withProps(ownProps => ({
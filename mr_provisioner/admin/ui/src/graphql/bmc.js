@@ -24,6 +24,11 @@ export const bmcsListGQL = gql`
       name
       ip
       bmcType
+      health {
+        state
+        consecutiveFailures
+        lastError
+      }
     }
   }
 `
@@ -0,0 +1,11 @@
+import { gql } from 'react-apollo'
+
+export const jobGQL = gql`
+  query($id: Int!) {
+    job(id: $id) {
+      id
+      status
+      error
+    }
+  }
+`
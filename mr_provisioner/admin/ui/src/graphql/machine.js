@@ -95,6 +95,10 @@ export const machineChangePowerGQL = gql`
         id
         name
       }
+      job {
+        id
+        status
+      }
     }
   }
 `
@@ -4,9 +4,12 @@ import logging
 
 from mr_provisioner import db
 from mr_provisioner.models import Interface, Machine, Image, Preseed, User, Token, MachineUsers, \
-    ConsoleToken, Arch, Subarch, MachineEvent
+    ConsoleToken, Arch, Subarch, MachineEvent, Job
 from mr_provisioner.bmc_types import BMCError
+from mr_provisioner.power import get_power_state, POWER_CHANGES
+from mr_provisioner.jobs import enqueue, enqueue_power_changes
 from sqlalchemy.exc import DatabaseError, IntegrityError
+from sqlalchemy.orm import joinedload
 
 from flask import current_app as app
 
@@ -56,6 +59,21 @@ def serialize_machine(machine):
     }
 
 
+def serialize_job(job):
+    return {
+        'id': job.id,
+        'machine_id': job.machine_id,
+        'action': job.action,
+        'params': job.params,
+        'status': job.status,
+        'result': job.result,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
 def serialize_image(image):
     return {
         'id': image.id,
@@ -84,6 +102,7 @@ def serialize_preseed(preseed):
 
 
 def serialize_interface(interface):
+    lease = interface.lease
     return {
         'id': interface.id,
         'identifier': interface.identifier,
@@ -96,8 +115,8 @@ def serialize_interface(interface):
         'reserved_pool_v4': interface.network.reserved_net if interface.network else None,
         'config_type_v4': interface.config_type_v4,
         'configured_ipv4': interface.configured_ipv4,
-        'lease_ipv4': interface.lease.ipv4 if interface.lease else None,
-        'last_seen_date': interface.lease.last_seen if interface.lease else None,
+        'lease_ipv4': lease.ipv4 if lease else None,
+        'last_seen_date': lease.last_seen if lease else None,
     }
 
 
@@ -128,10 +147,17 @@ machine_schema = Schema({
 
 
 machine_power_schema = Schema({
-    'state': And(str, lambda s: s in ('on', 'off', 'reboot', 'pxe_reboot', 'bios_reboot', 'disk_reboot')),
+    'state': And(str, lambda s: s in POWER_CHANGES),
 })
 
 
+machines_power_schema = Schema({
+    'state': And(str, lambda s: s in POWER_CHANGES),
+    Optional('machines'): [Use(int)],
+    Optional('q'): And(str, lambda s: validators.length(s, min=0, max=300)),
+}, ignore_extra_keys=True)
+
+
 machine_state_post_schema = Schema({
     'state': And(str, lambda s: s in ('provision')),
 })
@@ -540,7 +566,9 @@ def machine_power_get(id):
     if not machine:
         raise InvalidUsage('machine not found', status_code=404)
 
-    return jsonify({'state': machine.power_state}), 200
+    fresh = True if request.args.get('fresh', 'false').lower() == 'true' else False
+
+    return jsonify({'state': get_power_state(machine, fresh=fresh)}), 200
 
 
 @mod.route('/machine/<int:id>/power', methods=['POST'])
@@ -558,11 +586,39 @@ def machine_power_post(id):
     if not machine.bmc:
         raise InvalidUsage('power state changes require a BMC', status_code=400)
 
-    machine.set_power(data['state'])
+    job = enqueue(machine, g.user, 'power', {'state': data['state']})
+
+    return jsonify({'state': data['state'], 'job_id': job.id}), 202, \
+        {'Location': url_for('.job_get', id=job.id)}
 
-    MachineEvent.power_changed(machine.id, g.user, data['state'])
 
-    return jsonify({'state': machine.power_state}), 202
+@mod.route('/machine/power', methods=['POST'])
+def machines_power_post():
+    data = request.get_json(force=True)
+    data = machines_power_schema.validate(data)
+
+    if ('machines' in data) == ('q' in data):
+        raise InvalidUsage('exactly one of machines or q is required', status_code=400)
+
+    if 'q' in data:
+        q = Machine.query_by_criteria(data['q'])
+    else:
+        q = Machine.query.filter(Machine.id.in_(data['machines'])) if data['machines'] else None
+
+    machines = q.options(joinedload(Machine.bmc)).all() if q else []
+
+    results = {}
+    for machine_id, (job, error) in enqueue_power_changes(machines, g.user, data['state']).items():
+        if job:
+            results[machine_id] = {'id': machine_id, 'ok': True, 'error': None, 'job_id': job.id}
+        else:
+            results[machine_id] = {'id': machine_id, 'ok': False, 'error': error}
+
+    if 'machines' in data:
+        for machine_id in set(data['machines']) - set(results):
+            results[machine_id] = {'id': machine_id, 'ok': False, 'error': 'machine not found'}
+
+    return jsonify({'state': data['state'], 'results': [results[k] for k in sorted(results)]}), 202
 
 
 @mod.route('/machine/reservation', methods=['POST'])
@@ -638,13 +694,13 @@ def machine_state_post(id):
         db.session.commit()
         db.session.refresh(machine)
 
-        machine.set_power('pxe_reboot')
+        job = enqueue(machine, g.user, 'provision')
 
         MachineEvent.state_changed(machine.id, g.user, machine.state, "api")
     else:
         return '', 400
 
-    return jsonify({'state': machine.state}), 202
+    return jsonify({'state': machine.state, 'job_id': job.id}), 202, {'Location': url_for('.job_get', id=job.id)}
 
 
 @mod.route('/machine/<int:id>/state', methods=['PUT'])
@@ -696,6 +752,18 @@ def machine_console_post(id):
     })
 
 
+@mod.route('/job/<int:id>', methods=['GET'])
+def job_get(id):
+    job = Job.query.get(id)
+    if not job:
+        raise InvalidUsage('job not found', status_code=404)
+
+    if not job.check_permission(g.user):
+        return '', 403
+
+    return jsonify(serialize_job(job)), 200
+
+
 @mod.route('/preseed', methods=['GET'])
 def preseeds_get():
     show_all = True if request.args.get('show_all', 'false').lower() == 'true' else False
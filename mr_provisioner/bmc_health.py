@@ -0,0 +1,144 @@
+"""
+BMC health tracking and circuit breaking.
+
+A BMC that is down makes every operation against it wait for the full
+ipmitool (or native client) timeout, and a listing of many machines behind
+it pays that over and over. The scheduler therefore keeps, per BMC, the
+number of consecutive failures, when it last answered and how long recent
+operations took.
+
+After `threshold` consecutive failures ([power] breaker_threshold) the
+breaker opens: operations on that BMC fail straight away with
+BMCUnreachable instead of being run. Once `cooldown` seconds ([power]
+breaker_cooldown) have passed, the next operation submitted still fails
+fast but also queues a power state query as a probe (half-open); if the
+probe succeeds the breaker closes again, otherwise it stays open for
+another cooldown.
+
+Breakers are per process, like the scheduler queues. For the fleet-wide
+view, poll_power and bmc_worker store the health of the BMCs they talked to
+in the bmc_health table (BMCHealthState), which is what the admin UI shows.
+"""
+
+import copy
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from mr_provisioner.bmc_types import BMCError
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+LATENCY_WINDOW = 20
+
+
+class BMCUnreachable(BMCError):
+    pass
+
+
+class BMCHealth:
+    def __init__(self, bmc_id):
+        self.bmc_id = bmc_id
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.last_success = None
+        self.last_failure = None
+        self.last_error = None
+        self.opened_at = None
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    @property
+    def latency(self):
+        """Mean duration, in seconds, of the last LATENCY_WINDOW operations."""
+        if not self.latencies:
+            return None
+        return sum(self.latencies) / len(self.latencies)
+
+    def copy(self):
+        health = copy.copy(self)
+        health.latencies = deque(self.latencies, maxlen=LATENCY_WINDOW)
+        return health
+
+
+class HealthTracker:
+    def __init__(self, threshold=3, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._health = {}
+        self._changed = set()
+
+    def get(self, bmc_id):
+        """Health of BMC bmc_id; a fresh, closed one if nothing ran against it yet."""
+        with self._lock:
+            return self._health.get(bmc_id) or BMCHealth(bmc_id)
+
+    def _health_of(self, bmc_id):
+        health = self._health.get(bmc_id)
+        if health is None:
+            health = self._health[bmc_id] = BMCHealth(bmc_id)
+        return health
+
+    def forget(self, bmc_id):
+        """Start afresh with bmc_id, e.g. after its address or credentials changed."""
+        with self._lock:
+            self._health.pop(bmc_id, None)
+            self._changed.discard(bmc_id)
+
+    def clear(self):
+        with self._lock:
+            self._health.clear()
+            self._changed.clear()
+
+    def changed(self):
+        """Copies of the health of the BMCs that changed since the last call, to store them."""
+        with self._lock:
+            changed = [self._health[bmc_id].copy() for bmc_id in self._changed]
+            self._changed.clear()
+        return changed
+
+    def check(self, bmc_id):
+        """
+        Whether operations may run against bmc_id. Returns (allowed, probe):
+        probe is True when the breaker just went half-open and the caller
+        should queue a probe.
+        """
+        with self._lock:
+            health = self._health.get(bmc_id)
+            if health is None or health.state == CLOSED:
+                return True, False
+            if health.state == OPEN and time.monotonic() - health.opened_at >= self.cooldown:
+                health.state = HALF_OPEN
+                self._changed.add(bmc_id)
+                return False, True
+            return False, False
+
+    def unreachable(self, bmc_id):
+        with self._lock:
+            error = self._health_of(bmc_id).last_error
+        return BMCUnreachable('BMC error: BMC unreachable (%s)' % error)
+
+    def record_success(self, bmc_id, duration):
+        with self._lock:
+            health = self._health_of(bmc_id)
+            health.state = CLOSED
+            health.consecutive_failures = 0
+            health.last_success = datetime.utcnow()
+            health.latencies.append(duration)
+            self._changed.add(bmc_id)
+
+    def record_failure(self, bmc_id, duration, error):
+        with self._lock:
+            health = self._health_of(bmc_id)
+            health.consecutive_failures += 1
+            health.last_failure = datetime.utcnow()
+            health.last_error = str(error)
+            health.latencies.append(duration)
+            if health.state == HALF_OPEN or health.consecutive_failures >= self.threshold:
+                health.state = OPEN
+                health.opened_at = time.monotonic()
+            self._changed.add(bmc_id)
@@ -0,0 +1,243 @@
+"""
+Scheduling of BMC operations.
+
+Every BMC call (power state queries and changes, boot device changes, SOL
+deactivation) goes through the scheduler instead of being run directly by
+whichever thread needs it. Each BMC gets its own queue, of which at most
+`max_concurrency` operations (see BMCType.max_concurrency, [power]
+per_bmc_concurrency) run at a time, so that e.g. a Moonshot chassis BMC is
+not hit by as many sessions as there are cartridges being looked at. A
+shared pool of `POWER_MAX_WORKERS` threads serves the queues round-robin, so
+one busy BMC does not hold up the others.
+
+Read-only operations can be coalesced: a power state query for a machine
+that already has one queued shares its result instead of asking the BMC
+again. Anything submitted without a coalescing name is assumed to change
+state and stops later reads from being merged into earlier ones.
+
+Every operation's outcome feeds the BMC's health (see bmc_health): once a
+BMC has failed repeatedly, operations against it fail fast until a
+background probe finds it answering again.
+
+Workers never touch the ORM: they are handed detached snapshots of the
+machine and BMC attributes the BMC types need.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+from types import SimpleNamespace
+
+from flask import current_app
+
+from mr_provisioner.bmc_health import HealthTracker
+from mr_provisioner.bmc_types import BMCError, resolve_bmc_type
+
+
+logger = logging.getLogger('bmc_scheduler')
+
+
+class SchedulerTimeout(BMCError):
+    pass
+
+
+def snapshot(machine):
+    """Return a detached copy of what BMC operations on machine need, or None without a BMC."""
+    bmc = machine.bmc
+    if not bmc:
+        return None
+
+    subarch = machine.subarch
+    return SimpleNamespace(
+        id=machine.id,
+        bmc_info=machine.bmc_info,
+        subarch=SimpleNamespace(efiboot=subarch.efiboot) if subarch else None,
+        bmc=SimpleNamespace(id=bmc.id, ip=bmc.ip, username=bmc.username, password=bmc.password,
+                            privilege_level=bmc.privilege_level, bmc_type=bmc.bmc_type))
+
+
+def _probe(machine):
+    return resolve_bmc_type(machine.bmc.bmc_type).get_power(machine)
+
+
+class _Op:
+    __slots__ = ('fn', 'machine', 'coalesce', 'deadline', 'probe', 'future')
+
+    def __init__(self, fn, machine, coalesce, deadline, probe=False):
+        self.fn = fn
+        self.machine = machine
+        self.coalesce = coalesce
+        self.deadline = deadline
+        self.probe = probe
+        self.future = Future()
+
+
+class BMCScheduler:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._workers = []
+        self._queues = {}     # BMC id -> deque of _Op
+        self._active = {}     # BMC id -> number of running ops
+        self._limits = {}     # BMC id -> max concurrency
+        self._ready = deque()  # BMC ids with queued ops and a free slot, in serving order
+        self._ready_set = set()
+        self._coalescable = {}  # machine id -> {coalescing name: queued _Op}
+        self.coalesced = 0
+        self.health = HealthTracker()
+
+    def start(self, workers):
+        with self._cond:
+            while len(self._workers) < workers:
+                thread = threading.Thread(target=self._run, name='bmc-scheduler-%d' % len(self._workers),
+                                          daemon=True)
+                self._workers.append(thread)
+                thread.start()
+
+    def _ensure_started(self):
+        if not self._workers:
+            self.health.threshold = current_app.config['POWER_BREAKER_THRESHOLD']
+            self.health.cooldown = current_app.config['POWER_BREAKER_COOLDOWN']
+            self.start(current_app.config['POWER_MAX_WORKERS'])
+
+    def _mark_ready(self, bmc_id):
+        if bmc_id not in self._ready_set and self._queues.get(bmc_id) and \
+           self._active.get(bmc_id, 0) < self._limits[bmc_id]:
+            self._ready.append(bmc_id)
+            self._ready_set.add(bmc_id)
+            self._cond.notify()
+
+    def _enqueue(self, op):
+        bmc_id = op.machine.bmc.id
+        self._limits[bmc_id] = resolve_bmc_type(op.machine.bmc.bmc_type).max_concurrency
+        self._queues.setdefault(bmc_id, deque()).append(op)
+        self._mark_ready(bmc_id)
+
+    def _unreachable(self, machine, probe):
+        """Fail fast for machine's BMC, queueing a probe of it if one is due."""
+        if probe:
+            with self._cond:
+                self._enqueue(_Op(_probe, machine, None, None, probe=True))
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+        future.set_exception(self.health.unreachable(machine.bmc.id))
+        return future
+
+    def submit(self, fn, machine, *, coalesce=None, deadline=None):
+        """
+        Queue fn(machine) on machine's BMC; machine must be a snapshot.
+        Returns a Future. Ops still queued at deadline (a time.monotonic()
+        value) fail with SchedulerTimeout without being run. With coalesce
+        set, an op of the same name already queued for the machine is
+        reused. While the BMC's breaker is open, the Future fails with
+        BMCUnreachable straight away.
+        """
+        self._ensure_started()
+
+        allowed, probe = self.health.check(machine.bmc.id)
+        if not allowed:
+            return self._unreachable(machine, probe)
+
+        with self._cond:
+            pending = self._coalescable.get(machine.id, {})
+            if coalesce is not None and coalesce in pending:
+                op = pending[coalesce]
+                if op.deadline is not None:
+                    op.deadline = None if deadline is None else max(op.deadline, deadline)
+                self.coalesced += 1
+                return op.future
+
+            op = _Op(fn, machine, coalesce, deadline)
+            if coalesce is not None:
+                self._coalescable.setdefault(machine.id, {})[coalesce] = op
+            else:
+                # Reads queued before this op must not answer for reads
+                # submitted after it.
+                self._coalescable.pop(machine.id, None)
+
+            self._enqueue(op)
+            return op.future
+
+    def _next(self):
+        with self._cond:
+            while not self._ready:
+                self._cond.wait()
+
+            bmc_id = self._ready.popleft()
+            self._ready_set.discard(bmc_id)
+            op = self._queues[bmc_id].popleft()
+            self._active[bmc_id] = self._active.get(bmc_id, 0) + 1
+
+            pending = self._coalescable.get(op.machine.id)
+            if pending is not None and pending.get(op.coalesce) is op:
+                del pending[op.coalesce]
+                if not pending:
+                    del self._coalescable[op.machine.id]
+
+            # Back of the line, behind the other BMCs
+            self._mark_ready(bmc_id)
+            return bmc_id, op
+
+    def _finish(self, bmc_id):
+        with self._cond:
+            self._active[bmc_id] -= 1
+            if not self._queues[bmc_id] and not self._active[bmc_id]:
+                del self._queues[bmc_id]
+                del self._active[bmc_id]
+            else:
+                self._mark_ready(bmc_id)
+
+    def _run(self):
+        while True:
+            bmc_id, op = self._next()
+            try:
+                if not op.future.set_running_or_notify_cancel():
+                    continue
+                if op.deadline is not None and time.monotonic() > op.deadline:
+                    op.future.set_exception(SchedulerTimeout('BMC error: timed out waiting for the BMC'))
+                    continue
+
+                if not op.probe:
+                    # The breaker may have opened while this was queued.
+                    allowed, probe = self.health.check(bmc_id)
+                    if not allowed:
+                        op.future.set_exception(self._unreachable(op.machine, probe).exception())
+                        continue
+
+                start = time.monotonic()
+                try:
+                    result = op.fn(op.machine)
+                except BaseException as e:
+                    if op.probe or isinstance(e, BMCError):
+                        self.health.record_failure(bmc_id, time.monotonic() - start, e)
+                    op.future.set_exception(e)
+                else:
+                    self.health.record_success(bmc_id, time.monotonic() - start)
+                    op.future.set_result(result)
+            finally:
+                self._finish(bmc_id)
+
+
+scheduler = BMCScheduler()
+
+
+def call(machine, fn, *, coalesce=None, timeout=None):
+    """
+    Run fn(snapshot of machine) through the scheduler and wait for it, for
+    at most timeout seconds (default POWER_CHANGE_TIMEOUT). Raises
+    SchedulerTimeout if it did not complete in time.
+    """
+    if timeout is None:
+        timeout = current_app.config['POWER_CHANGE_TIMEOUT']
+
+    snap = snapshot(machine)
+    if snap is None:
+        raise BMCError('BMC error: no BMC configured')
+
+    future = scheduler.submit(fn, snap, coalesce=coalesce, deadline=time.monotonic() + timeout)
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        raise SchedulerTimeout('BMC error: timed out waiting for the BMC')
@@ -2,7 +2,21 @@ import importlib
 
 
 class BMCType:
-    pass
+    # One of mr_provisioner.ipmi.BACKENDS, see [ipmi] backend
+    ipmi_backend = 'ipmitool'
+    # Operations run against one BMC at a time, see bmc_scheduler; None
+    # means [power] per_bmc_concurrency.
+    max_concurrency = None
+
+    def boot_and_reset(self, machine, bootdev):
+        """
+        Set the boot device, then reset the machine if it is on or power it
+        on otherwise. Returns the final power state. BMC types should
+        override this to do it in fewer round trips.
+        """
+        self.set_bootdev(machine, bootdev)
+        self.set_power(machine, 'reset' if self.get_power(machine) == 'on' else 'on')
+        return self.get_power(machine)
 
 
 class BMCError(Exception):
@@ -1,8 +1,13 @@
 from mr_provisioner.bmc_types import register_bmc_type, BMCType, BMCError
-from mr_provisioner.ipmi import get_power, set_power, set_bootdev, get_sol_command, deactivate_sol, IPMIError
+from mr_provisioner.ipmi import get_power, set_power, set_bootdev, boot_and_reset, get_sol_command, deactivate_sol, \
+    IPMIError
 
 
 class MoonshotBMC(BMCType):
+    # All cartridges of a chassis are reached through the one chassis BMC,
+    # which copes badly with concurrent sessions.
+    max_concurrency = 1
+
     @property
     def name(self):
         return "moonshot"
@@ -34,11 +39,27 @@ class MoonshotBMC(BMCType):
             opts = "efiboot"
 
         try:
-            set_bootdev(bootdev, opts, host=bmc.ip, username=bmc.username, password=bmc.password,
+            set_bootdev(bootdev, opts, backend=self.ipmi_backend,
+                        host=bmc.ip, username=bmc.username, password=bmc.password,
                         bridge_info=self.get_bridge_info(machine))
         except IPMIError as e:
             raise BMCError("BMC error: %s" % str(e))
 
+    def boot_and_reset(self, machine, bootdev):
+        bmc = machine.bmc
+
+        opts = None
+        if machine.subarch and machine.subarch.efiboot:
+            opts = "efiboot"
+
+        try:
+            # See set_power for why this cycles rather than resets
+            return boot_and_reset(bootdev, opts, reset="cycle", backend=self.ipmi_backend,
+                                  host=bmc.ip, username=bmc.username, password=bmc.password,
+                                  bridge_info=self.get_bridge_info(machine))
+        except IPMIError as e:
+            raise BMCError("BMC error: %s" % str(e))
+
     def set_power(self, machine, power_state):
         bmc = machine.bmc
         try:
@@ -46,7 +67,7 @@ class MoonshotBMC(BMCType):
             # "chassis power cycle" reboots machine everytime
             if power_state == "reset":
                 power_state = "cycle"
-            set_power(power_state, host=bmc.ip, username=bmc.username, password=bmc.password,
+            set_power(power_state, backend=self.ipmi_backend, host=bmc.ip, username=bmc.username, password=bmc.password,
                       bridge_info=self.get_bridge_info(machine))
         except IPMIError as e:
             raise BMCError("BMC error: %s" % str(e))
@@ -54,7 +75,7 @@ class MoonshotBMC(BMCType):
     def get_power(self, machine):
         bmc = machine.bmc
         try:
-            return get_power(host=bmc.ip, username=bmc.username, password=bmc.password,
+            return get_power(backend=self.ipmi_backend, host=bmc.ip, username=bmc.username, password=bmc.password,
                              bridge_info=self.get_bridge_info(machine))
         except IPMIError as e:
             raise BMCError("BMC error: %s" % str(e))
@@ -1,5 +1,6 @@
 from mr_provisioner.bmc_types import register_bmc_type, BMCType, BMCError
-from mr_provisioner.ipmi import get_power, set_power, set_bootdev, deactivate_sol, get_sol_command, IPMIError
+from mr_provisioner.ipmi import get_power, set_power, set_bootdev, boot_and_reset, deactivate_sol, get_sol_command, \
+    IPMIError
 
 
 class PlainBMC(BMCType):
@@ -18,21 +19,35 @@ class PlainBMC(BMCType):
             opts = "efiboot"
 
         try:
-            set_bootdev(bootdev, opts, host=bmc.ip, username=bmc.username, password=bmc.password)
+            set_bootdev(bootdev, opts, backend=self.ipmi_backend,
+                        host=bmc.ip, username=bmc.username, password=bmc.password)
+        except IPMIError as e:
+            raise BMCError("BMC error: %s" % str(e))
+
+    def boot_and_reset(self, machine, bootdev):
+        bmc = machine.bmc
+
+        opts = None
+        if machine.subarch and machine.subarch.efiboot:
+            opts = "efiboot"
+
+        try:
+            return boot_and_reset(bootdev, opts, backend=self.ipmi_backend,
+                                  host=bmc.ip, username=bmc.username, password=bmc.password)
         except IPMIError as e:
             raise BMCError("BMC error: %s" % str(e))
 
     def set_power(self, machine, power_state):
         bmc = machine.bmc
         try:
-            set_power(power_state, host=bmc.ip, username=bmc.username, password=bmc.password)
+            set_power(power_state, backend=self.ipmi_backend, host=bmc.ip, username=bmc.username, password=bmc.password)
         except IPMIError as e:
             raise BMCError("BMC error: %s" % str(e))
 
     def get_power(self, machine):
         bmc = machine.bmc
         try:
-            return get_power(host=bmc.ip, username=bmc.username, password=bmc.password)
+            return get_power(backend=self.ipmi_backend, host=bmc.ip, username=bmc.username, password=bmc.password)
         except IPMIError as e:
             raise BMCError("BMC error: %s" % str(e))
 
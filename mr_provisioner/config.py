@@ -3,9 +3,12 @@ import os
 import logging
 import configparser
 import sys
+from urllib.parse import urlparse
 
 from jinja2 import Environment, FileSystemLoader
-from mr_provisioner.ipmi import set_ipmitool
+from mr_provisioner import ipmi_lanplus
+from mr_provisioner.bmc_types import list_bmc_types
+from mr_provisioner.ipmi import set_ipmitool, set_ipmitool_timeout, BACKENDS
 
 _basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 _pydir = os.path.abspath(os.path.dirname(__file__))
@@ -58,11 +61,31 @@ def apply_config(app, config_file):
     except configparser.Error:
         pass
 
+    set_ipmitool_timeout(float(config.get('tools', 'ipmitool_timeout', fallback=30)))
+
+    ipmi_backend = config.get('ipmi', 'backend', fallback='ipmitool')
+    for bmc_type in list_bmc_types():
+        bmc_type.ipmi_backend = config.get('ipmi', '%s_backend' % bmc_type.name, fallback=ipmi_backend)
+        if bmc_type.ipmi_backend not in BACKENDS:
+            raise ValueError('unknown IPMI backend %s for %s BMCs' % (bmc_type.ipmi_backend, bmc_type.name))
+
+    per_bmc_concurrency = int(config.get('power', 'per_bmc_concurrency', fallback=2))
+    for bmc_type in list_bmc_types():
+        bmc_type.max_concurrency = int(config.get('power', '%s_per_bmc_concurrency' % bmc_type.name,
+                                                  fallback=type(bmc_type).max_concurrency or per_bmc_concurrency))
+
+    ipmi_lanplus.configure(cipher_suite=int(config.get('ipmi', 'cipher_suite', fallback=3)),
+                           timeout=float(config.get('ipmi', 'timeout', fallback=1.0)),
+                           retries=int(config.get('ipmi', 'retries', fallback=3)),
+                           session_max_idle=float(config.get('ipmi', 'session_max_idle', fallback=30)))
+
     try:
         db_uri = os.environ['APP_DATABASE_URI']
     except KeyError:
         db_uri = config.get('database', 'uri')
 
+    controller_access_uri = config.get('controller', 'access_uri', fallback='http://127.0.0.1:5000')
+
     # Config settings used by app itself
     app.config.update(
         VERSION=version,
@@ -71,10 +94,43 @@ def apply_config(app, config_file):
         TFTP_ROOT=config.get('files', 'tftp_root', fallback='/tmp'),
         DHCP_TFTP_PROXY_HOST=config.get('dhcp', 'tftp_proxy_host', fallback='127.0.0.1'),
         DHCP_DEFAULT_BOOTFILE=config.get('dhcp', 'default_bootfile', fallback=''),
+        DHCP_SEEN_WRITE_INTERVAL=float(config.get('dhcp', 'seen_write_interval', fallback=300)),
+        DHCP_SEEN_FLUSH_INTERVAL=float(config.get('dhcp', 'seen_flush_interval', fallback=30)),
+        DHCP_LEASE_RETENTION_DAYS=int(config.get('dhcp', 'lease_retention_days', fallback=7)),
+        DHCP_LEASE_SWEEP_BATCH_SIZE=int(config.get('dhcp', 'lease_sweep_batch_size', fallback=5000)),
+        DHCP_TOMBSTONE_RETENTION_DAYS=int(config.get('dhcp', 'tombstone_retention_days', fallback=30)),
+        DHCP_KEA_LEASE_FILE=config.get('dhcp', 'kea_lease_file', fallback='/var/lib/kea/kea-leases4.csv'),
+        DHCP_KEA_LEASE_STATE_FILE=config.get('dhcp', 'kea_lease_state_file',
+                                             fallback='/var/lib/mr-provisioner/kea-leases4.offset'),
+        DNSMASQ_HOSTSDIR=config.get('dnsmasq', 'hostsdir', fallback='/var/lib/mr-provisioner/dnsmasq/hosts'),
+        DNSMASQ_OPTSDIR=config.get('dnsmasq', 'optsdir', fallback='/var/lib/mr-provisioner/dnsmasq/opts'),
+        DNSMASQ_PID_FILE=config.get('dnsmasq', 'pid_file', fallback=''),
         WSS_EXT_HOST=config.get('wssubprocess', 'ext_host', fallback=''),
         WSS_EXT_PORT=int(config.get('wssubprocess', 'ext_port', fallback=8866)),
-        CONTROLLER_ACCESS_URI=config.get('controller', 'access_uri', fallback='http://127.0.0.1:5000'),
-        PRESEED_DNS=config.get('provisioning', 'preseed_dns', fallback='')
+        CONTROLLER_ACCESS_URI=controller_access_uri,
+        NETBOOT_FILE_PROTOCOL=config.get('netboot', 'file_protocol', fallback='tftp'),
+        NETBOOT_HTTP_HOST=config.get('netboot', 'http_host', fallback='') or urlparse(controller_access_uri).netloc,
+        PRESEED_DNS=config.get('provisioning', 'preseed_dns', fallback=''),
+        EVENTS_ASYNC=config.getboolean('events', 'async_writes', fallback=True),
+        EVENTS_FLUSH_INTERVAL_MS=int(config.get('events', 'flush_interval_ms', fallback=250)),
+        EVENTS_BATCH_SIZE=int(config.get('events', 'batch_size', fallback=500)),
+        EVENTS_QUEUE_SIZE=int(config.get('events', 'queue_size', fallback=10000)),
+        EVENTS_ENQUEUE_TIMEOUT=float(config.get('events', 'enqueue_timeout', fallback=1.0)),
+        EVENTS_RETENTION_DAYS=int(config.get('events', 'retention_days', fallback=30)),
+        EVENTS_PRUNE_BATCH_SIZE=int(config.get('events', 'prune_batch_size', fallback=5000)),
+        EVENTS_PARTITION_INTERVAL=config.get('events', 'partition_interval', fallback='daily'),
+        EVENTS_PARTITIONS_AHEAD=int(config.get('events', 'partitions_ahead', fallback=7)),
+        POWER_MAX_WORKERS=int(config.get('power', 'max_workers', fallback=32)),
+        POWER_PER_BMC_CONCURRENCY=per_bmc_concurrency,
+        POWER_STATE_TIMEOUT=float(config.get('power', 'state_timeout', fallback=10.0)),
+        POWER_POLL_INTERVAL=int(config.get('power', 'poll_interval', fallback=60)),
+        POWER_STATE_MAX_AGE=int(config.get('power', 'state_max_age', fallback=180)),
+        POWER_CHANGE_TIMEOUT=float(config.get('power', 'change_timeout', fallback=60.0)),
+        POWER_BREAKER_THRESHOLD=int(config.get('power', 'breaker_threshold', fallback=3)),
+        POWER_BREAKER_COOLDOWN=float(config.get('power', 'breaker_cooldown', fallback=30.0)),
+        JOBS_WORKERS=int(config.get('jobs', 'workers', fallback=16)),
+        JOBS_MAX_RUNTIME=int(config.get('jobs', 'max_runtime', fallback=600)),
+        JOBS_RETENTION_DAYS=int(config.get('jobs', 'retention_days', fallback=7))
     )
 
     # Config settings used by Flask
@@ -1,70 +1,43 @@
-from flask import Blueprint, abort, request, jsonify
+from flask import Blueprint, abort, request, jsonify, Response
 
 import logging
-import re
 import ipaddress
-from datetime import datetime
 
 from mr_provisioner import db
-from mr_provisioner.models import Interface, Machine, Lease, DiscoveredMAC, MachineEvent
-from mr_provisioner.util import MAC_REGEX, DHCP_ARCH_CODES, mac_vendor
+from mr_provisioner.models import Interface, Machine, Subarch, Image, Network, Lease, MachineEvent
+from mr_provisioner.util import DHCP_ARCH_CODES
+from mr_provisioner.util.cache import ModelCache
+from mr_provisioner.dhcp import reservations as host_reservations
+from mr_provisioner.dhcp import networks, validation
+from mr_provisioner.dhcp.validation import ValidationError
+from mr_provisioner.dhcp.discovery import seen_tracker, cached_mac_vendor
 from sqlalchemy.exc import DatabaseError
 
 from flask import current_app as app
 
-from schema import Schema, And, Or, Use, SchemaError
-from functools import reduce
-
 
 mod = Blueprint('dhcp', __name__, template_folder='templates')
 logger = logging.getLogger('dhcp')
 
-lease_schema = Schema({
-    'mac': And(str, lambda s: re.match(MAC_REGEX, s) is not None),
-    'ipv4': Use(ipaddress.IPv4Address),
-    'duration': And(int, lambda i: i >= 0)
-})
-
-seen_schema = Schema({
-    'discover': bool,
-    'mac': And(str, lambda s: re.match(MAC_REGEX, s) is not None),
-    'options': [{
-        'option': And(int, lambda i: i >= 0),
-        'value': Or(int, str)
-    }]
-})
-
-subnet_schema = Schema({
-    'mac': And(str, lambda s: re.match(MAC_REGEX, s) is not None),
-    'subnets': [{
-        'subnetId': int,
-        'prefix': Use(ipaddress.IPv4Address),
-        'prefixLen': And(int, lambda i: i >= 0 and i <= 32),
-        'pools': [{
-            'poolId': int,
-            'capacity': int,
-            'firstIP': Use(ipaddress.IPv4Address),
-            'lastIP': Use(ipaddress.IPv4Address),
-        }]
-    }]
-})
 
+# Precomputed /ipv4 answers keyed by (lower-case) MAC. Network is included
+# because changing a network's reserved range clears interface reservations
+# with a bulk UPDATE that bypasses the Interface mapper events. Any client
+# can make up MACs, so only so many are kept.
+BOOT_CACHE_SIZE = 10000
+boot_cache = ModelCache('dhcp-boot', max_size=BOOT_CACHE_SIZE) \
+    .invalidate_on(Interface, Machine, Subarch, Image, Network)
 
-@mod.route('/ipv4', methods=['GET'])
-def index():
-    hwaddr = request.args.get('hwaddr')
-    if not hwaddr:
-        abort(400)
-
-    machine = Machine.by_mac(hwaddr)
-    if not machine:
-        abort(404)
 
+def boot_answer(hwaddr):
     interface = Interface.by_mac(hwaddr)
     if not interface:
-        abort(404)
+        return None
+
+    machine = interface.machine
+    if not machine:
+        return None
 
-    # query param ?hwaddr=
     # response:
     # {
     #   "ipv4": "",
@@ -90,36 +63,88 @@ def index():
     if interface.reserved_ipv4 and not use_static:
         data['ipv4'] = interface.reserved_ipv4
 
+    return data
+
+
+@mod.route('/ipv4', methods=['GET'])
+def index():
+    # query param ?hwaddr=
+    try:
+        hwaddr = validation.parse_mac(request.args.get('hwaddr'))
+    except ValidationError:
+        abort(400)
+
+    data = boot_cache.get_or_compute(hwaddr, lambda: boot_answer(hwaddr))
+    if data is None:
+        abort(404)
+
     return jsonify(data), 200
 
 
+@mod.route('/ipv4/reservations', methods=['GET'])
+def reservations():
+    # query param ?since=<version>
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            abort(400)
+
+    # Read before the reservations themselves: anything changed in between
+    # is sent again next time rather than missed.
+    version = host_reservations.current_version()
+    since = host_reservations.usable_since(since, version)
+
+    etag = '"%d-%s%s"' % (version, host_reservations.config_fingerprint(), '' if since is None else '-%d' % since)
+    if etag in [t.strip() for t in request.headers.get('If-None-Match', '').split(',')]:
+        return Response(status=304, headers={'ETag': etag})
+
+    hosts, deleted = host_reservations.reservations(since)
+
+    data = {
+        'version': version,
+        'full': since is None,
+        'reservations': hosts,
+    }
+    if since is not None:
+        data['since'] = since
+        data['deleted'] = deleted
+
+    response = jsonify(data)
+    response.headers['ETag'] = etag
+    return response, 200
+
+
 @mod.route('/ipv4/lease', methods=['POST'])
 def lease():
-    data = request.get_json(force=True)
     try:
-        lease_schema.validate(data)
-    except SchemaError as e:
+        data = validation.validate_lease(request.get_json(force=True))
+    except ValidationError as e:
+        return str(e), 400
+
+    Lease.upsert([data])
+
+    return "", 201
+
+
+@mod.route('/ipv4/leases', methods=['POST'])
+def leases():
+    try:
+        data = validation.validate_leases(request.get_json(force=True))
+    except ValidationError as e:
         return str(e), 400
 
-    lease = Lease.by_mac(data['mac'])
-    if lease:
-        lease.ipv4 = data['ipv4']
-        lease.last_seen = datetime.utcnow()
-        db.session.commit()
-    else:
-        lease = Lease(mac=data['mac'], ipv4=data['ipv4'])
-        db.session.add(lease)
-        db.session.commit()
+    Lease.upsert(data)
 
     return "", 201
 
 
 @mod.route('/ipv4/seen', methods=['POST'])
 def seen():
-    data = request.get_json(force=True)
     try:
-        seen_schema.validate(data)
-    except SchemaError as e:
+        data = validation.validate_seen(request.get_json(force=True))
+    except ValidationError as e:
         return str(e), 400
 
     interface = Interface.by_mac(data['mac'])
@@ -132,7 +157,7 @@ def seen():
 
     info = {}
 
-    info['mac_vendor'] = mac_vendor(data['mac'])
+    info['mac_vendor'] = cached_mac_vendor(data['mac'])
 
     if 12 in options:
         # hostname option
@@ -144,62 +169,36 @@ def seen():
         info['arch_code'] = code
         info['arch'] = DHCP_ARCH_CODES.get(code, 'unknown')
 
-    discovered_mac = DiscoveredMAC.by_mac(data['mac'])
-    if discovered_mac:
-        discovered_mac.info = info
-        discovered_mac.last_seen = datetime.utcnow()
-        db.session.commit()
-    else:
-        discovered_mac = DiscoveredMAC(mac=data['mac'], info=info)
-        db.session.add(discovered_mac)
-        db.session.commit()
+    seen_tracker.seen(data['mac'], info)
 
     return "", 202
 
 
 @mod.route('/ipv4/subnet', methods=['POST'])
 def subnet():
-    data = request.get_json(force=True)
     try:
-        data = subnet_schema.validate(data)
-    except SchemaError as e:
+        data = validation.validate_subnet(request.get_json(force=True))
+    except ValidationError as e:
         return str(e), 400
 
-    hwaddr = data['mac']
-    if not hwaddr:
-        abort(400)
-
-    interface = Interface.by_mac(hwaddr)
-    if not interface:
-        abort(404)
-
-    if not interface.network:
+    found = networks.interface_network(data['mac'])
+    network = networks.network_index().get(found[0]) if found else None
+    if network is None:
         abort(404)
 
-    use_static = True if interface.static_ipv4 else False
-    use_reserved = True if not use_static and interface.reserved_ipv4 else False
-
-    expected_pool = None
-    if use_reserved:
-        expected_pool = ipaddress.IPv4Network(interface.network.reserved_net)
-
-    logger.info('expected_pool: %s' % expected_pool)
-
-    if expected_pool is None:
+    _, use_reserved = found
+    if not use_reserved or network.reserved is None:
+        logger.info('expected_pool: None')
         return jsonify({'subnetId': None}), 200
 
-    response = {}
+    logger.info('expected_pool: %s - %s' % tuple(map(ipaddress.IPv4Address, network.reserved)))
 
-    for subnet in data['subnets']:
-        net = ipaddress.IPv4Network((subnet['prefix'], subnet['prefixLen']), strict=False)
-        if not net.overlaps(ipaddress.IPv4Network(interface.network.subnet)):
-            continue
+    response = {}
 
-        pool_matches = reduce(lambda r, p: r or p['firstIP'] in expected_pool, subnet['pools'], False)
-        if pool_matches:
-            response['subnetId'] = subnet['subnetId']
-            logger.info('matched subnet: %s' % subnet)
-            break
+    subnet = networks.match_subnet(network, data['subnets'])
+    if subnet is not None:
+        response['subnetId'] = subnet['subnetId']
+        logger.info('matched subnet: %s' % subnet)
 
     return jsonify(response), 200
 
@@ -0,0 +1,152 @@
+"""
+Debounced recording of unknown MACs seen by the DHCP server.
+
+Unknown machines on the provisioning network send a DHCPDISCOVER every few
+seconds, and each one used to cost a DiscoveredMAC lookup and a commit. The
+SeenTracker remembers what it last wrote for each MAC: a sighting with the
+same info within `DHCP_SEEN_WRITE_INTERVAL` seconds of that write only
+bumps last_seen in memory, and pending bumps are written together every
+`DHCP_SEEN_FLUSH_INTERVAL` seconds by a background thread. New MACs and
+changed info are still written straight away.
+
+The MAC vendor lookup is cached as well.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+
+from flask import current_app
+from sqlalchemy import event
+
+from mr_provisioner import db
+from mr_provisioner.models import DiscoveredMAC, Interface
+from mr_provisioner.util import mac_vendor
+
+
+logger = logging.getLogger('dhcp')
+
+
+@lru_cache(maxsize=4096)
+def cached_mac_vendor(mac):
+    return mac_vendor(mac)
+
+
+class SeenTracker:
+    def __init__(self):
+        self._app = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._written = {}  # mac -> (info, time.monotonic() of the last write)
+        self._pending = {}  # mac -> last_seen not yet written
+        self.writes = 0
+        self.debounced = 0
+
+    def seen(self, mac, info):
+        """Record a sighting of mac, writing it out now only if needed."""
+        config = current_app.config
+        mac = mac.lower()
+        now = time.monotonic()
+
+        with self._lock:
+            written = self._written.get(mac)
+            if written is not None and written[0] == info and now - written[1] < config['DHCP_SEEN_WRITE_INTERVAL']:
+                self._pending[mac] = datetime.utcnow()
+                self.debounced += 1
+                debounced = True
+            else:
+                self._pending.pop(mac, None)
+                debounced = False
+
+        if debounced:
+            if config['DHCP_SEEN_FLUSH_INTERVAL'] > 0:
+                self._ensure_started(current_app._get_current_object())
+            return
+
+        DiscoveredMAC.upsert(mac, info)
+        with self._lock:
+            self._written[mac] = (info, now)
+            self.writes += 1
+
+    def forget(self, mac):
+        """Make the next sighting of mac be written out, e.g. because its row went away."""
+        with self._lock:
+            self._written.pop(mac.lower(), None)
+            self._pending.pop(mac.lower(), None)
+
+    def clear(self):
+        with self._lock:
+            self._written.clear()
+            self._pending.clear()
+            self.writes = 0
+            self.debounced = 0
+
+    def flush(self):
+        """Write out pending last_seen bumps, and forget MACs not written for a while."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if pending:
+            DiscoveredMAC.touch(pending)
+
+        cutoff = time.monotonic() - current_app.config['DHCP_SEEN_WRITE_INTERVAL']
+        with self._lock:
+            for mac in [mac for mac, (info, at) in self._written.items() if at < cutoff and mac not in self._pending]:
+                del self._written[mac]
+
+        return len(pending)
+
+    def _ensure_started(self, app):
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            self._app = app
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='dhcp-seen', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _run(self):
+        interval = self._app.config['DHCP_SEEN_FLUSH_INTERVAL']
+        while not self._stopping.wait(interval):
+            self._flush_in_context()
+        self._flush_in_context()
+
+    def _flush_in_context(self):
+        with self._app.app_context():
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error('failed to write discovered MAC sightings: %s' % str(e))
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+    def stop(self):
+        thread = self._thread
+        if thread is None:
+            return
+
+        self._stopping.set()
+        thread.join()
+        self._thread = None
+
+
+seen_tracker = SeenTracker()
+
+
+@event.listens_for(Interface, 'after_insert')
+@event.listens_for(Interface, 'after_delete')
+def interface_changed(mapper, connection, target):
+    # Assigning a MAC to an interface deletes its DiscoveredMAC row, and
+    # deleting the interface makes it unknown again: either way, what was
+    # last written for it no longer is in the table.
+    seen_tracker.forget(target.mac)
@@ -0,0 +1,174 @@
+"""
+Host reservations for dnsmasq, as files in a dhcp-hostsdir and dhcp-optsdir.
+
+For sites running dnsmasq rather than Kea with the mr-provisioner hook,
+DnsmasqSync writes what /dhcp/ipv4 answers for every interface as a
+dhcp-host entry, one file per interface in the hosts directory: the MAC,
+the reserved address if any and, for machines that netboot, a tag for
+their bootloader. The options of each such tag (bootfile and TFTP server)
+go into one file per tag in the options directory. dnsmasq then answers
+without calling into mr-provisioner at all.
+
+Using the reservation versions (see mr_provisioner.dhcp.reservations), each
+pass only rewrites the files of interfaces that changed since the previous
+one, and removes those of deleted interfaces. The first pass, any pass
+after the [dhcp] settings changed and any pass after the tombstones it
+needed were pruned compare every file against what it should contain
+instead, and only rewrite those that differ.
+
+dnsmasq reads new and changed files in these directories by itself
+(inotify), but keeps the entries of changed or deleted files until it gets
+a SIGHUP. If given dnsmasq's pid file, a pass that changed or deleted files
+sends it one.
+"""
+
+import hashlib
+import logging
+import os
+import signal
+import time
+
+from mr_provisioner import db
+from mr_provisioner.dhcp import reservations as host_reservations
+
+
+logger = logging.getLogger('dhcp')
+
+TAG_PREFIX = 'mrp-boot-'
+
+
+def host_filename(mac):
+    return mac.replace(':', '-')
+
+
+def boot_tag(bootfile, next_server):
+    """Tag for hosts booting bootfile from next_server: the same for the same options."""
+    return TAG_PREFIX + hashlib.sha1(('%s\0%s' % (bootfile, next_server)).encode('utf-8')).hexdigest()[:12]
+
+
+def host_entry(host):
+    """
+    Return (dhcp-host line, (tag, dhcp-option lines) or None) for host, a
+    reservation as returned by reservations.reservations().
+    """
+    fields = [host['hw-address']]
+    opts = None
+
+    if 'next-server' in host:
+        bootfile = host['option-data'][0]['data']
+        tag = boot_tag(bootfile, host['next-server'])
+        fields.append('set:%s' % tag)
+        opts = (tag, 'tag:%s,option:bootfile-name,%s\ntag:%s,option:tftp-server,%s\n' %
+                (tag, bootfile, tag, host['next-server']))
+
+    if 'ip-address' in host:
+        fields.append(host['ip-address'])
+
+    return ','.join(fields) + '\n', opts
+
+
+class DnsmasqSync:
+    def __init__(self, hostsdir, optsdir, pid_file=None):
+        self.hostsdir = hostsdir
+        self.optsdir = optsdir
+        self.pid_file = pid_file
+        self.version = None
+        self.fingerprint = None
+        # Whether dnsmasq has entries of changed or deleted files to drop
+        self.needs_reload = False
+        self.written = 0
+        self.removed = 0
+
+    def _write(self, directory, name, content):
+        """Write content to directory/name, unless it's there already."""
+        path = os.path.join(directory, name)
+        try:
+            with open(path) as f:
+                if f.read() == content:
+                    return
+            existed = True
+        except FileNotFoundError:
+            existed = False
+
+        # dnsmasq ignores dotfiles, and sees the rename as a new file.
+        tmp_path = os.path.join(directory, '.%s.tmp' % name)
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        self.written += 1
+        self.needs_reload |= existed
+
+    def _remove(self, directory, name):
+        try:
+            os.unlink(os.path.join(directory, name))
+        except FileNotFoundError:
+            return
+        self.removed += 1
+        self.needs_reload = True
+
+    def sync(self):
+        """Bring the directories up to date; returns whether dnsmasq needs a reload."""
+        # Read before the reservations themselves, as for /dhcp/ipv4/reservations
+        version = host_reservations.current_version()
+        fingerprint = host_reservations.config_fingerprint()
+
+        full = fingerprint != self.fingerprint or host_reservations.usable_since(self.version, version) is None
+        if not full and version == self.version:
+            return self.needs_reload
+
+        hosts, deleted = host_reservations.reservations(None if full else self.version)
+
+        entries = {}
+        opts = {}
+        for host in hosts:
+            line, host_opts = host_entry(host)
+            entries[host_filename(host['hw-address'])] = line
+            if host_opts is not None:
+                opts[host_opts[0]] = host_opts[1]
+
+        # Options before the hosts that use them
+        for tag, content in opts.items():
+            self._write(self.optsdir, tag, content)
+        for name, line in entries.items():
+            self._write(self.hostsdir, name, line)
+        for mac in deleted:
+            self._remove(self.hostsdir, host_filename(mac))
+
+        if full:
+            for name in os.listdir(self.hostsdir):
+                if not name.startswith('.') and name not in entries:
+                    self._remove(self.hostsdir, name)
+            for name in os.listdir(self.optsdir):
+                if name.startswith(TAG_PREFIX) and name not in opts:
+                    self._remove(self.optsdir, name)
+
+        self.version = version
+        self.fingerprint = fingerprint
+        return self.needs_reload
+
+    def reload(self):
+        """Make dnsmasq drop entries of changed and deleted files."""
+        if not self.pid_file:
+            logger.warning('dnsmasq keeps entries of changed or deleted host files until it gets a SIGHUP')
+            self.needs_reload = False
+            return
+
+        with open(self.pid_file) as f:
+            pid = int(f.read().strip())
+        os.kill(pid, signal.SIGHUP)
+        self.needs_reload = False
+
+    def run(self, interval, once=False):
+        while True:
+            try:
+                if self.sync():
+                    self.reload()
+            except Exception as e:
+                logger.error('failed to sync dnsmasq host files: %s' % str(e))
+            finally:
+                # Each pass gets to see what was committed since
+                db.session.remove()
+
+            if once:
+                return
+            time.sleep(interval)
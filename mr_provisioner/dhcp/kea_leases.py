@@ -0,0 +1,159 @@
+"""
+Lease ingestion from Kea's memfile lease file.
+
+With the memfile lease backend, Kea appends a CSV row to its lease file
+(kea-leases4.csv) whenever a lease is created, renewed, released or
+expires. LeaseFileTailer reads the rows appended since it last looked and
+stores them with batched Lease.upserts, one transaction per batch, as an
+alternative to the hook reporting each lease to /dhcp/ipv4/lease. Its byte
+offset into the file is saved after every batch, so a restart carries on
+where it stopped.
+
+Kea's lease file cleanup (LFC) periodically moves the lease file to
+<file>.2 and starts a new one. The tailer notices the new file by its inode,
+and finishes reading the old one from <file>.2 first.
+"""
+
+import json
+import logging
+import os
+import time
+
+from mr_provisioner import db
+from mr_provisioner.dhcp.validation import ValidationError, parse_ipv4, parse_mac
+from mr_provisioner.models import Lease
+
+
+logger = logging.getLogger('dhcp')
+
+# Lease states (the state column)
+STATE_DEFAULT = 0
+STATE_DECLINED = 1
+STATE_EXPIRED_RECLAIMED = 2
+
+
+def parse_lease(columns, line, now=None):
+    """
+    Return a lease ({'mac': ..., 'ipv4': ..., 'duration': ...}, as
+    Lease.upsert takes) for a row of the lease file with the given columns,
+    or None for rows without a valid MAC or address. Leases that were
+    released, declined or have expired get a duration of 0.
+    """
+    values = line.rstrip('\r\n').split(',')
+    if len(values) < len(columns):
+        return None
+
+    row = dict(zip(columns, values))
+    try:
+        mac = parse_mac(row['hwaddr'])
+        parse_ipv4(row['address'])
+        valid_lifetime = int(row['valid_lifetime'])
+        expire = int(row['expire'])
+        state = int(row.get('state') or STATE_DEFAULT)
+    except (KeyError, ValueError, ValidationError):
+        return None
+
+    now = time.time() if now is None else now
+    if valid_lifetime == 0 or state != STATE_DEFAULT:
+        duration = 0
+    else:
+        duration = max(0, int(expire - now))
+
+    return {'mac': mac, 'ipv4': row['address'], 'duration': duration}
+
+
+class LeaseFileTailer:
+    def __init__(self, path, state_path, batch_size=5000):
+        self.path = path
+        self.state_path = state_path
+        self.batch_size = batch_size
+        self.inode, self.offset = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            return state['inode'], state['offset']
+        except FileNotFoundError:
+            return None, 0
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning('ignoring invalid lease file state in %s: %s' % (self.state_path, str(e)))
+            return None, 0
+
+    def _save_state(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'inode': self.inode, 'offset': self.offset}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def poll(self):
+        """Store the leases appended since the last poll; returns how many rows were read."""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return 0
+
+        count = 0
+        if self.inode is not None and inode != self.inode:
+            # Rotated by LFC: read what's left of the previous file first.
+            # Once LFC is done with it, it's gone, so this only works if
+            # polling more often than LFC runs.
+            rotated = self.path + '.2'
+            try:
+                if os.stat(rotated).st_ino == self.inode:
+                    count += self._read(rotated)
+            except FileNotFoundError:
+                pass
+            self.inode, self.offset = inode, 0
+        elif self.inode is None:
+            self.inode = inode
+
+        count += self._read(self.path)
+        return count
+
+    def _read(self, path):
+        count = 0
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < self.offset:
+                # Truncated or replaced in place
+                self.offset = 0
+
+            columns = f.readline().decode('utf-8', 'replace').rstrip('\r\n').split(',')
+            if 'address' not in columns:
+                logger.warning('%s has no lease file header, skipping it' % path)
+                return 0
+            self.offset = max(self.offset, f.tell())
+            f.seek(self.offset)
+
+            while True:
+                lines = f.readlines(self.batch_size * 128)[:self.batch_size]
+                if not lines:
+                    return count
+                if not lines[-1].endswith(b'\n'):
+                    # Kea is still writing that one
+                    lines.pop()
+                    if not lines:
+                        return count
+
+                now = time.time()
+                leases = [parse_lease(columns, line.decode('utf-8', 'replace'), now) for line in lines]
+                Lease.upsert([lease for lease in leases if lease is not None])
+
+                self.offset += sum(len(line) for line in lines)
+                self._save_state()
+                f.seek(self.offset)
+                count += len(lines)
+
+    def run(self, interval, once=False):
+        while True:
+            try:
+                count = self.poll()
+                if count:
+                    logger.info('read %d leases from %s' % (count, self.path))
+            except Exception as e:
+                logger.error('failed to read leases from %s: %s' % (self.path, str(e)))
+                db.session.rollback()
+
+            if once:
+                return
+            time.sleep(interval)
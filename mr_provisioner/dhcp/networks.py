@@ -0,0 +1,102 @@
+"""
+In-memory index of networks for /dhcp/ipv4/subnet.
+
+Kea asks which of its subnets to pick for a MAC on every subnet selection,
+listing all of its subnets and their pools each time. Rather than building
+ipaddress objects for each of them, networks are kept as integer
+(first, last) address ranges, rebuilt whenever a network changes, and
+matching a Kea subnet or pool comes down to integer comparisons. What each
+interface is expected to get an address from is cached as well.
+"""
+
+import ipaddress
+from collections import namedtuple
+
+from mr_provisioner import db
+from mr_provisioner.models import Interface, Network
+from mr_provisioner.util.cache import ModelCache
+
+
+NetworkRanges = namedtuple('NetworkRanges', ['subnet', 'reserved'])
+
+
+def ip_range(cidr):
+    """Return the (first, last) address of cidr as integers, or None."""
+    if not cidr:
+        return None
+
+    net = ipaddress.IPv4Network(cidr)
+    return int(net.network_address), int(net.broadcast_address)
+
+
+def prefix_range(prefix, prefix_len):
+    """Like ip_range, for an address (of any host in the network) and a prefix length."""
+    host_mask = 0xffffffff >> prefix_len
+    first = int(prefix) & ~host_mask
+    return first, first | host_mask
+
+
+class NetworkIndex:
+    def __init__(self, networks):
+        """networks: (id, subnet, reserved_net) of every network."""
+        self._by_id = {network_id: NetworkRanges(ip_range(subnet), ip_range(reserved_net))
+                       for network_id, subnet, reserved_net in networks}
+
+    @classmethod
+    def load(cls):
+        return cls(db.session.query(Network.id, Network.subnet, Network.reserved_net))
+
+    def get(self, network_id):
+        return self._by_id.get(network_id)
+
+    def __len__(self):
+        return len(self._by_id)
+
+
+# Network is the only model the index depends on.
+index_cache = ModelCache('dhcp-networks').invalidate_on(Network)
+
+# (network id, use reserved range) for each (lower-case) MAC, or None for
+# MACs without an interface on a network. Network is included for the same
+# reason as for the boot answers: changing a network's reserved range clears
+# reservations with a bulk UPDATE that bypasses the Interface mapper events.
+# Bounded, as clients pick the MACs.
+interface_cache = ModelCache('dhcp-subnet', max_size=10000).invalidate_on(Interface, Network)
+
+
+def network_index():
+    return index_cache.get_or_compute(None, NetworkIndex.load)
+
+
+def _interface_network(mac):
+    interface = Interface.by_mac(mac)
+    if not interface or interface.network_id is None:
+        return None
+
+    use_static = True if interface.static_ipv4 else False
+    use_reserved = True if not use_static and interface.reserved_ipv4 else False
+    return interface.network_id, use_reserved
+
+
+def interface_network(mac):
+    return interface_cache.get_or_compute(mac.lower(), lambda: _interface_network(mac))
+
+
+def match_subnet(network, subnets):
+    """
+    Return the first of Kea's subnets that overlaps the network's subnet and
+    has a pool starting in its reserved range, or None.
+    """
+    net_first, net_last = network.subnet
+    pool_first, pool_last = network.reserved
+
+    for subnet in subnets:
+        first, last = prefix_range(subnet['prefix'], subnet['prefixLen'])
+        if last < net_first or first > net_last:
+            continue
+
+        for pool in subnet['pools']:
+            if pool_first <= int(pool['firstIP']) <= pool_last:
+                return subnet
+
+    return None
@@ -0,0 +1,104 @@
+"""
+Kea host reservations for every known interface.
+
+What /dhcp/ipv4 answers for a MAC, exported for all interfaces at once as
+Kea host reservations, so that a DHCP server can keep them locally and only
+ask again when something changed.
+
+Every change that affects an interface's reservation gives the interface a
+new version (see reservation_version_seq in the models); deleted interfaces
+leave a tombstone with a version. The snapshot version is the highest of
+them, and `since=<version>` returns only what changed after it.
+
+Tombstones are pruned after `[dhcp] tombstone_retention_days` (by the
+sweep_leases command); clients asking for changes since before the oldest
+one left get a full snapshot instead, as deletions may be missing.
+"""
+
+import hashlib
+
+from sqlalchemy import func
+
+from mr_provisioner import db
+from mr_provisioner.models import Interface, Machine, Subarch, Image, ReservationTombstone
+
+from flask import current_app as app
+
+
+def current_version():
+    interfaces = db.session.query(func.coalesce(func.max(Interface.version), 0)).scalar()
+    tombstones = db.session.query(func.coalesce(func.max(ReservationTombstone.version), 0)).scalar()
+    return max(interfaces, tombstones)
+
+
+def usable_since(since, version):
+    """
+    Return since, or None for a full snapshot if it is not one of our
+    versions (e.g. the database was restored) or tombstones after it may
+    have been pruned.
+    """
+    if since is None or since > version:
+        return None
+
+    oldest = ReservationTombstone.oldest_version()
+    if oldest is not None and since < oldest:
+        return None
+
+    return since
+
+
+def config_fingerprint():
+    """Changes when the config settings that go into reservations do."""
+    settings = '%s\0%s' % (app.config['DHCP_TFTP_PROXY_HOST'], app.config['DHCP_DEFAULT_BOOTFILE'])
+    return hashlib.sha1(settings.encode('utf-8')).hexdigest()[:12]
+
+
+def host_reservation(row):
+    mac, static_ipv4, reserved_ipv4, netboot_enabled, bootfile = row
+
+    host = {'hw-address': mac}
+    if reserved_ipv4 and not static_ipv4:
+        host['ip-address'] = reserved_ipv4
+
+    if netboot_enabled:
+        host['next-server'] = app.config['DHCP_TFTP_PROXY_HOST']
+        host['option-data'] = [{
+            'name': 'boot-file-name',
+            'code': 67,
+            'data': bootfile or app.config['DHCP_DEFAULT_BOOTFILE'],
+        }]
+
+    return host
+
+
+def reservations(since=None):
+    """
+    Return (reservations, deleted MACs) for all interfaces, or only those
+    changed after version since.
+    """
+    query = db.session.query(Interface.mac, Interface.static_ipv4, Interface.reserved_ipv4,
+                             Machine.netboot_enabled, Image.filename, Machine.id) \
+        .outerjoin(Machine, Interface.machine_id == Machine.id) \
+        .outerjoin(Subarch, Machine.subarch_id == Subarch.id) \
+        .outerjoin(Image, Subarch.bootloader_id == Image.id)
+    if since is not None:
+        query = query.filter(Interface.version > since)
+
+    hosts = []
+    deleted = set()
+    for row in query:
+        if row[-1] is None:
+            # No machine, no answer from /dhcp/ipv4 either
+            deleted.add(row[0])
+        else:
+            hosts.append(host_reservation(row[:-1]))
+
+    if since is None:
+        return hosts, []
+
+    tombstones = db.session.query(ReservationTombstone.mac).filter(ReservationTombstone.version > since)
+    deleted.update(mac for mac, in tombstones)
+    # Deleted and since re-added
+    deleted.difference_update(host['hw-address'] for host in hosts)
+
+    return hosts, sorted(deleted)
@@ -0,0 +1,180 @@
+"""
+Validation of the payloads the Kea hook posts to /dhcp.
+
+These are validated on every DHCP callout, and seen and subnet payloads
+carry every DHCP option or every Kea subnet, so rather than `schema`
+schemas (a call through And/Or/Use and a lambda per field) they are checked
+with plain type checks, a precompiled pattern for MACs and inet_pton for
+IPv4 addresses. Invalid payloads raise ValidationError, with messages like
+schema's; valid ones are returned with MACs in canonical (lower-case) form,
+and for subnet selection with IPv4 addresses as integers.
+"""
+
+import re
+import socket
+
+
+_MAC_RE = re.compile(r'[\da-fA-F]{2}(?::[\da-fA-F]{2}){5}\Z')
+
+LEASE_KEYS = frozenset(['mac', 'ipv4', 'duration'])
+SEEN_KEYS = frozenset(['discover', 'mac', 'options'])
+OPTION_KEYS = frozenset(['option', 'value'])
+SUBNET_KEYS = frozenset(['mac', 'subnets'])
+KEA_SUBNET_KEYS = frozenset(['subnetId', 'prefix', 'prefixLen', 'pools'])
+POOL_KEYS = frozenset(['poolId', 'capacity', 'firstIP', 'lastIP'])
+
+
+class ValidationError(ValueError):
+    pass
+
+
+def _instance(value, types, name):
+    if not isinstance(value, types):
+        raise ValidationError('%r should be instance of %r' % (value, name))
+
+
+def _keys(data, keys):
+    _instance(data, dict, 'dict')
+    if data.keys() == keys:
+        return
+
+    missing = keys - data.keys()
+    if missing:
+        raise ValidationError('Missing keys: %s' % ', '.join(repr(k) for k in sorted(missing)))
+    raise ValidationError('Wrong keys %s in %r' % (', '.join(repr(k) for k in data if k not in keys), data))
+
+
+def _field(data, key, check):
+    try:
+        return check(data[key])
+    except ValidationError as e:
+        raise ValidationError('Key %r error:\n%s' % (key, e))
+
+
+def _list(value, check):
+    _instance(value, list, 'list')
+    return [check(item) for item in value]
+
+
+def parse_mac(value):
+    """Return value, a MAC address, in canonical form."""
+    _instance(value, str, 'str')
+    if _MAC_RE.match(value) is None:
+        raise ValidationError('%r is not a MAC address' % value)
+    return value.lower()
+
+
+def parse_ipv4(value):
+    """Return value, an IPv4 address (dotted-quad, or an integer), as an integer."""
+    if isinstance(value, str):
+        try:
+            return int.from_bytes(socket.inet_pton(socket.AF_INET, value), 'big')
+        except (OSError, ValueError):
+            pass
+    elif isinstance(value, int):
+        if 0 <= value <= 0xffffffff:
+            return int(value)
+    else:
+        raise ValidationError('%r should be instance of %r' % (value, 'str'))
+    raise ValidationError('%r is not an IPv4 address' % value)
+
+
+def format_ipv4(address):
+    return '%d.%d.%d.%d' % (address >> 24, (address >> 16) & 0xff, (address >> 8) & 0xff, address & 0xff)
+
+
+def _integer(value):
+    _instance(value, int, 'int')
+    return value
+
+
+def _non_negative(value):
+    _instance(value, int, 'int')
+    if value < 0:
+        raise ValidationError('%r should be >= 0' % value)
+    return value
+
+
+def _prefix_len(value):
+    _instance(value, int, 'int')
+    if not 0 <= value <= 32:
+        raise ValidationError('%r should be between 0 and 32' % value)
+    return value
+
+
+def _boolean(value):
+    _instance(value, bool, 'bool')
+    return value
+
+
+def _option_value(value):
+    _instance(value, (int, str), 'int or str')
+    return value
+
+
+def _address(value):
+    # Leases are stored as given, as long as it's an address.
+    address = parse_ipv4(value)
+    return value if isinstance(value, str) else format_ipv4(address)
+
+
+def validate_lease(data):
+    """{'mac': ..., 'ipv4': ..., 'duration': ...}"""
+    _keys(data, LEASE_KEYS)
+    return {
+        'mac': _field(data, 'mac', parse_mac),
+        'ipv4': _field(data, 'ipv4', _address),
+        'duration': _field(data, 'duration', _non_negative),
+    }
+
+
+def validate_leases(data):
+    """A list of leases."""
+    return _list(data, validate_lease)
+
+
+def _option(data):
+    _keys(data, OPTION_KEYS)
+    return {
+        'option': _field(data, 'option', _non_negative),
+        'value': _field(data, 'value', _option_value),
+    }
+
+
+def validate_seen(data):
+    """{'discover': bool, 'mac': ..., 'options': [{'option': ..., 'value': ...}]}"""
+    _keys(data, SEEN_KEYS)
+    return {
+        'discover': _field(data, 'discover', _boolean),
+        'mac': _field(data, 'mac', parse_mac),
+        'options': _field(data, 'options', lambda options: _list(options, _option)),
+    }
+
+
+def _pool(data):
+    _keys(data, POOL_KEYS)
+    return {
+        'poolId': _field(data, 'poolId', _integer),
+        'capacity': _field(data, 'capacity', _integer),
+        'firstIP': _field(data, 'firstIP', parse_ipv4),
+        'lastIP': _field(data, 'lastIP', parse_ipv4),
+    }
+
+
+def _kea_subnet(data):
+    _keys(data, KEA_SUBNET_KEYS)
+    return {
+        'subnetId': _field(data, 'subnetId', _integer),
+        'prefix': _field(data, 'prefix', parse_ipv4),
+        'prefixLen': _field(data, 'prefixLen', _prefix_len),
+        'pools': _field(data, 'pools', lambda pools: _list(pools, _pool)),
+    }
+
+
+def validate_subnet(data):
+    """{'mac': ..., 'subnets': [Kea subnet with its pools]}"""
+    _keys(data, SUBNET_KEYS)
+    return {
+        'mac': _field(data, 'mac', parse_mac),
+        'subnets': _field(data, 'subnets', lambda subnets: _list(subnets, _kea_subnet)),
+    }
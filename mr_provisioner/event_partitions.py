@@ -0,0 +1,130 @@
+"""
+Optional time-partitioned layout for the machine_event table.
+
+When enabled (see the machine_event_partitioning migration), machine_event is
+a PostgreSQL (11+) table partitioned by RANGE on `date`, with one partition
+per day or per week named machine_event_pYYYYMMDD after the first day it
+covers, plus a DEFAULT partition catching anything outside of them. Retention
+then drops whole partitions instead of deleting rows.
+"""
+
+from datetime import datetime, timedelta
+import logging
+import re
+
+from sqlalchemy import text
+
+
+logger = logging.getLogger('events')
+
+INTERVALS = ('daily', 'weekly')
+
+PARENT_TABLE = 'machine_event'
+DEFAULT_PARTITION = 'machine_event_default'
+
+_BOUND_REGEX = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def period_start(day, interval):
+    day = datetime(day.year, day.month, day.day)
+    if interval == 'weekly':
+        day -= timedelta(days=day.weekday())
+    return day
+
+
+def period_end(start, interval):
+    return start + timedelta(days=7 if interval == 'weekly' else 1)
+
+
+def partition_name(start):
+    return '%s_p%s' % (PARENT_TABLE, start.strftime('%Y%m%d'))
+
+
+def is_partitioned(connection):
+    return connection.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"),
+        table=PARENT_TABLE).scalar() is not None
+
+
+def list_partitions(connection):
+    """Return [(name, start, end)] for every range partition, oldest first."""
+    rows = connection.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table)"), table=PARENT_TABLE)
+
+    partitions = []
+    for name, bound in rows:
+        m = _BOUND_REGEX.search(bound or '')
+        if not m:
+            # DEFAULT partition
+            continue
+        start, end = (datetime.strptime(v, '%Y-%m-%d %H:%M:%S') for v in m.groups())
+        partitions.append((name, start, end))
+
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def create_partitions(connection, interval, first_day, last_day):
+    """Create any missing partitions covering first_day up to and including last_day."""
+    if interval not in INTERVALS:
+        raise ValueError('partition interval must be one of: %s' % ', '.join(INTERVALS))
+
+    existing = list_partitions(connection)
+    created = []
+
+    start = period_start(first_day, interval)
+    while start <= last_day:
+        end = period_end(start, interval)
+
+        # Never overlap partitions created with a different interval.
+        if not any(s < end and start < e for (_, s, e) in existing):
+            name = partition_name(start)
+            bounds = {'start': start, 'end': end}
+
+            # Events that arrived before their partition existed ended up in
+            # the DEFAULT partition; move them over, as ATTACH PARTITION
+            # refuses to create a partition overlapping rows in DEFAULT.
+            connection.execute(text('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)' %
+                                    (name, PARENT_TABLE)))
+            connection.execute(text(
+                'WITH moved AS (DELETE FROM %s WHERE date >= :start AND date < :end RETURNING *) '
+                'INSERT INTO %s SELECT * FROM moved' % (DEFAULT_PARTITION, name)), **bounds)
+            connection.execute(text(
+                "ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM ('%s') TO ('%s')" %
+                (PARENT_TABLE, name, start.isoformat(' '), end.isoformat(' '))))
+            existing.append((name, start, end))
+            created.append(name)
+
+        start = end
+
+    return created
+
+
+def drop_expired_partitions(connection, retention_days):
+    """Drop partitions that only hold events older than retention_days."""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    dropped = []
+
+    for name, start, end in list_partitions(connection):
+        if end <= cutoff:
+            connection.execute(text('DROP TABLE %s' % name))
+            dropped.append(name)
+
+    return dropped
+
+
+def maintain(connection, interval, ahead, retention_days):
+    """Create partitions for the next `ahead` periods and drop expired ones."""
+    today = datetime.utcnow()
+    last_day = today + timedelta(days=ahead * (7 if interval == 'weekly' else 1))
+
+    created = create_partitions(connection, interval, today, last_day)
+    dropped = drop_expired_partitions(connection, retention_days)
+
+    for name in created:
+        logger.info('created event partition %s' % name)
+    for name in dropped:
+        logger.info('dropped event partition %s' % name)
+
+    return created, dropped
@@ -0,0 +1,151 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from flask import current_app
+
+from mr_provisioner import db
+
+
+logger = logging.getLogger('events')
+
+
+class EventSink:
+    """
+    Writes MachineEvents off the request path.
+
+    Events are queued in memory and a background thread inserts them with a
+    single multi-row INSERT every `EVENTS_FLUSH_INTERVAL_MS` milliseconds or
+    as soon as `EVENTS_BATCH_SIZE` events are pending, whichever comes first.
+    The queue is bounded: once `EVENTS_QUEUE_SIZE` events are pending,
+    producers block for up to `EVENTS_ENQUEUE_TIMEOUT` seconds and the event
+    is dropped (and logged) if there is still no room.
+
+    With `EVENTS_ASYNC` disabled, events are added and committed through the
+    regular session instead.
+    """
+
+    def __init__(self):
+        self._app = None
+        self._queue = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def submit(self, event):
+        config = current_app.config
+        if not config['EVENTS_ASYNC']:
+            db.session.add(event)
+            db.session.commit()
+            return
+
+        self._ensure_started(current_app._get_current_object())
+
+        row = {c.name: getattr(event, c.name) for c in event.__table__.columns if c.name != 'id'}
+        try:
+            self._queue.put(row, timeout=config['EVENTS_ENQUEUE_TIMEOUT'])
+        except queue.Full:
+            self.dropped += 1
+            logger.warning('event queue full, dropping %s event for machine %s' %
+                           (row['event_type'], row['machine_id']))
+
+    def submit_many(self, events):
+        if not events:
+            return
+
+        if not current_app.config['EVENTS_ASYNC']:
+            db.session.add_all(events)
+            db.session.commit()
+            return
+
+        for event in events:
+            self.submit(event)
+
+    def _ensure_started(self, app):
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            self._app = app
+            self._queue = queue.Queue(maxsize=app.config['EVENTS_QUEUE_SIZE'])
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='event-sink', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _collect(self, batch_size, deadline):
+        rows = []
+        while len(rows) < batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                rows.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return rows
+
+    def _drain(self):
+        rows = []
+        while True:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                return rows
+
+    def _write(self, rows):
+        from mr_provisioner.models import MachineEvent
+
+        if not rows:
+            return
+
+        engine = db.get_engine(self._app)
+        table = MachineEvent.__table__
+        try:
+            engine.execute(table.insert().values(rows))
+        except Exception as e:
+            # One bad row (e.g. its machine was deleted in the meantime)
+            # fails the whole statement, so retry the batch row by row.
+            logger.warning('batched event insert failed, retrying individually: %s' % str(e))
+            for row in rows:
+                try:
+                    engine.execute(table.insert().values(row))
+                except Exception as e:
+                    logger.error('dropping event for machine %s: %s' % (row['machine_id'], str(e)))
+
+    def _run(self):
+        config = self._app.config
+        interval = config['EVENTS_FLUSH_INTERVAL_MS'] / 1000.0
+        batch_size = config['EVENTS_BATCH_SIZE']
+
+        while not self._stopping.is_set():
+            rows = self._collect(batch_size, time.monotonic() + interval)
+            try:
+                self._write(rows)
+            except Exception as e:
+                logger.error('failed to write %d events: %s' % (len(rows), str(e)))
+
+        self._write(self._drain())
+
+    def flush(self):
+        """Synchronously write out everything that is currently queued."""
+        if self._queue is not None:
+            self._write(self._drain())
+
+    def stop(self):
+        thread = self._thread
+        if thread is None:
+            return
+
+        self._stopping.set()
+        thread.join()
+        self._thread = None
+
+
+event_sink = EventSink()
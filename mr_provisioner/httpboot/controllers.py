@@ -0,0 +1,112 @@
+from flask import Blueprint, abort, request, safe_join, Response
+
+import logging
+import os
+import re
+
+from werkzeug.wsgi import wrap_file
+
+from flask import current_app as app
+
+mod = Blueprint('httpboot', __name__)
+logger = logging.getLogger('httpboot')
+
+RANGE_REGEX = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_etag(st):
+    return '"%x-%x-%x"' % (int(st.st_mtime), st.st_size, st.st_ino)
+
+
+def parse_range(header, size):
+    """
+    Return (start, end) (inclusive) for a single-range `Range` header, None if
+    the header should be ignored and a full response sent, or raise ValueError
+    if the range is unsatisfiable.
+    """
+    m = RANGE_REGEX.match(header.strip())
+    if not m:
+        # Multiple ranges or other units: serve the whole file.
+        return None
+
+    first, last = m.groups()
+    if first == '' and last == '':
+        return None
+
+    if size == 0:
+        # Not even a suffix range has a byte to select.
+        raise ValueError('unsatisfiable range')
+
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError('unsatisfiable range')
+        return (max(0, size - length), size - 1)
+
+    start = int(first)
+    end = min(int(last), size - 1) if last != '' else size - 1
+    if start >= size or start > end:
+        raise ValueError('unsatisfiable range')
+
+    return (start, end)
+
+
+def iter_range(f, start, length):
+    try:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+@mod.route('/<path:filename>', methods=['GET'])
+def get_file(filename):
+    path = safe_join(app.config['TFTP_ROOT'], filename)
+    if not path or not os.path.isfile(path):
+        abort(404)
+
+    st = os.stat(path)
+    etag = file_etag(st)
+
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'no-cache',
+    }
+
+    if etag in [t.strip() for t in request.headers.get('If-None-Match', '').split(',')]:
+        return Response(status=304, headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = parse_range(range_header, st.st_size)
+        except ValueError:
+            headers['Content-Range'] = 'bytes */%d' % st.st_size
+            return Response(status=416, headers=headers)
+
+    logger.info("HTTP boot request for %s from %s (range: %s)" % (filename, request.remote_addr, byte_range))
+
+    f = open(path, 'rb')
+    if byte_range is None:
+        headers['Content-Length'] = str(st.st_size)
+        # Read and written CHUNK_SIZE bytes at a time, through userspace:
+        # WSGI gives no access to the socket, so no sendfile(). Servers with
+        # a wsgi.file_wrapper of their own (waitress) stream it themselves.
+        body = wrap_file(request.environ, f, CHUNK_SIZE)
+        return Response(body, status=200, headers=headers, mimetype='application/octet-stream',
+                        direct_passthrough=True)
+
+    start, end = byte_range
+    headers['Content-Length'] = str(end - start + 1)
+    headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, st.st_size)
+    return Response(iter_range(f, start, end - start + 1), status=206, headers=headers,
+                    mimetype='application/octet-stream', direct_passthrough=True)
@@ -0,0 +1,20 @@
+import os
+
+from tornado.web import StaticFileHandler
+
+from mr_provisioner.httpboot.controllers import file_etag
+
+
+class BootFileHandler(StaticFileHandler):
+    """
+    Native tornado handler for /boot/ used by the `tornado` runner, so large
+    kernel/initrd downloads are streamed by the IOLoop (with Range and
+    If-None-Match support) instead of tying up the WSGI container. Like the
+    WSGI endpoint, this is buffered streaming, not sendfile(): tornado reads
+    the file in 64 KiB chunks and writes them to the socket.
+    """
+
+    def compute_etag(self):
+        # StaticFileHandler hashes the whole file by default; use the same
+        # cheap stat-based ETag as the WSGI endpoint instead.
+        return file_etag(os.stat(self.absolute_path))
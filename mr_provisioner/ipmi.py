@@ -1,18 +1,31 @@
 #!/usr/bin/env python
 
+import logging
 import subprocess
 import re
+import tempfile
+
+from mr_provisioner import ipmi_lanplus
+from mr_provisioner.ipmi_lanplus import LanplusError, LanplusUnsupportedError
 
 
 class IPMIError(Exception):
     pass
 
 
+logger = logging.getLogger('ipmi')
+
 IPMITOOL_CMD = '/usr/bin/ipmitool'
+IPMITOOL_TIMEOUT = None
 
 ALLOWED_BOOTDEVS = ['pxe', 'disk', 'bios']
 ALLOWED_POWER_STATES = ['on', 'off', 'cycle', 'reset', 'soft']
 
+# ipmitool: fork ipmitool for every command
+# native: use the built-in RMCP+ client (see ipmi_lanplus), falling back to
+#         ipmitool for what it doesn't support
+BACKENDS = ['ipmitool', 'native']
+
 # chassis bootdev [pxe|disk|bios]
 # chassis power status
 # chassis power [on|off|cycle|reset|soft]
@@ -23,6 +36,11 @@ def set_ipmitool(cmd):
     IPMITOOL_CMD = cmd
 
 
+def set_ipmitool_timeout(timeout):
+    global IPMITOOL_TIMEOUT
+    IPMITOOL_TIMEOUT = timeout
+
+
 def build_command(cmd, *, host=None, username=None, password=None, privilege_level=None,
                   bridge_info=[], interface='lanplus'):
     command = [IPMITOOL_CMD, "-I", interface]
@@ -58,15 +76,40 @@ def run_command(command):
 
         return subprocess.check_output(command,
                                        stderr=subprocess.STDOUT,
-                                       shell=False)
+                                       shell=False,
+                                       timeout=IPMITOOL_TIMEOUT)
     except subprocess.CalledProcessError as e:
         raise IPMIError("IPMI error: %s (%s)" % (str(e), e.output))
+    except subprocess.TimeoutExpired as e:
+        raise IPMIError("IPMI error: %s" % str(e))
+
 
+def run_native(fn, *args, bridge_info=[], interface='lanplus', **kwargs):
+    """
+    Run an ipmi_lanplus call with build_command-style arguments. Returns
+    (True, result), or (False, None) if it should be done with ipmitool.
+    """
+    if interface != 'lanplus':
+        return (False, None)
+
+    try:
+        return (True, fn(*args, bridge_info=list(bridge_info), **kwargs))
+    except LanplusUnsupportedError as e:
+        logger.warning("%s, falling back to ipmitool" % str(e))
+        return (False, None)
+    except LanplusError as e:
+        raise IPMIError(str(e))
 
-def set_bootdev(bootdev, options=None, **kwargs):
+
+def set_bootdev(bootdev, options=None, backend='ipmitool', **kwargs):
     if bootdev not in ALLOWED_BOOTDEVS:
         raise IPMIError("IPMI error: Uknown bootdev %s" % (bootdev))
 
+    if backend == 'native':
+        done, _ = run_native(ipmi_lanplus.set_bootdev, bootdev, options, **kwargs)
+        if done:
+            return b""
+
     cmd = ["chassis", "bootdev", bootdev]
     if options:
         cmd += ["options=%s" % options]
@@ -76,24 +119,76 @@ def set_bootdev(bootdev, options=None, **kwargs):
     return run_command(command)
 
 
-def set_power(power_state, **kwargs):
+def set_power(power_state, backend='ipmitool', **kwargs):
     if power_state not in ALLOWED_POWER_STATES:
         raise IPMIError("IPMI error: Unknown power state %s" % (power_state))
 
+    if backend == 'native':
+        done, _ = run_native(ipmi_lanplus.set_power, power_state, **kwargs)
+        if done:
+            return b""
+
     command = build_command(["chassis", "power", power_state], **kwargs)
     return run_command(command)
 
 
-def get_power(**kwargs):
-    command = build_command(["chassis", "power", "status"], **kwargs)
-    output = run_command(command).decode("utf-8")
-    m = re.match(r"Chassis Power is (\w+)", output)
+def parse_power_state(output):
+    # The last one, when running a batch of commands
+    m = re.findall(r"^Chassis Power is (\w+)", output, re.MULTILINE)
     if m:
-        return m.group(1)
+        return m[-1]
     else:
         raise IPMIError("IPMI error: Unable to parse power state: %s" % (output))
 
 
+def get_power(backend='ipmitool', **kwargs):
+    if backend == 'native':
+        done, state = run_native(ipmi_lanplus.get_power, **kwargs)
+        if done:
+            return state
+
+    command = build_command(["chassis", "power", "status"], **kwargs)
+    return parse_power_state(run_command(command).decode("utf-8"))
+
+
+def run_batch(cmds, *, bridge_info=[], **kwargs):
+    """Run several ipmitool commands in one process (and session) with `ipmitool exec`."""
+    with tempfile.NamedTemporaryFile('w', prefix='mr-provisioner-ipmi-') as batch:
+        batch.write("".join(" ".join(cmd) + "\n" for cmd in cmds))
+        batch.flush()
+
+        command = build_command(["exec", batch.name], bridge_info=list(bridge_info), **kwargs)
+        return run_command(command).decode("utf-8")
+
+
+def boot_and_reset(bootdev, options=None, reset='reset', backend='ipmitool', **kwargs):
+    """
+    Set the boot device, then reset the machine (with the reset power
+    state, e.g. cycle) if it is on or power it on otherwise. Returns the
+    final power state.
+    """
+    if bootdev not in ALLOWED_BOOTDEVS:
+        raise IPMIError("IPMI error: Uknown bootdev %s" % (bootdev))
+    if reset not in ALLOWED_POWER_STATES:
+        raise IPMIError("IPMI error: Unknown power state %s" % (reset))
+
+    if backend == 'native':
+        done, state = run_native(ipmi_lanplus.boot_and_reset, bootdev, options, reset, **kwargs)
+        if done:
+            return state
+
+    cmd = ["chassis", "bootdev", bootdev]
+    if options:
+        cmd += ["options=%s" % options]
+
+    # A batch can't branch on the power state, so this takes two ipmitool
+    # runs rather than one.
+    state = parse_power_state(run_batch([cmd, ["chassis", "power", "status"]], **kwargs))
+    power_state = reset if state == "on" else "on"
+    return parse_power_state(run_batch([["chassis", "power", power_state], ["chassis", "power", "status"]],
+                                       **kwargs))
+
+
 def deactivate_sol(**kwargs):
     command = build_command(["sol", "deactivate"], **kwargs)
     return run_command(command)
@@ -0,0 +1,172 @@
+"""
+BMC jobs.
+
+API requests that need to talk to a BMC (power changes, provisioning) only
+queue a Job row and return its id; the bmc_worker command claims queued
+jobs and runs them, so that a slow or dead BMC ties up a worker thread
+rather than a web server one. Job status is available from
+/api/v1/job/<id>.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mr_provisioner import db
+from mr_provisioner.bmc_types import BMCError
+
+
+logger = logging.getLogger('jobs')
+
+ACTIONS = {}
+
+
+def action(name):
+    def register(fn):
+        ACTIONS[name] = fn
+        return fn
+    return register
+
+
+@action('power')
+def run_power(job):
+    from mr_provisioner.models import MachineEvent
+
+    state = job.machine.set_power(job.params['state'])
+    MachineEvent.power_changed(job.machine_id, job.user, job.params['state'])
+    return {'state': state}
+
+
+@action('provision')
+def run_provision(job):
+    from mr_provisioner.models import MachineEvent
+
+    machine = job.machine
+    try:
+        state = machine.set_power('pxe_reboot')
+    except BMCError as e:
+        machine.state = 'error'
+        db.session.commit()
+        MachineEvent.state_changed(machine.id, job.user, machine.state, 'provisioning failed: %s' % str(e))
+        raise
+
+    return {'state': state}
+
+
+def enqueue_many(machines, user, action, params=None):
+    from mr_provisioner.models import Job
+
+    if action not in ACTIONS:
+        raise ValueError('unknown job action %s' % action)
+
+    jobs = [Job(machine_id=machine.id, user=user, action=action, params=params or {}) for machine in machines]
+    db.session.add_all(jobs)
+    db.session.commit()
+    return jobs
+
+
+def enqueue(machine, user, action, params=None):
+    return enqueue_many([machine], user, action, params)[0]
+
+
+def enqueue_power_changes(machines, user, power_state):
+    """
+    Queue a power job for each of machines whose power user may change.
+    Returns {machine id: (job, None) if queued, otherwise (None, error message)}.
+    """
+    from mr_provisioner.models import Machine
+
+    permitted = Machine.permitted_ids([m.id for m in machines], user, 'assignee')
+
+    results = {}
+    todo = []
+    for machine in machines:
+        if machine.id not in permitted:
+            results[machine.id] = (None, 'permission denied')
+        elif not machine.bmc:
+            results[machine.id] = (None, 'no BMC configured')
+        else:
+            todo.append(machine)
+
+    for job in enqueue_many(todo, user, 'power', {'state': power_state}):
+        results[job.machine_id] = (job, None)
+    return results
+
+
+def run_job(job_id):
+    """Run a claimed job and record its outcome."""
+    from mr_provisioner.models import Job
+
+    job = Job.query.get(job_id)
+    try:
+        result = ACTIONS[job.action](job)
+    except BMCError as e:
+        db.session.rollback()
+        job.finish(error=str(e))
+    except Exception as e:
+        logger.exception('job %d (%s) failed' % (job_id, job.action))
+        db.session.rollback()
+        job.finish(error=str(e))
+    else:
+        job.finish(result=result)
+
+
+class JobWorker:
+    """Claims queued jobs and runs up to `workers` of them at a time."""
+
+    def __init__(self, app, workers):
+        self.app = app
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _run(self, job_id):
+        try:
+            with self.app.app_context():
+                run_job(job_id)
+        finally:
+            self._slots.release()
+
+    def _free_slots(self):
+        free = 0
+        while self._slots.acquire(blocking=False):
+            free += 1
+        return free
+
+    def step(self):
+        """Claim and start as many jobs as there are idle workers; returns how many were started."""
+        from mr_provisioner.models import Job
+
+        free = self._free_slots()
+        ids = Job.claim(free) if free else []
+        for i in range(free - len(ids)):
+            self._slots.release()
+
+        for job_id in ids:
+            self._executor.submit(self._run, job_id)
+        return len(ids)
+
+    def run(self, interval, once=False):
+        from mr_provisioner.models import Job
+        from mr_provisioner.power import record_bmc_health
+
+        config = self.app.config
+        last_maintenance = 0
+        while True:
+            if time.monotonic() - last_maintenance > 60:
+                failed = Job.fail_stale(config['JOBS_MAX_RUNTIME'])
+                if failed:
+                    logger.warning('failed %d jobs whose worker went away' % failed)
+                Job.prune(config['JOBS_RETENTION_DAYS'])
+                last_maintenance = time.monotonic()
+
+            started = self.step()
+            if once:
+                self._executor.shutdown(wait=True)
+                record_bmc_health()
+                return
+            # Outcomes of the jobs that finished since the last pass
+            record_bmc_health()
+            if not started:
+                time.sleep(interval)
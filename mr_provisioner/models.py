@@ -3,13 +3,18 @@ from base64 import b64encode
 from os import urandom
 import json
 from datetime import datetime, timedelta
-from mr_provisioner.bmc_types import resolve_bmc_type, BMCError, list_bmc_types
-from sqlalchemy import true, event, text
+from mr_provisioner.bmc_types import resolve_bmc_type, list_bmc_types
+from sqlalchemy import true, false, event, text, inspect, select
 from sqlalchemy.dialects.postgresql import JSONB, INET, CIDR, MACADDR
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy import func
 from mr_provisioner.util.query import build_filter
+from mr_provisioner.events import event_sink
+from mr_provisioner import bmc_scheduler
+from mr_provisioner.power import get_power_state, change_power
+from functools import partial
 import binascii
 from netaddr import IPSet, IPNetwork
 import itertools
@@ -86,6 +91,34 @@ class DiscoveredMAC(db.Model):
         except NoResultFound:
             return None
 
+    @staticmethod
+    def upsert(mac, info):
+        db.session.execute(text("""
+            INSERT INTO "discoveredMAC" (mac, info, last_seen) VALUES (:mac, CAST(:info AS jsonb), :now)
+            ON CONFLICT (mac) DO UPDATE SET info = excluded.info, last_seen = excluded.last_seen
+        """), {'mac': mac.lower(), 'info': json.dumps(info), 'now': datetime.utcnow()})
+        db.session.commit()
+
+    @staticmethod
+    def touch(last_seen):
+        """Bump last_seen of existing rows, given as {mac: last_seen}, in one statement."""
+        if not last_seen:
+            return
+
+        params = {}
+        values = []
+        for i, (mac, seen) in enumerate(last_seen.items()):
+            params['mac%d' % i] = mac
+            params['seen%d' % i] = seen
+            values.append('(CAST(:mac%d AS macaddr), CAST(:seen%d AS timestamp))' % (i, i))
+
+        db.session.execute(text("""
+            UPDATE "discoveredMAC" AS d SET last_seen = greatest(d.last_seen, v.last_seen)
+            FROM (VALUES %s) AS v (mac, last_seen)
+            WHERE d.mac = v.mac
+        """ % ', '.join(values)), params)
+        db.session.commit()
+
     @staticmethod
     def can_list(user):
         return True if user.admin else False
@@ -96,11 +129,15 @@ class Lease(db.Model):
     mac = db.Column(MACADDR, unique=True, nullable=False)
     ipv4 = db.Column(INET)
     last_seen = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    # Set by Lease.sweep once expires_at has passed
+    expired = db.Column(db.Boolean, nullable=False, default=False)
 
-    def __init__(self, *, mac, ipv4):
+    def __init__(self, *, mac, ipv4, duration):
         self.mac = mac
         self.ipv4 = ipv4
         self.last_seen = datetime.utcnow()
+        self.expires_at = self.last_seen + timedelta(seconds=duration)
 
     @staticmethod
     def by_mac(mac):
@@ -110,13 +147,108 @@ class Lease(db.Model):
         except NoResultFound:
             return None
 
+    @staticmethod
+    def active():
+        """Leases that have not expired, through lease_active_idx."""
+        return Lease.query.filter((Lease.expired == false()) & (Lease.expires_at > datetime.utcnow()))
+
+    @staticmethod
+    def active_by_mac(mac):
+        return Lease.active().filter(Lease.mac == mac).first()
+
+    @staticmethod
+    def upsert(leases):
+        """
+        Store leases, a list of {'mac': ..., 'ipv4': ..., 'duration': ...},
+        in one INSERT ... ON CONFLICT statement, so that concurrent writers
+        of the same MAC can't trip over each other. Later leases for a MAC
+        win.
+        """
+        now = datetime.utcnow()
+
+        # ON CONFLICT can't update the same row twice in one statement.
+        by_mac = {}
+        for lease in leases:
+            by_mac[lease['mac'].lower()] = (str(lease['ipv4']), now + timedelta(seconds=lease['duration']))
+        if not by_mac:
+            return
+
+        params = {'now': now}
+        values = []
+        for i, (mac, (ipv4, expires_at)) in enumerate(by_mac.items()):
+            params['mac%d' % i] = mac
+            params['ipv4%d' % i] = ipv4
+            params['expires_at%d' % i] = expires_at
+            values.append('(:mac%d, :ipv4%d, :now, :expires_at%d, false)' % (i, i, i))
+
+        db.session.execute(text("""
+            INSERT INTO lease (mac, ipv4, last_seen, expires_at, expired) VALUES %s
+            ON CONFLICT (mac) DO UPDATE SET ipv4 = excluded.ipv4, last_seen = excluded.last_seen,
+                                            expires_at = excluded.expires_at, expired = false
+        """ % ', '.join(values)), params)
+        db.session.commit()
+
+    @staticmethod
+    def sweep(retention_days, batch_size=5000):
+        """
+        Mark leases past expires_at as expired, and delete those that expired
+        more than retention_days ago, batch_size rows per transaction.
+        Returns (expired, deleted).
+        """
+        now = datetime.utcnow()
+        cutoff = now - timedelta(days=retention_days)
+
+        def in_batches(condition, change):
+            total = 0
+            while True:
+                ids = db.session.query(Lease.id).filter(condition).limit(batch_size).subquery()
+                changed = change(Lease.query.filter(Lease.id.in_(ids)))
+                db.session.commit()
+
+                total += changed
+                if changed < batch_size:
+                    return total
+
+        expired = in_batches((Lease.expired == false()) & (Lease.expires_at <= now),
+                             lambda q: q.update({'expired': True}, synchronize_session=False))
+        deleted = in_batches((Lease.expired == true()) & (Lease.expires_at <= cutoff),
+                             lambda q: q.delete(synchronize_session=False))
+        return expired, deleted
+
 
 @event.listens_for(Lease.mac, 'set', retval=True)
 def set_lease_mac(target, value, oldvalue, initiator):
     return value.lower()
 
 
+# Lets lease lookups and the sweeper skip expired leases
+db.Index('lease_active_idx', Lease.mac, Lease.expires_at, postgresql_where=(Lease.expired == false()))
+
+
+# Every change to what /dhcp/ipv4/reservations returns for an interface gives
+# it a new version from this sequence; see mr_provisioner.dhcp.reservations.
+reservation_version_seq = db.Sequence('reservation_version_seq')
+
+# Advisory lock serializing such changes, so that versions become visible
+# in order and a client that has seen version N has seen everything below.
+RESERVATIONS_LOCK = 0x6d727276
+
+
+def lock_reservations(connection):
+    connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), key=RESERVATIONS_LOCK)
+
+
+def bump_reservations(connection, where):
+    """Give the interfaces matching where a new reservation version."""
+    lock_reservations(connection)
+    connection.execute(Interface.__table__.update().where(where)
+                       .values(version=reservation_version_seq.next_value()))
+
+
 class Interface(db.Model):
+    # Attributes /dhcp/ipv4/reservations depends on
+    RESERVATION_ATTRS = ('mac', 'static_ipv4', 'reserved_ipv4', 'machine', 'machine_id')
+
     id = db.Column(db.Integer, primary_key=True)
     mac = db.Column(MACADDR, unique=True, nullable=False)
     identifier = db.Column(db.String, nullable=True)
@@ -127,6 +259,7 @@ class Interface(db.Model):
     machine = db.relationship("Machine", passive_deletes=True)
     network_id = db.Column(db.Integer, db.ForeignKey("network.id", ondelete="SET NULL"), nullable=True)
     network = db.relationship("Network", passive_deletes=True)
+    version = db.Column(db.BigInteger, reservation_version_seq, nullable=False, index=True)
     __table_args__ = (UniqueConstraint('static_ipv4', 'network_id'),
                       UniqueConstraint('reserved_ipv4', 'network_id'),)
 
@@ -142,7 +275,7 @@ class Interface(db.Model):
 
     @property
     def lease(self):
-        return Lease.query.filter_by(mac=self.mac).first()
+        return Lease.active_by_mac(self.mac)
 
     @property
     def config_type_v4(self):
@@ -191,6 +324,62 @@ def interface_after_insert(mapper, connection, target):
     Interface.update_discovery(connection, target)
 
 
+@event.listens_for(Interface, 'before_insert')
+def interface_before_insert(mapper, connection, target):
+    # The version itself comes from the column default
+    lock_reservations(connection)
+
+
+@event.listens_for(Interface, 'before_update')
+def interface_before_update(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in Interface.RESERVATION_ATTRS):
+        return
+
+    lock_reservations(connection)
+    target.version = reservation_version_seq.next_value()
+
+    old_mac = state.attrs.mac.history.deleted
+    if old_mac and old_mac[0]:
+        connection.execute(ReservationTombstone.__table__.insert().values(mac=old_mac[0]))
+
+
+@event.listens_for(Interface, 'after_delete')
+def interface_after_delete(mapper, connection, target):
+    lock_reservations(connection)
+    connection.execute(ReservationTombstone.__table__.insert().values(mac=target.mac))
+
+
+class ReservationTombstone(db.Model):
+    """A MAC whose interface was deleted or changed its MAC, for /dhcp/ipv4/reservations?since=."""
+    version = db.Column(db.BigInteger, reservation_version_seq, primary_key=True)
+    mac = db.Column(MACADDR, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, server_default=text("(now() at time zone 'utc')"))
+
+    @staticmethod
+    def oldest_version():
+        return db.session.query(func.min(ReservationTombstone.version)).scalar()
+
+    @staticmethod
+    def prune(retention_days):
+        """
+        Delete tombstones older than retention_days, except for the newest
+        of those: the oldest tombstone left tells how far back ?since= can
+        go (see reservations.usable_since). Returns how many were deleted.
+        """
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+        newest = db.session.query(func.max(ReservationTombstone.version)) \
+            .filter(ReservationTombstone.deleted_at < cutoff) \
+            .scalar()
+        if newest is None:
+            return 0
+
+        deleted = ReservationTombstone.query.filter(ReservationTombstone.version < newest) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+
 class Machine(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, unique=True, nullable=False)
@@ -273,69 +462,54 @@ class Machine(db.Model):
 
     @property
     def power_state(self):
-        bmc = self.bmc
-        if not bmc:
-            return "unknown"
+        return get_power_state(self)
 
+    def _bmc_set_power(self, power_state):
+        # XXX: raise exception if not bmc
+        state = None
         try:
-            # XXX: consider proxying get_power in bmc so that one can do bmc.get_power instead
-            return bmc.type_inst.get_power(self)
-        except BMCError as e:
-            return "Unknown (BMC error)"
+            # Reboots (re)set the boot device, check the power state and
+            # then power on or reset in one go, without other operations
+            # on the machine in between.
+            state = bmc_scheduler.call(self, partial(change_power, power_state=power_state))
+            return state
+        finally:
+            # Whatever the poller stored last is now out of date.
+            if state:
+                PowerState.record({self.id: state})
+            else:
+                PowerState.forget(self.id)
 
     def reboot(self):
-        bmc = self.bmc
-        # XXX: raise exception if not bmc
-        if self.power_state == "on":
-            bmc.type_inst.set_power(self, "reset")
-        else:
-            bmc.type_inst.set_power(self, "on")
+        return self._bmc_set_power("reboot")
 
     def pxe_reboot(self):
-        bmc = self.bmc
-        # XXX: raise exception if not bmc
-        bmc.type_inst.set_bootdev(self, "pxe")
-        if self.power_state == "on":
-            bmc.type_inst.set_power(self, "reset")
-        else:
-            bmc.type_inst.set_power(self, "on")
+        return self._bmc_set_power("pxe_reboot")
 
     def disk_reboot(self):
-        bmc = self.bmc
-        # XXX: raise exception if not bmc
-        bmc.type_inst.set_bootdev(self, "disk")
-        if self.power_state == "on":
-            bmc.type_inst.set_power(self, "reset")
-        else:
-            bmc.type_inst.set_power(self, "on")
+        return self._bmc_set_power("disk_reboot")
 
     def bios_reboot(self):
-        bmc = self.bmc
-        # XXX: raise exception if not bmc
-        bmc.type_inst.set_bootdev(self, "bios")
-        if self.power_state == "on":
-            bmc.type_inst.set_power(self, "reset")
-        else:
-            bmc.type_inst.set_power(self, "on")
+        return self._bmc_set_power("bios_reboot")
 
     def set_power(self, power_state):
+        """Returns the resulting power state if it is known, otherwise None."""
         if power_state == 'pxe_reboot':
-            self.pxe_reboot()
+            return self.pxe_reboot()
         elif power_state == 'disk_reboot':
-            self.disk_reboot()
+            return self.disk_reboot()
         elif power_state == 'bios_reboot':
-            self.bios_reboot()
+            return self.bios_reboot()
+        elif power_state == 'reboot':
+            # Powers on machines that are off, rather than resetting them
+            return self.reboot()
         else:
-            power_state = 'reset' if power_state == 'reboot' else power_state
-            bmc = self.bmc
-            # XXX: raise exception if not bmc
-            bmc.type_inst.set_power(self, power_state)
+            return self._bmc_set_power(power_state)
 
     def deactivate_sol(self):
-        bmc = self.bmc
         # XXX: raise exception if not bmc
         if self.power_state == "on":
-            bmc.type_inst.deactivate_sol(self)
+            bmc_scheduler.call(self, lambda machine: resolve_bmc_type(machine.bmc.bmc_type).deactivate_sol(machine))
 
     @property
     def sol_command(self):
@@ -356,6 +530,24 @@ class Machine(db.Model):
 
         return True
 
+    @staticmethod
+    def permitted_ids(machine_ids, user, min_priv_level='any'):
+        """check_permission for many machines at once; returns the ids of those that pass."""
+        if user.admin:
+            return set(machine_ids)
+        elif min_priv_level == 'admin':
+            return set()
+
+        if min_priv_level == 'assignee':
+            if not machine_ids:
+                return set()
+            rows = db.session.query(MachineUsers.machine_id) \
+                .filter(MachineUsers.user_id == user.id) \
+                .filter(MachineUsers.machine_id.in_(machine_ids))
+            return {machine_id for machine_id, in rows}
+
+        return set(machine_ids)
+
     @staticmethod
     def can_create(user):
         return True if user.admin else False
@@ -405,7 +597,234 @@ class Machine(db.Model):
         return q
 
 
+@event.listens_for(Machine, 'before_update')
+def machine_before_update(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in ('netboot_enabled', 'subarch', 'subarch_id')):
+        bump_reservations(connection, Interface.machine_id == target.id)
+
+
+@event.listens_for(Machine, 'before_delete')
+def machine_before_delete(mapper, connection, target):
+    # Its interfaces go with it through ON DELETE CASCADE, behind the
+    # mapper's back.
+    lock_reservations(connection)
+    connection.execute(ReservationTombstone.__table__.insert().from_select(
+        ['mac', 'version'],
+        select([Interface.mac, reservation_version_seq.next_value()]).where(Interface.machine_id == target.id)))
+
+
 # Architectures are AArch64/ARM/x86_64
+class PowerState(db.Model):
+    """Last known power state of a machine, as seen by the poll_power command."""
+    machine_id = db.Column(db.Integer, db.ForeignKey("machine.id", ondelete="CASCADE"), primary_key=True)
+    state = db.Column(db.String, nullable=False)
+    last_updated = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, *, machine_id, state):
+        self.machine_id = machine_id
+        self.state = state
+        self.last_updated = datetime.utcnow()
+
+    @staticmethod
+    def by_machine_ids(machine_ids, max_age):
+        """Return {machine id: state} for states stored less than max_age seconds ago."""
+        if not machine_ids:
+            return {}
+
+        cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+        rows = db.session.query(PowerState.machine_id, PowerState.state) \
+            .filter(PowerState.machine_id.in_(machine_ids)) \
+            .filter(PowerState.last_updated >= cutoff)
+        return dict(rows)
+
+    @staticmethod
+    def record(states):
+        """
+        Store {machine id: state}. Written through a connection of its own:
+        reading a power state must not commit, or roll back, the caller's
+        session.
+        """
+        if not states:
+            return
+
+        params = {'now': datetime.utcnow()}
+        values = []
+        for i, (machine_id, state) in enumerate(states.items()):
+            params['machine_id%d' % i] = machine_id
+            params['state%d' % i] = state
+            values.append('(CAST(:machine_id%d AS integer), CAST(:state%d AS varchar))' % (i, i))
+
+        try:
+            with db.engine.begin() as connection:
+                # Machines deleted (or not committed yet) are skipped.
+                connection.execute(text("""
+                    INSERT INTO power_state (machine_id, state, last_updated)
+                    SELECT v.machine_id, v.state, :now FROM (VALUES %s) AS v (machine_id, state)
+                    JOIN machine ON machine.id = v.machine_id
+                    ON CONFLICT (machine_id) DO UPDATE SET state = excluded.state, last_updated = excluded.last_updated
+                """ % ', '.join(values)), params)
+        except IntegrityError:
+            # Raced with a machine being deleted; the poller catches up.
+            pass
+
+    @staticmethod
+    def forget(*machine_ids):
+        table = PowerState.__table__
+        with db.engine.begin() as connection:
+            connection.execute(table.delete().where(table.c.machine_id.in_(machine_ids)))
+
+
+class BMCHealthState(db.Model):
+    """Last known health of a BMC, as seen by the poll_power and bmc_worker commands."""
+    __tablename__ = 'bmc_health'
+    bmc_id = db.Column(db.Integer, db.ForeignKey("BMC.id", ondelete="CASCADE"), primary_key=True)
+    state = db.Column(db.String, nullable=False)
+    consecutive_failures = db.Column(db.Integer, nullable=False)
+    last_success = db.Column(db.DateTime, nullable=True)
+    last_failure = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.String, nullable=True)
+    latency = db.Column(db.Float, nullable=True)
+    last_updated = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, *, bmc_id):
+        self.bmc_id = bmc_id
+
+    def update(self, health):
+        self.state = health.state
+        self.consecutive_failures = health.consecutive_failures
+        self.last_success = health.last_success
+        self.last_failure = health.last_failure
+        self.last_error = health.last_error
+        self.latency = health.latency
+        self.last_updated = datetime.utcnow()
+
+    @staticmethod
+    def record(healths):
+        """Store a list of bmc_health.BMCHealth."""
+        if not healths:
+            return
+
+        healths = {health.bmc_id: health for health in healths}
+        existing = BMCHealthState.query.filter(BMCHealthState.bmc_id.in_(list(healths))).all()
+        seen = {hs.bmc_id for hs in existing}
+        for bmc_id in healths:
+            if bmc_id not in seen:
+                existing.append(BMCHealthState(bmc_id=bmc_id))
+                db.session.add(existing[-1])
+
+        for hs in existing:
+            hs.update(healths[hs.bmc_id])
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Raced with another writer inserting the same BMC, or the BMC
+            # was deleted meanwhile.
+            db.session.rollback()
+
+    @staticmethod
+    def forget(*bmc_ids):
+        BMCHealthState.query.filter(BMCHealthState.bmc_id.in_(bmc_ids)).delete(synchronize_session=False)
+        db.session.commit()
+
+
+# Advisory lock serializing Job.claim
+JOBS_LOCK = 0x6d72726a
+
+
+class Job(db.Model):
+    """A BMC action requested through the API, run by the bmc_worker command."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    machine_id = db.Column(db.Integer, db.ForeignKey("machine.id", ondelete="CASCADE"), nullable=False)
+    machine = db.relationship("Machine", passive_deletes=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="SET NULL"), nullable=True)
+    user = db.relationship("User", passive_deletes=True)
+    action = db.Column(db.String, nullable=False)
+    params = db.Column(JSONB)
+    status = db.Column(db.String, nullable=False)
+    result = db.Column(JSONB)
+    error = db.Column(db.String)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __init__(self, *, machine_id, user, action, params):
+        self.machine_id = machine_id
+        self.user_id = user.id if user else None
+        self.action = action
+        self.params = params
+        self.status = Job.QUEUED
+        self.created_at = datetime.utcnow()
+
+    def check_permission(self, user, min_priv_level='any'):
+        if user.admin:
+            return True
+        elif min_priv_level == 'admin':
+            return False
+
+        return self.user_id == user.id
+
+    def finish(self, *, result=None, error=None):
+        self.status = Job.FAILED if error else Job.DONE
+        self.result = result
+        self.error = error
+        self.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    @staticmethod
+    def claim(limit):
+        """
+        Mark up to limit queued jobs as running and return their ids, oldest
+        first. Jobs for the same machine run one at a time, in order: only
+        the oldest queued job of machines without a running one is claimed.
+        """
+        # Claims are serialized, so that two workers can't each claim a job
+        # for the same machine; the UPDATE then sees the other's claims.
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': JOBS_LOCK})
+        rows = db.session.execute(text("""
+            UPDATE job SET status = :running, started_at = :now
+            WHERE id IN (SELECT id FROM (SELECT DISTINCT ON (machine_id) id FROM job q
+                                         WHERE status = :queued AND NOT EXISTS (
+                                             SELECT 1 FROM job r
+                                             WHERE r.machine_id = q.machine_id AND r.status = :running)
+                                         ORDER BY machine_id, id) oldest
+                         ORDER BY id LIMIT :limit)
+            RETURNING id
+        """), {'running': Job.RUNNING, 'queued': Job.QUEUED, 'now': datetime.utcnow(), 'limit': limit})
+        ids = sorted(job_id for job_id, in rows)
+        db.session.commit()
+        return ids
+
+    @staticmethod
+    def fail_stale(max_runtime):
+        """Fail jobs that have been running for more than max_runtime seconds, e.g. because their worker died."""
+        cutoff = datetime.utcnow() - timedelta(seconds=max_runtime)
+        failed = Job.query.filter((Job.status == Job.RUNNING) & (Job.started_at < cutoff)) \
+            .update({'status': Job.FAILED, 'error': 'worker lost', 'finished_at': datetime.utcnow()},
+                    synchronize_session=False)
+        db.session.commit()
+        return failed
+
+    @staticmethod
+    def prune(retention_days):
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+        deleted = Job.query.filter(Job.status.in_([Job.DONE, Job.FAILED]) & (Job.finished_at < cutoff)) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+
+# Lets the workers find queued jobs, and machines with a running one,
+# without scanning finished ones
+db.Index('job_queued_idx', Job.id, postgresql_where=(Job.status == Job.QUEUED))
+db.Index('job_running_idx', Job.machine_id, postgresql_where=(Job.status == Job.RUNNING))
+
+
 class Arch(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, unique=True, nullable=False)
@@ -469,6 +888,14 @@ class Subarch(db.Model):
 db.Index('subarch_arch_name_uniq', Subarch.arch_id, Subarch.name, unique=True)
 
 
+@event.listens_for(Subarch, 'before_update')
+def subarch_before_update(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in ('bootloader', 'bootloader_id')):
+        bump_reservations(connection, Interface.machine_id.in_(
+            select([Machine.id]).where(Machine.subarch_id == target.id)))
+
+
 class ConsoleToken(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     token = db.Column(db.String, unique=True, nullable=False)
@@ -740,10 +1167,26 @@ class MachineEvent(db.Model):
         return q.all()
 
     @staticmethod
-    def cleanup():
-        db.session.query(MachineEvent).filter(
-            MachineEvent.date <= (datetime.utcnow() - timedelta(days=30))
-        ).delete()
+    def prune(retention_days, batch_size=5000):
+        """Delete events older than retention_days, batch_size rows per transaction."""
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+        total = 0
+
+        while True:
+            ids = db.session.query(MachineEvent.id) \
+                .filter(MachineEvent.date <= cutoff) \
+                .limit(batch_size) \
+                .subquery()
+            # The date condition is redundant, but lets PostgreSQL skip
+            # partitions when machine_event is partitioned.
+            deleted = db.session.query(MachineEvent) \
+                .filter(MachineEvent.id.in_(ids) & (MachineEvent.date <= cutoff)) \
+                .delete(synchronize_session=False)
+            db.session.commit()
+
+            total += deleted
+            if deleted < batch_size:
+                return total
 
     @staticmethod
     def console_accessed(machine_id, user):
@@ -751,8 +1194,7 @@ class MachineEvent(db.Model):
                              info={},
                              machine_id=machine_id,
                              user=user)
-        db.session.add(event)
-        db.session.commit()
+        event_sink.submit(event)
 
     @staticmethod
     def power_changed(machine_id, user, power_state):
@@ -760,8 +1202,7 @@ class MachineEvent(db.Model):
                              info={'power': power_state},
                              machine_id=machine_id,
                              user=user)
-        db.session.add(event)
-        db.session.commit()
+        event_sink.submit(event)
 
     @staticmethod
     def state_changed(machine_id, user, state, reason):
@@ -769,8 +1210,7 @@ class MachineEvent(db.Model):
                              info={'state': state, 'reason': reason},
                              machine_id=machine_id,
                              user=user)
-        db.session.add(event)
-        db.session.commit()
+        event_sink.submit(event)
 
     @staticmethod
     def preseed_accessed(machine_id, user, client_ip):
@@ -778,8 +1218,7 @@ class MachineEvent(db.Model):
                              info={'client_ip': client_ip},
                              machine_id=machine_id,
                              user=user)
-        db.session.add(event)
-        db.session.commit()
+        event_sink.submit(event)
 
     @staticmethod
     def preseed_error(machine_id, user, client_ip, message, lineno=0):
@@ -787,8 +1226,7 @@ class MachineEvent(db.Model):
                              info={'client_ip': client_ip, 'message': message, 'lineno': lineno},
                              machine_id=machine_id,
                              user=user)
-        db.session.add(event)
-        db.session.commit()
+        event_sink.submit(event)
 
     @staticmethod
     def dhcp_request(machine_id, user, discover):
@@ -796,8 +1234,7 @@ class MachineEvent(db.Model):
                              info={'discover': discover},
                              machine_id=machine_id,
                              user=user)
-        db.session.add(event)
-        db.session.commit()
+        event_sink.submit(event)
 
     @staticmethod
     def tftp_request(machine_id, user, filename):
@@ -805,13 +1242,12 @@ class MachineEvent(db.Model):
                              info={'filename': filename},
                              machine_id=machine_id,
                              user=user)
-        db.session.add(event)
-        db.session.commit()
+        event_sink.submit(event)
 
 
-@event.listens_for(MachineEvent, 'after_insert')
-def machine_event_after_insert(mapper, connection, target):
-    MachineEvent.cleanup()
+# Retention (MachineEvent.prune) and per-machine event listings
+db.Index('machine_event_date_idx', MachineEvent.date)
+db.Index('machine_event_machine_id_date_idx', MachineEvent.machine_id, MachineEvent.date)
 
 
 class Image(db.Model):
@@ -889,6 +1325,14 @@ class Image(db.Model):
         return ['Initrd', 'Kernel', 'bootloader']
 
 
+@event.listens_for(Image, 'before_update')
+def image_before_update(mapper, connection, target):
+    if inspect(target).attrs.filename.history.has_changes():
+        bump_reservations(connection, Interface.machine_id.in_(
+            select([Machine.id]).where(Machine.subarch_id.in_(
+                select([Subarch.id]).where(Subarch.bootloader_id == target.id)))))
+
+
 class Preseed(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String, unique=True, nullable=False)
@@ -1064,19 +1508,21 @@ class Network(db.Model):
 
     @staticmethod
     def static_net_changed(connection, network):
-        query = Interface.__table__.update().where((Interface.network_id == network.id))
+        query = Interface.__table__.update().where((Interface.network_id == network.id)) \
+            .where(Interface.static_ipv4.isnot(None))
         if network.static_net:
             query = query.where(text('not static_ipv4 << network(:range)'))
-        query = query.values(static_ipv4=None)
+        query = query.values(static_ipv4=None, version=reservation_version_seq.next_value())
 
         connection.execute(query, range=network.static_net)
 
     @staticmethod
     def reserved_net_changed(connection, network):
-        query = Interface.__table__.update().where((Interface.network_id == network.id))
+        query = Interface.__table__.update().where((Interface.network_id == network.id)) \
+            .where(Interface.reserved_ipv4.isnot(None))
         if network.reserved_net:
             query = query.where(text('not reserved_ipv4 << network(:range)'))
-        query = query.values(reserved_ipv4=None)
+        query = query.values(reserved_ipv4=None, version=reservation_version_seq.next_value())
 
         connection.execute(query, range=network.reserved_net)
 
@@ -1087,5 +1533,6 @@ class Network(db.Model):
 
 @event.listens_for(Network, 'before_update')
 def network_before_update(mapper, connection, target):
+    lock_reservations(connection)
     Network.static_net_changed(connection, target)
     Network.reserved_net_changed(connection, target)
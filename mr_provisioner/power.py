@@ -0,0 +1,197 @@
+"""
+Concurrent power state queries.
+
+Each power state query is a synchronous ipmitool run against the machine's
+BMC, so asking for a whole listing one machine at a time takes as long as
+all of them added up. get_power_states() hands the queries to the BMC
+scheduler instead, which runs them concurrently, bounded per BMC (several
+machines, e.g. moonshot cartridges, can share one), and returns whatever
+answered within `POWER_STATE_TIMEOUT` seconds.
+
+Results are stored in the PowerState table, kept up to date for every
+machine by the poll_power command. Reads are served from there unless the
+stored state is older than `POWER_STATE_MAX_AGE` seconds (e.g. the poller is
+not running) or a fresh state was explicitly asked for.
+
+BMCs that keep failing are not asked at all for a while (see bmc_health);
+their machines are reported as STATE_BMC_UNREACHABLE straight away. The
+poller also stores the health of every BMC it polled.
+"""
+
+import logging
+import time
+from concurrent.futures import wait
+
+from flask import current_app
+
+from mr_provisioner.bmc_health import BMCUnreachable
+from mr_provisioner.bmc_scheduler import scheduler, snapshot, SchedulerTimeout
+from mr_provisioner.bmc_types import BMCError, resolve_bmc_type
+
+
+logger = logging.getLogger('power')
+
+STATE_UNKNOWN = 'unknown'
+STATE_BMC_ERROR = 'Unknown (BMC error)'
+STATE_TIMEOUT = 'Unknown (timeout)'
+STATE_BMC_UNREACHABLE = 'Unknown (BMC unreachable)'
+
+# Power states as understood by Machine.set_power, and the boot device the
+# reboot variants select first.
+POWER_CHANGES = ['on', 'off', 'reboot', 'pxe_reboot', 'disk_reboot', 'bios_reboot']
+REBOOT_BOOTDEVS = {
+    'pxe_reboot': 'pxe',
+    'disk_reboot': 'disk',
+    'bios_reboot': 'bios',
+}
+
+
+def query_power(machine):
+    return resolve_bmc_type(machine.bmc.bmc_type).get_power(machine)
+
+
+def power_state_of(machine_id, result):
+    """Call result() for the power state of machine_id, turning errors into one of the STATE_* values."""
+    try:
+        return result()
+    except SchedulerTimeout:
+        return STATE_TIMEOUT
+    except BMCUnreachable:
+        return STATE_BMC_UNREACHABLE
+    except BMCError:
+        return STATE_BMC_ERROR
+    except Exception as e:
+        logger.error('power state query for machine %d failed: %s' % (machine_id, str(e)))
+        return STATE_BMC_ERROR
+
+
+def change_power(machine, power_state):
+    """
+    Machine.set_power for a snapshot. Returns the resulting power state if
+    the BMC reported it along the way, otherwise None. Raises BMCError.
+    """
+    bmc_type = resolve_bmc_type(machine.bmc.bmc_type)
+
+    if power_state in REBOOT_BOOTDEVS:
+        return bmc_type.boot_and_reset(machine, REBOOT_BOOTDEVS[power_state])
+
+    if power_state == 'reboot':
+        power_state = 'reset' if bmc_type.get_power(machine) == 'on' else 'on'
+
+    bmc_type.set_power(machine, power_state)
+    return None
+
+
+def run_all(fn, machines, timeout, coalesce=None):
+    """
+    Schedule fn(snapshot) for each of machines, which must all have a BMC.
+    Returns {machine id: future} for the calls that completed within
+    timeout seconds, and the ids of those that did not.
+    """
+    deadline = time.monotonic() + timeout
+
+    futures = {}
+    for machine in machines:
+        futures[scheduler.submit(fn, snapshot(machine), coalesce=coalesce, deadline=deadline)] = machine.id
+
+    if not futures:
+        return {}, []
+
+    # Calls not started by the deadline are dropped by the scheduler;
+    # running ones finish in the background, bounded by the ipmitool
+    # timeout.
+    done, not_done = wait(futures, timeout=max(0, deadline - time.monotonic()))
+
+    timed_out = [futures[f] for f in not_done]
+    timed_out.extend(futures[f] for f in done if isinstance(f.exception(), SchedulerTimeout))
+    if timed_out:
+        logger.warning('%d of %d BMC requests timed out after %.1fs' % (len(timed_out), len(futures), timeout))
+
+    return {futures[f]: f for f in done if futures[f] not in timed_out}, timed_out
+
+
+def query_power_states(machines, timeout=None):
+    """
+    Return {machine id: power state} for machines, as reported by their
+    BMCs. Machines whose BMC did not answer within timeout (default
+    POWER_STATE_TIMEOUT) seconds are reported as STATE_TIMEOUT.
+    """
+    if timeout is None:
+        timeout = current_app.config['POWER_STATE_TIMEOUT']
+
+    states = {m.id: STATE_UNKNOWN for m in machines if not m.bmc}
+    done, timed_out = run_all(query_power, [m for m in machines if m.bmc], timeout, coalesce='get_power')
+    for machine_id, future in done.items():
+        states[machine_id] = power_state_of(machine_id, future.result)
+    for machine_id in timed_out:
+        states[machine_id] = STATE_TIMEOUT
+
+    return states
+
+
+def record_power_states(states):
+    from mr_provisioner.models import PowerState
+
+    # Not worth remembering that there was no answer.
+    PowerState.record({machine_id: state for machine_id, state in states.items()
+                       if state not in (STATE_UNKNOWN, STATE_TIMEOUT)})
+
+
+def record_bmc_health():
+    """Store the health of the BMCs this process saw change, for the admin UI."""
+    from mr_provisioner.models import BMCHealthState
+
+    BMCHealthState.record(scheduler.health.changed())
+
+
+def get_power_states(machines, *, fresh=False, timeout=None):
+    """
+    Return {machine id: power state}, from the PowerState table where
+    possible and querying the BMCs (concurrently) otherwise.
+    """
+    from mr_provisioner.models import PowerState
+
+    states = {}
+    if not fresh:
+        states = PowerState.by_machine_ids([m.id for m in machines if m.bmc],
+                                           current_app.config['POWER_STATE_MAX_AGE'])
+
+    stale = [m for m in machines if m.id not in states]
+    if stale:
+        live = query_power_states(stale, timeout=timeout)
+        record_power_states(live)
+        states.update(live)
+
+    return states
+
+
+def get_power_state(machine, *, fresh=False):
+    return get_power_states([machine], fresh=fresh)[machine.id]
+
+
+def poll_power_states(timeout):
+    """Refresh the stored power state of every machine with a BMC."""
+    from mr_provisioner.models import Machine
+
+    machines = Machine.query.filter(Machine.bmc_id.isnot(None)).all()
+    states = query_power_states(machines, timeout=timeout)
+    record_power_states(states)
+    record_bmc_health()
+    return states
+
+
+class PowerStateBatch:
+    """Power states of a list of machines, all looked up at once on first access."""
+
+    def __init__(self, machines):
+        self.machines = machines
+        self._ids = {m.id for m in machines}
+        self._states = {}
+
+    def __contains__(self, machine):
+        return machine.id in self._ids
+
+    def get(self, machine, fresh=False):
+        if fresh not in self._states:
+            self._states[fresh] = get_power_states(self.machines, fresh=fresh)
+        return self._states[fresh].get(machine.id, STATE_UNKNOWN)
@@ -1,51 +1,91 @@
-from flask import Blueprint, abort, request, send_from_directory, safe_join
+from flask import Blueprint, abort, request, send_from_directory, safe_join, jsonify
 
 import logging
-import re
 import os
+from functools import partial
 
-from mr_provisioner.models import Machine, MachineEvent
+from mr_provisioner.models import Machine, MachineEvent, Interface, Preseed, Image, Token
 from mr_provisioner import db
+from mr_provisioner.util.cache import ModelCache
+from mr_provisioner.tftp.paths import classify_path, STATIC, PXELINUX, IPXE
 from sqlalchemy.exc import DatabaseError
 
 from flask import current_app as app
 
-MAC_FILE_REGEX = r"/01-([\da-fA-F]{2}-[\da-fA-F]{2}-[\da-fA-F]{2}-[\da-fA-F]{2}-[\da-fA-F]{2}-[\da-fA-F]{2})"
-DEFAULT_FILE_REGEXES = ["/pxelinux.cfg/default", "/efidefault"]
-
 mod = Blueprint('tftp', __name__, template_folder='templates')
 logger = logging.getLogger('tftp')
 
+# Rendered configs keyed by (MAC or None for the default config, bootloader).
+# Only changes made through this process invalidate it, so only the web
+# process, which those are made through, uses it. Bounded, as clients pick
+# the MACs.
+config_cache = ModelCache('tftp-config', max_size=10000).invalidate_on(Interface, Machine, Preseed, Image)
+
 
 def clean_filename(filename):
     return filename.replace("..", "")
 
 
-def is_pxelinux_path(filename):
-    return (filename.find("pxelinux.cfg") >= 0)
+def file_prefix(bootloader):
+    if app.config['NETBOOT_FILE_PROTOCOL'] == 'http':
+        host = app.config['NETBOOT_HTTP_HOST']
+        if bootloader in (PXELINUX, IPXE):
+            return "http://%s/boot/" % host
+        return "(http,%s)/boot/" % host
+    else:
+        if bootloader == PXELINUX:
+            return ""
+        elif bootloader == IPXE:
+            # iPXE resolves paths relative to the script's own URI
+            return "/"
+        return "(tftp)/"
 
 
-def render_config(is_pxelinux, machine):
+def render_config(bootloader, machine):
     if (machine and machine.netboot_enabled):
-        template_file = "pxelinux.netboot.tmpl" if is_pxelinux else "grub.netboot.tmpl"
+        template_file = "%s.netboot.tmpl" % bootloader
     else:
-        template_file = "pxelinux.local.tmpl" if is_pxelinux else "grub.local.tmpl"
+        template_file = "%s.local.tmpl" % bootloader
 
     template = app.config['TFTP_JINJA_ENV'].get_template(template_file)
-    return template.render(machine=machine, config=app.config)
+    return template, template.render(machine=machine, config=app.config,
+                                     file_prefix=file_prefix(bootloader))
+
+
+def machine_config(mac, bootloader):
+    machine = Machine.by_mac(mac) if mac else None
+    template, config = render_config(bootloader, machine)
+    return (machine.id if machine else None, template, config)
+
+
+def cached_config(mac, bootloader):
+    key = (mac, bootloader)
+    compute = partial(machine_config, mac, bootloader)
+    machine_id, template, config = config_cache.get_or_compute(key, compute)
 
+    # Pick up edits to the netboot templates themselves.
+    if not template.is_up_to_date:
+        config_cache.invalidate()
+        machine_id, template, config = config_cache.get_or_compute(key, compute)
 
-def handle_config_request(client_ip, filename):
-    m = re.search(MAC_FILE_REGEX, filename)
-    machine = Machine.by_mac(m.group(1).replace('-', ':').lower()) if m else None
+    return machine_id, config
 
-    use_def_config = any(re.search(regex, filename) for regex in DEFAULT_FILE_REGEXES)
 
-    if machine:
-        MachineEvent.tftp_request(machine.id, None, filename)
+def handle_config_request(client_ip, filename, cached=True):
+    bootloader, mac = classify_path(filename)
+    if bootloader == STATIC:
+        return None
+
+    if cached:
+        machine_id, config = cached_config(mac, bootloader)
+    else:
+        machine_id, _, config = machine_config(mac, bootloader)
+
+    if machine_id:
+        MachineEvent.tftp_request(machine_id, None, filename)
 
-    if machine or use_def_config:
-        return render_config(is_pxelinux_path(filename), machine)
+    if machine_id or not mac:
+        return config
     else:
         return None
 
@@ -75,6 +115,16 @@ def get_file_tftp():
     return "", 404
 
 
+@mod.route('/stats', methods=['GET'])
+def stats():
+    # Same API tokens as /api/v1/
+    token_str = request.headers.get('Authorization', '').replace('Bearer ', '')
+    if not token_str or not Token.by_token(token_str):
+        return '', 401
+
+    return jsonify(config_cache.stats), 200
+
+
 @mod.errorhandler(DatabaseError)
 def handle_db_error(error):
     db.session.rollback()
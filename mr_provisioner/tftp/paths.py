@@ -0,0 +1,68 @@
+"""
+Classification of requested TFTP paths.
+
+Bootloaders probe a series of per-MAC and default config names; all of the
+conventions we answer are folded into a single compiled regex so that
+classifying a path costs one match, whatever it turns out to be:
+
+  pxelinux:  pxelinux.cfg/01-aa-bb-cc-dd-ee-ff, pxelinux.cfg/default
+  GRUB:      grub.cfg-01-aa-bb-cc-dd-ee-ff, 01-aa-bb-cc-dd-ee-ff, efidefault
+  iPXE:      aa-bb-cc-dd-ee-ff.ipxe, 01-aa-bb-cc-dd-ee-ff.ipxe,
+             mac-aabbccddeeff.ipxe, default.ipxe
+
+Each may be preceded by any directory. Anything else is a static file.
+"""
+
+import re
+
+
+STATIC = 'static'
+PXELINUX = 'pxelinux'
+GRUB = 'grub'
+IPXE = 'ipxe'
+
+_HEX = r'[0-9a-fA-F]{2}'
+_MAC_HYPHEN = '-'.join([_HEX] * 6)
+_MAC_RAW = _HEX * 6
+
+_PATH_REGEX = re.compile(r"""
+    (?:[^/]*/)*?(?:
+        pxelinux\.cfg/(?:01-(?P<pxelinux_mac>{hyphen})|(?P<pxelinux_default>default))
+      | (?:grub\.cfg-)?01-(?P<grub_mac>{hyphen})
+      | (?P<grub_default>efidefault)
+      | (?:(?:01-)?(?P<ipxe_mac>{hyphen})|mac-(?P<ipxe_mac_raw>{raw}))\.ipxe
+      | (?P<ipxe_default>default\.ipxe)
+    )
+    """.format(hyphen=_MAC_HYPHEN, raw=_MAC_RAW), re.VERBOSE)
+
+_GROUPS = {
+    'pxelinux_mac': PXELINUX,
+    'pxelinux_default': PXELINUX,
+    'grub_mac': GRUB,
+    'grub_default': GRUB,
+    'ipxe_mac': IPXE,
+    'ipxe_mac_raw': IPXE,
+    'ipxe_default': IPXE,
+}
+
+
+def classify_path(filename):
+    """
+    Return (kind, mac) for a requested path: kind is one of PXELINUX, GRUB
+    or IPXE for config requests, with mac set (lowercase, colon separated)
+    for per-MAC configs and None for the default one, or (STATIC, None).
+    """
+    m = _PATH_REGEX.fullmatch(filename)
+    if not m:
+        return STATIC, None
+
+    group = m.lastgroup
+    kind = _GROUPS[group]
+
+    if group.endswith('_default'):
+        return kind, None
+
+    mac = m.group(group).lower()
+    if group == 'ipxe_mac_raw':
+        return kind, ':'.join(mac[i:i + 2] for i in range(0, 12, 2))
+    return kind, mac.replace('-', ':')
@@ -0,0 +1,371 @@
+"""
+Built-in TFTP server (RFC 1350) with option negotiation (RFC 2347) for
+blksize (RFC 2348), timeout/tsize (RFC 2349) and windowsize (RFC 7440).
+
+Static files are served straight from TFTP_ROOT; any other path is handed to
+the same handle_config_request() used by the HTTP-proxied /tftp/ endpoint,
+so per-MAC GRUB/pxelinux configs work the same way without the extra hop.
+Machines are edited through the web process, so configs are rendered from
+the database on every request rather than from the web process's cache.
+
+Config lookups and file reads run in the loop's default executor, a window of
+blocks per read, so a slow disk only holds up the transfers waiting on it.
+"""
+
+import asyncio
+import io
+import logging
+import os
+import struct
+
+from flask import safe_join
+
+from mr_provisioner.tftp.controllers import clean_filename, handle_config_request
+
+
+logger = logging.getLogger('tftp')
+
+OP_RRQ = 1
+OP_WRQ = 2
+OP_DATA = 3
+OP_ACK = 4
+OP_ERROR = 5
+OP_OACK = 6
+
+ERR_UNDEFINED = 0
+ERR_NOT_FOUND = 1
+ERR_ACCESS = 2
+ERR_ILLEGAL_OP = 4
+ERR_UNKNOWN_TID = 5
+ERR_OPTIONS = 8
+
+DEFAULT_BLKSIZE = 512
+MIN_BLKSIZE = 8
+MAX_BLKSIZE = 65464
+DEFAULT_TIMEOUT = 1.0
+MAX_WINDOWSIZE = 64
+MAX_RETRIES = 5
+
+
+def error_packet(code, message):
+    return struct.pack('!HH', OP_ERROR, code) + message.encode('ascii', 'replace') + b'\0'
+
+
+def parse_request(data):
+    """Parse an RRQ/WRQ into (opcode, filename, mode, options)."""
+    opcode, = struct.unpack('!H', data[:2])
+    fields = data[2:].split(b'\0')
+    if len(fields) < 3 or fields[-1] != b'':
+        raise ValueError('malformed request')
+
+    fields = [f.decode('ascii', 'replace') for f in fields[:-1]]
+    filename, mode = fields[0], fields[1].lower()
+
+    options = {}
+    rest = fields[2:]
+    for i in range(0, len(rest) - 1, 2):
+        options[rest[i].lower()] = rest[i + 1]
+
+    return opcode, filename, mode, options
+
+
+def negotiate(options, size):
+    """Return (accepted options, blksize, windowsize, timeout)."""
+    accepted = {}
+    blksize = DEFAULT_BLKSIZE
+    windowsize = 1
+    timeout = DEFAULT_TIMEOUT
+
+    try:
+        if 'blksize' in options:
+            blksize = max(MIN_BLKSIZE, min(int(options['blksize']), MAX_BLKSIZE))
+            accepted['blksize'] = blksize
+
+        if 'windowsize' in options:
+            windowsize = max(1, min(int(options['windowsize']), MAX_WINDOWSIZE))
+            accepted['windowsize'] = windowsize
+
+        if 'timeout' in options:
+            t = int(options['timeout'])
+            if 1 <= t <= 255:
+                timeout = float(t)
+                accepted['timeout'] = t
+
+        if 'tsize' in options and size is not None:
+            accepted['tsize'] = size
+    except ValueError:
+        # Malformed option values are ignored rather than failing the transfer
+        pass
+
+    return accepted, blksize, windowsize, timeout
+
+
+class Transfer(asyncio.DatagramProtocol):
+    """A single read transfer, bound to its own ephemeral port (TID)."""
+
+    def __init__(self, loop, source, remote, *, oack=None, blksize=DEFAULT_BLKSIZE,
+                 windowsize=1, timeout=DEFAULT_TIMEOUT):
+        self.loop = loop
+        self.source = source
+        self.remote = remote
+        self.oack = oack
+        self.blksize = blksize
+        self.windowsize = windowsize
+        self.timeout = timeout
+
+        self.transport = None
+        self.acked = 0
+        self.last_block = None
+        self.retries = 0
+        self.timer = None
+        self.reading = False
+        self.closed = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.oack:
+            self._send_oack()
+        else:
+            self._send_window()
+
+    def connection_lost(self, exc):
+        self._cancel_timer()
+        self.closed = True
+        if not self.reading:
+            # Otherwise closed once the read in flight is done
+            self.source.close()
+
+    def _cancel_timer(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def _arm_timer(self):
+        self._cancel_timer()
+        self.timer = self.loop.call_later(self.timeout, self._on_timeout)
+
+    def _send_oack(self):
+        payload = b''.join(k.encode('ascii') + b'\0' + str(v).encode('ascii') + b'\0'
+                           for k, v in self.oack.items())
+        self.transport.sendto(struct.pack('!H', OP_OACK) + payload, self.remote)
+        self._arm_timer()
+
+    def _send_window(self):
+        if self.reading:
+            # The window is sent from the latest ACK once the read is done
+            return
+
+        first = self.acked + 1
+        count = self.windowsize
+        if self.last_block is not None:
+            count = min(count, self.last_block - self.acked)
+
+        self.reading = True
+        future = self.loop.run_in_executor(None, self.source.read_blocks, first, count, self.blksize)
+        future.add_done_callback(lambda f: self._window_read(f, first))
+
+    def _window_read(self, future, first):
+        self.reading = False
+        if self.closed:
+            self.source.close()
+            return
+        if self.transport.is_closing():
+            return
+
+        try:
+            blocks = future.result()
+        except OSError as e:
+            logger.error('TFTP transfer to %s:%d failed: %s' % (self.remote + (str(e),)))
+            self.transport.sendto(error_packet(ERR_UNDEFINED, 'Read error'), self.remote)
+            self.transport.close()
+            return
+
+        if first != self.acked + 1:
+            # ACKed further while reading
+            self._send_window()
+            return
+
+        for block, data in enumerate(blocks, first):
+            if len(data) < self.blksize:
+                self.last_block = block
+            self.transport.sendto(struct.pack('!HH', OP_DATA, block & 0xffff) + data, self.remote)
+        self._arm_timer()
+
+    def _on_timeout(self):
+        self.retries += 1
+        if self.retries > MAX_RETRIES:
+            logger.warning('TFTP transfer to %s:%d timed out' % self.remote)
+            self.transport.close()
+            return
+
+        if self.acked == 0 and self.oack:
+            self._send_oack()
+        else:
+            self._send_window()
+
+    def _absolute_block(self, wire_block):
+        # Map a 16-bit block number back to the block inside the current
+        # window (block numbers roll over after 65535).
+        for block in range(self.acked, self.acked + self.windowsize + 1):
+            if block & 0xffff == wire_block:
+                return block
+        return None
+
+    def datagram_received(self, data, addr):
+        if addr != self.remote:
+            self.transport.sendto(error_packet(ERR_UNKNOWN_TID, 'Unknown transfer ID'), addr)
+            return
+
+        if len(data) < 4:
+            return
+
+        opcode, block = struct.unpack('!HH', data[:4])
+        if opcode == OP_ERROR:
+            logger.info('TFTP transfer aborted by %s:%d' % self.remote)
+            self.transport.close()
+            return
+
+        if opcode != OP_ACK:
+            self.transport.sendto(error_packet(ERR_ILLEGAL_OP, 'Illegal TFTP operation'), addr)
+            self.transport.close()
+            return
+
+        block = self._absolute_block(block)
+        if block is None or block < self.acked or (block == self.acked and block != 0):
+            # Duplicate or stray ACK
+            return
+
+        self.acked = block
+        self.retries = 0
+
+        if self.last_block is not None and self.acked >= self.last_block:
+            self._cancel_timer()
+            self.transport.close()
+            return
+
+        self._send_window()
+
+    def error_received(self, exc):
+        logger.warning('TFTP transfer to %s:%d failed: %s' % (self.remote + (str(exc),)))
+        self.transport.close()
+
+
+class FileSource:
+    def __init__(self, path):
+        self.f = open(path, 'rb')
+        self.size = os.fstat(self.f.fileno()).st_size
+
+    def read_blocks(self, first, count, blksize):
+        """Read up to count blocks from block first on, stopping after a short (last) block."""
+        self.f.seek((first - 1) * blksize)
+        data = self.f.read(count * blksize)
+
+        blocks = []
+        for i in range(count):
+            blocks.append(data[i * blksize:(i + 1) * blksize])
+            if len(blocks[-1]) < blksize:
+                break
+        return blocks
+
+    def close(self):
+        self.f.close()
+
+
+class BytesSource(FileSource):
+    def __init__(self, data):
+        self.f = io.BytesIO(data)
+        self.size = len(data)
+
+
+class TFTPServer(asyncio.DatagramProtocol):
+    """Listens for requests on the well-known port and spawns a Transfer per RRQ."""
+
+    def __init__(self, app, loop, host):
+        self.app = app
+        self.loop = loop
+        self.host = host
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            opcode, filename, mode, options = parse_request(data)
+        except (ValueError, struct.error):
+            self.transport.sendto(error_packet(ERR_ILLEGAL_OP, 'Malformed request'), addr)
+            return
+
+        if opcode == OP_WRQ:
+            self.transport.sendto(error_packet(ERR_ACCESS, 'Read-only server'), addr)
+            return
+        elif opcode != OP_RRQ:
+            self.transport.sendto(error_packet(ERR_ILLEGAL_OP, 'Illegal TFTP operation'), addr)
+            return
+
+        # Config lookups hit the database, keep them off the event loop.
+        future = self.loop.run_in_executor(None, self.resolve, addr[0], filename)
+        future.add_done_callback(lambda f: self._start_transfer(f, addr, options))
+
+    def resolve(self, client_ip, filename):
+        filename = clean_filename(filename.lstrip('/'))
+        logger.info("TFTP Request received for filename %s, from ip  %s" % (filename, client_ip))
+
+        with self.app.app_context():
+            path = safe_join(self.app.config['TFTP_ROOT'], filename)
+            if os.path.isfile(path):
+                return FileSource(path)
+
+            config = handle_config_request(client_ip, filename, cached=False)
+            if config:
+                return BytesSource(config.encode('utf-8'))
+
+        return None
+
+    def _start_transfer(self, future, addr, options):
+        try:
+            source = future.result()
+        except Exception as e:
+            logger.error('TFTP request from %s:%d failed: %s' % (addr + (str(e),)))
+            self.transport.sendto(error_packet(ERR_UNDEFINED, 'Internal error'), addr)
+            return
+
+        if source is None:
+            self.transport.sendto(error_packet(ERR_NOT_FOUND, 'File not found'), addr)
+            return
+
+        oack, blksize, windowsize, timeout = negotiate(options, source.size)
+
+        endpoint = self.loop.create_datagram_endpoint(
+            lambda: Transfer(self.loop, source, addr, oack=oack, blksize=blksize,
+                             windowsize=windowsize, timeout=timeout),
+            local_addr=(self.host, 0))
+        future = asyncio.ensure_future(endpoint, loop=self.loop)
+        future.add_done_callback(lambda f: self._transfer_started(f, source, addr))
+
+    def _transfer_started(self, future, source, addr):
+        try:
+            future.result()
+        except (Exception, asyncio.CancelledError) as e:
+            # No Transfer took over the source
+            source.close()
+            logger.error('TFTP transfer to %s:%d failed to start: %s' % (addr + (str(e),)))
+            self.transport.sendto(error_packet(ERR_UNDEFINED, 'Internal error'), addr)
+
+
+def create_server(app, loop, host, port):
+    endpoint = loop.create_datagram_endpoint(lambda: TFTPServer(app, loop, host),
+                                             local_addr=(host, port))
+    return loop.run_until_complete(endpoint)
+
+
+def serve(app, host, port):
+    loop = asyncio.get_event_loop()
+    transport, _ = create_server(app, loop, host, port)
+    logger.info('TFTP server listening on %s:%d' % (host, port))
+
+    try:
+        loop.run_forever()
+    finally:
+        transport.close()
+        loop.close()
@@ -0,0 +1,109 @@
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+
+class ModelCache:
+    """
+    In-process cache for values derived from database rows.
+
+    The whole cache is dropped whenever one of the models it was registered
+    against (see `invalidate_on`) is inserted, updated or deleted, and again
+    when the transaction of each session that flushed such a change ends:
+    until then, other sessions still read the old rows. Values computed
+    concurrently with either are not stored, so a reader racing a writer
+    can never repopulate the cache with stale data.
+
+    With max_size set, the least recently used values are evicted beyond
+    that many, so that caches keyed on what clients send stay bounded.
+    """
+
+    def __init__(self, name, max_size=None):
+        self.name = name
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            try:
+                value = self._data[key]
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            except KeyError:
+                self.misses += 1
+                generation = self._generation
+
+        value = compute()
+
+        with self._lock:
+            if generation == self._generation:
+                self._data[key] = value
+                if self.max_size is not None and len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+            self.invalidations += 1
+
+    @property
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+            }
+
+    def _on_change(self, mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('modelcache_pending', set()).add(self)
+        self.invalidate()
+
+    def _transaction_end(self, session, done):
+        # Rows written by a flush become visible to other sessions (or
+        # disappear, on rollback) only once the transaction ends, so
+        # drop anything computed in between once more. Savepoints keep
+        # them pending until the enclosing transaction ends too.
+        pending = session.info.get('modelcache_pending')
+        if not pending or self not in pending:
+            return
+        if done:
+            pending.discard(self)
+        self.invalidate()
+
+    def _on_commit(self, session):
+        # Called before the transaction is closed
+        self._transaction_end(session, not session.transaction.nested)
+
+    def _on_rollback(self, session, previous_transaction):
+        self._transaction_end(session, not previous_transaction.nested)
+
+    def invalidate_on(self, *models):
+        for model in models:
+            for name in ('after_insert', 'after_update', 'after_delete'):
+                event.listen(model, name, self._on_change)
+
+        event.listen(Session, 'after_commit', self._on_commit)
+        event.listen(Session, 'after_soft_rollback', self._on_rollback)
+
+        return self
@@ -37,6 +37,8 @@ setup(
     python_requires='>=3, !=3.0.*, !=3.1.*, !=3.2.*, <4',
     install_requires=requires,
     extras_require={
+        # cipher suite 3 (AES) for the native IPMI client
+        'native-ipmi': ['cryptography'],
     },
     entry_points={
         'console_scripts':
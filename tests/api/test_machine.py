@@ -1,5 +1,5 @@
 import json
-from mr_provisioner.models import Machine
+from mr_provisioner.models import Machine, PowerState, Job
 
 def test_empty_machine_list_no_machines(client, valid_headers_nonadmin):
     r = client.get('/api/v1/machine', headers=valid_headers_nonadmin)
@@ -388,3 +388,88 @@ def test_change_subarch(client, valid_headers_nonadmin, valid_plain_machine, val
     assert data['initrd_id'] == valid_image_initrd.id
     assert data['kernel_id'] == valid_image_kernel.id
     assert data['netboot_enabled'] # is true
+
+
+def test_machine_power_stored(client, valid_headers_nonadmin, valid_plain_machine):
+    PowerState.record({valid_plain_machine.id: 'on'})
+
+    r = client.get('/api/v1/machine/%d/power' % valid_plain_machine.id, headers=valid_headers_nonadmin)
+    assert r.status_code == 200
+
+    data = json.loads(r.data.decode('utf-8'))
+    assert data == {'state': 'on'}
+
+
+def test_machines_power(client, valid_headers_nonadmin, machines_for_reservation):
+    m = machines_for_reservation
+    r = client.post('/api/v1/machine/power',
+                    headers=valid_headers_nonadmin,
+                    data=json.dumps({'state': 'off', 'machines': [m[0].id, m[1].id, m[2].id, 1000000]}))
+    assert r.status_code == 202
+
+    data = json.loads(r.data.decode('utf-8'))
+    job = Job.query.filter_by(machine_id=m[1].id).one()
+    assert data == {
+        'state': 'off',
+        'results': [
+            {'id': m[0].id, 'ok': False, 'error': 'permission denied'},
+            {'id': m[1].id, 'ok': True, 'error': None, 'job_id': job.id},
+            {'id': m[2].id, 'ok': False, 'error': 'no BMC configured'},
+            {'id': 1000000, 'ok': False, 'error': 'machine not found'},
+        ],
+    }
+    assert (job.action, job.params, job.status) == ('power', {'state': 'off'}, Job.QUEUED)
+
+
+def test_machines_power_query(client, valid_headers_admin, machines_for_reservation):
+    m = machines_for_reservation
+    r = client.post('/api/v1/machine/power',
+                    headers=valid_headers_admin,
+                    data=json.dumps({'state': 'on', 'q': '(= bmc_type "moonshot")'}))
+    assert r.status_code == 202
+
+    data = json.loads(r.data.decode('utf-8'))
+    assert [(res['id'], res['ok']) for res in data['results']] == [(m[1].id, True), (m[4].id, True)]
+    assert sorted(job.machine_id for job in Job.query.all()) == [m[1].id, m[4].id]
+
+
+def test_machines_power_bad_request(client, valid_headers_admin, machines_for_reservation):
+    r = client.post('/api/v1/machine/power',
+                    headers=valid_headers_admin,
+                    data=json.dumps({'state': 'on'}))
+    assert r.status_code == 400
+
+    r = client.post('/api/v1/machine/power',
+                    headers=valid_headers_admin,
+                    data=json.dumps({'state': 'on', 'machines': [], 'q': '(= name "machine0")'}))
+    assert r.status_code == 400
+
+
+def test_machine_power_job(client, db, valid_headers_nonadmin, valid_headers_admin, machines_for_reservation):
+    m = machines_for_reservation
+    r = client.post('/api/v1/machine/%d/power' % m[1].id,
+                    headers=valid_headers_nonadmin,
+                    data=json.dumps({'state': 'pxe_reboot'}))
+    assert r.status_code == 202
+
+    data = json.loads(r.data.decode('utf-8'))
+    assert data['state'] == 'pxe_reboot'
+    assert r.headers['Location'].endswith('/api/v1/job/%d' % data['job_id'])
+
+    r = client.get('/api/v1/job/%d' % data['job_id'], headers=valid_headers_nonadmin)
+    assert r.status_code == 200
+
+    job = json.loads(r.data.decode('utf-8'))
+    assert job['machine_id'] == m[1].id
+    assert job['action'] == 'power'
+    assert job['params'] == {'state': 'pxe_reboot'}
+    assert job['status'] == 'queued'
+
+    # Only the submitter and admins can look at a job
+    other_job = Job(machine_id=m[0].id, user=None, action='power', params={'state': 'on'})
+    db.session.add(other_job)
+    db.session.commit()
+    r = client.get('/api/v1/job/%d' % other_job.id, headers=valid_headers_nonadmin)
+    assert r.status_code == 403
+    r = client.get('/api/v1/job/%d' % other_job.id, headers=valid_headers_admin)
+    assert r.status_code == 200
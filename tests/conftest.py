@@ -1,3 +1,4 @@
+import contextlib
 import os
 import pytest
 import sqlalchemy
@@ -5,6 +6,7 @@ import tempfile
 import shutil
 from mr_provisioner import create_app
 from mr_provisioner import db as db_
+from mr_provisioner.bmc_scheduler import scheduler
 from mr_provisioner.models import User, Token, BMC, Machine, MachineUsers, Interface, Network, Image, Preseed, \
         Arch, Subarch
 
@@ -13,6 +15,10 @@ from mr_provisioner.models import User, Token, BMC, Machine, MachineUsers, Inter
 def app(request):
     test_config_path = os.environ.get('TEST_CONFIG', '')
     app = create_app(test_config_path)
+    # Events written from the background sink would bypass the per-test
+    # transaction, so write them through the session instead.
+    # Same for DiscoveredMAC sightings: tests flush them explicitly.
+    app.config.update(EVENTS_ASYNC=False, DHCP_SEEN_FLUSH_INTERVAL=0)
 
     ctx = app.app_context()
     ctx.push()
@@ -41,10 +47,39 @@ def tftp_root(app):
     shutil.rmtree(path)
 
 
+@pytest.fixture(scope='function', autouse=True)
+def bmc_health(app):
+    # Failures left over from earlier tests would trip the breakers.
+    scheduler.health.clear()
+
+
+class SavepointEngine:
+    """
+    Stands in for db.engine, running everything in savepoints of the test's
+    connection: writes made outside the session (power states, the event
+    sink) see the test's rows and are rolled back with them, and a failed
+    statement does not abort the test's transaction.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    @contextlib.contextmanager
+    def begin(self):
+        with self.connection.begin_nested():
+            yield self.connection
+
+    def execute(self, *args, **kwargs):
+        with self.begin() as connection:
+            return connection.execute(*args, **kwargs)
+
+
 @pytest.yield_fixture(scope='function')
 def db(app):
     connection = db_.engine.connect()
     transaction = connection.begin()
+    engine = SavepointEngine(connection)
+    db_.get_engine = lambda app=None, bind=None: engine
 
     options = dict(bind=connection, binds={})
     session = db_.create_scoped_session(options=options)
@@ -62,6 +97,7 @@ def db(app):
     yield db_
 
     session.remove()
+    del db_.get_engine
     transaction.rollback()
     connection.close()
 
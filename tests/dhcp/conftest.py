@@ -0,0 +1,22 @@
+import pytest
+from mr_provisioner.dhcp.controllers import boot_cache
+from mr_provisioner.dhcp import networks
+from mr_provisioner.dhcp.discovery import seen_tracker
+
+
+@pytest.fixture(scope='function', autouse=True)
+def clear_boot_cache():
+    # Test transactions are rolled back behind the session's back, so make
+    # sure nothing cached by a previous test leaks into the next one.
+    for cache in (boot_cache, networks.index_cache, networks.interface_cache):
+        cache.invalidate()
+    yield
+    for cache in (boot_cache, networks.index_cache, networks.interface_cache):
+        cache.invalidate()
+
+
+@pytest.fixture(scope='function', autouse=True)
+def clear_seen_tracker():
+    seen_tracker.clear()
+    yield
+    seen_tracker.clear()
@@ -0,0 +1,381 @@
+import json
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from mr_provisioner.dhcp.controllers import boot_cache
+from mr_provisioner.models import Interface, Lease, DiscoveredMAC, Network, ReservationTombstone
+from mr_provisioner.dhcp.discovery import seen_tracker
+from mr_provisioner.util.cache import ModelCache
+
+
+def test_ipv4_unknown_mac(client):
+    r = client.get('/dhcp/ipv4?hwaddr=00:de:ad:be:ef:00')
+    assert r.status_code == 404
+
+
+def test_ipv4_missing_hwaddr(client):
+    r = client.get('/dhcp/ipv4')
+    assert r.status_code == 400
+
+
+def test_ipv4_invalid_hwaddr(client):
+    size = boot_cache.stats['size']
+    r = client.get('/dhcp/ipv4?hwaddr=not-a-mac')
+    assert r.status_code == 400
+    assert boot_cache.stats['size'] == size
+
+
+def test_cache_max_size():
+    cache = ModelCache('test', max_size=2)
+    cache.get_or_compute('a', lambda: 1)
+    cache.get_or_compute('b', lambda: 2)
+    cache.get_or_compute('a', lambda: None)
+    cache.get_or_compute('c', lambda: 3)
+
+    # b was the least recently used
+    assert cache.get_or_compute('a', lambda: None) == 1
+    assert cache.get_or_compute('b', lambda: 'recomputed') == 'recomputed'
+    assert cache.stats['size'] == 2
+    assert cache.stats['evictions'] == 2
+
+
+def test_ipv4_netboot_disabled(client, valid_interface_1):
+    r = client.get('/dhcp/ipv4?hwaddr=%s' % valid_interface_1.mac)
+    assert r.status_code == 200
+
+    data = json.loads(r.data.decode('utf-8'))
+    assert data == {'options': []}
+
+
+def test_ipv4_netboot_bootloader(client, db, valid_interface_1, valid_subarch_bl):
+    machine = valid_interface_1.machine
+    machine.subarch_id = valid_subarch_bl.id
+    machine.netboot_enabled = True
+    db.session.commit()
+
+    r = client.get('/dhcp/ipv4?hwaddr=%s' % valid_interface_1.mac.upper())
+    assert r.status_code == 200
+
+    data = json.loads(r.data.decode('utf-8'))
+    assert data['options'] == [{'option': 67, 'value': valid_subarch_bl.bootloader.filename}]
+    assert 'next-server' in data
+
+
+def test_ipv4_cache_invalidated_on_change(client, db, valid_interface_1, valid_subarch_bl):
+    r = client.get('/dhcp/ipv4?hwaddr=%s' % valid_interface_1.mac)
+    data = json.loads(r.data.decode('utf-8'))
+    assert data['options'] == []
+
+    machine = valid_interface_1.machine
+    machine.subarch_id = valid_subarch_bl.id
+    machine.netboot_enabled = True
+    db.session.commit()
+
+    r = client.get('/dhcp/ipv4?hwaddr=%s' % valid_interface_1.mac)
+    data = json.loads(r.data.decode('utf-8'))
+    assert data['options'] == [{'option': 67, 'value': valid_subarch_bl.bootloader.filename}]
+
+    bootloader = valid_subarch_bl.bootloader
+    bootloader.filename = 'other/bootloader'
+    db.session.commit()
+
+    r = client.get('/dhcp/ipv4?hwaddr=%s' % valid_interface_1.mac)
+    data = json.loads(r.data.decode('utf-8'))
+    assert data['options'] == [{'option': 67, 'value': 'other/bootloader'}]
+
+
+def test_ipv4_cache_negative_entry_invalidated(client, db, valid_plain_machine):
+    r = client.get('/dhcp/ipv4?hwaddr=00:11:22:33:44:66')
+    assert r.status_code == 404
+
+    db.session.add(Interface(mac='00:11:22:33:44:66', machine_id=valid_plain_machine.id))
+    db.session.commit()
+
+    r = client.get('/dhcp/ipv4?hwaddr=00:11:22:33:44:66')
+    assert r.status_code == 200
+
+
+def test_ipv4_cache_pending_per_session(client, db, valid_interface_1, valid_subarch_bl):
+    machine = valid_interface_1.machine
+    machine.subarch_id = valid_subarch_bl.id
+    machine.netboot_enabled = True
+    db.session.flush()
+
+    # Another session committing doesn't end this one's transaction...
+    other = Session(bind=db.session.connection())
+    other.commit()
+    other.close()
+
+    # ...so what a reader computes from the rows as they were until then
+    # is dropped once this one commits.
+    boot_cache.get_or_compute(valid_interface_1.mac, lambda: 'stale')
+    db.session.commit()
+
+    assert boot_cache.get_or_compute(valid_interface_1.mac, lambda: 'fresh') == 'fresh'
+
+
+def test_lease(client):
+    r = client.post('/dhcp/ipv4/lease', data=json.dumps({'mac': '00:DE:AD:BE:EF:00', 'ipv4': '10.0.0.5',
+                                                         'duration': 3600}))
+    assert r.status_code == 201
+    lease = Lease.by_mac('00:de:ad:be:ef:00')
+    assert lease.ipv4 == '10.0.0.5'
+    last_seen = lease.last_seen
+
+    r = client.post('/dhcp/ipv4/lease', data=json.dumps({'mac': '00:de:ad:be:ef:00', 'ipv4': '10.0.0.6',
+                                                         'duration': 3600}))
+    assert r.status_code == 201
+    Lease.query.session.expire_all()
+    lease = Lease.by_mac('00:de:ad:be:ef:00')
+    assert lease.ipv4 == '10.0.0.6'
+    assert lease.last_seen >= last_seen
+    assert Lease.query.count() == 1
+
+
+def test_leases_batch(client):
+    Lease.upsert([{'mac': '00:de:ad:be:ef:01', 'ipv4': '10.0.0.1', 'duration': 3600}])
+
+    r = client.post('/dhcp/ipv4/leases', data=json.dumps([
+        {'mac': '00:de:ad:be:ef:01', 'ipv4': '10.0.0.11', 'duration': 3600},
+        {'mac': '00:de:ad:be:ef:02', 'ipv4': '10.0.0.2', 'duration': 3600},
+        {'mac': '00:de:ad:be:ef:02', 'ipv4': '10.0.0.12', 'duration': 3600},
+    ]))
+    assert r.status_code == 201
+
+    Lease.query.session.expire_all()
+    assert {lease.mac: lease.ipv4 for lease in Lease.query.all()} == {
+        '00:de:ad:be:ef:01': '10.0.0.11',
+        '00:de:ad:be:ef:02': '10.0.0.12',
+    }
+
+
+def test_lease_expiry(client, db, valid_interface_1):
+    r = client.post('/dhcp/ipv4/leases', data=json.dumps([
+        {'mac': valid_interface_1.mac, 'ipv4': '10.0.0.1', 'duration': 3600},
+        {'mac': '00:de:ad:be:ef:01', 'ipv4': '10.0.0.2', 'duration': 0},
+    ]))
+    assert r.status_code == 201
+    assert valid_interface_1.lease.ipv4 == '10.0.0.1'
+    assert Lease.active_by_mac('00:de:ad:be:ef:01') is None
+
+    assert Lease.sweep(retention_days=1) == (1, 0)
+    assert Lease.by_mac('00:de:ad:be:ef:01').expired
+
+    # Renewed
+    Lease.upsert([{'mac': '00:de:ad:be:ef:01', 'ipv4': '10.0.0.2', 'duration': 3600}])
+    Lease.query.session.expire_all()
+    assert not Lease.by_mac('00:de:ad:be:ef:01').expired
+    assert Lease.active_by_mac('00:de:ad:be:ef:01').ipv4 == '10.0.0.2'
+
+    Lease.upsert([{'mac': valid_interface_1.mac, 'ipv4': '10.0.0.1', 'duration': 0}])
+    assert Lease.sweep(retention_days=0) == (1, 1)
+    assert valid_interface_1.lease is None
+    assert Lease.by_mac(valid_interface_1.mac) is None
+    assert Lease.query.count() == 1
+
+
+def test_leases_invalid(client):
+    r = client.post('/dhcp/ipv4/leases', data=json.dumps([{'mac': 'nope', 'ipv4': '10.0.0.1', 'duration': 3600}]))
+    assert r.status_code == 400
+
+    r = client.post('/dhcp/ipv4/leases', data=json.dumps({'mac': '00:de:ad:be:ef:01', 'ipv4': '10.0.0.1',
+                                                          'duration': 3600}))
+    assert r.status_code == 400
+
+    r = client.post('/dhcp/ipv4/leases', data=json.dumps([]))
+    assert r.status_code == 201
+
+
+def get_reservations(client, query='', etag=None):
+    headers = {'If-None-Match': etag} if etag else {}
+    r = client.get('/dhcp/ipv4/reservations%s' % query, headers=headers)
+    data = json.loads(r.data.decode('utf-8')) if r.status_code == 200 else None
+    return r, data
+
+
+def test_reservations(client, db, valid_interface_1, valid_subarch_bl):
+    r, data = get_reservations(client)
+    assert r.status_code == 200
+    assert data['full']
+    assert data['reservations'] == [{'hw-address': valid_interface_1.mac}]
+
+    r, _ = get_reservations(client, etag=r.headers['ETag'])
+    assert r.status_code == 304
+
+    machine = valid_interface_1.machine
+    machine.subarch_id = valid_subarch_bl.id
+    machine.netboot_enabled = True
+    db.session.commit()
+
+    r, data = get_reservations(client, etag=r.headers['ETag'])
+    assert r.status_code == 200
+    assert data['reservations'] == [{
+        'hw-address': valid_interface_1.mac,
+        'next-server': client.application.config['DHCP_TFTP_PROXY_HOST'],
+        'option-data': [{'name': 'boot-file-name', 'code': 67, 'data': valid_subarch_bl.bootloader.filename}],
+    }]
+
+
+def test_reservations_since(client, db, valid_interface_1, valid_plain_machine):
+    other = Interface(mac='00:11:22:33:44:66', machine_id=valid_plain_machine.id)
+    db.session.add(other)
+    db.session.commit()
+
+    _, data = get_reservations(client)
+    version = data['version']
+
+    r, data = get_reservations(client, '?since=%d' % version)
+    assert not data['full']
+    assert data['reservations'] == []
+    assert data['deleted'] == []
+
+    valid_interface_1.reserved_ipv4 = '10.0.0.100'
+    db.session.commit()
+    db.session.delete(other)
+    db.session.commit()
+
+    r, data = get_reservations(client, '?since=%d' % version)
+    assert data['reservations'] == [{'hw-address': valid_interface_1.mac, 'ip-address': '10.0.0.100'}]
+    assert data['deleted'] == ['00:11:22:33:44:66']
+    assert data['version'] > version
+
+    # Deleting the machine deletes its interfaces
+    version = data['version']
+    db.session.delete(valid_plain_machine)
+    db.session.commit()
+
+    r, data = get_reservations(client, '?since=%d' % version)
+    assert data['reservations'] == []
+    assert data['deleted'] == [valid_interface_1.mac]
+
+    # Unknown versions get a full snapshot
+    r, data = get_reservations(client, '?since=%d' % (data['version'] + 1000))
+    assert data['full']
+
+    r, _ = get_reservations(client, '?since=abc')
+    assert r.status_code == 400
+
+
+def test_reservations_since_pruned_tombstones(client, db, valid_interface_1, valid_plain_machine):
+    macs = ['00:11:22:33:44:6%d' % i for i in range(3)]
+    for mac in macs:
+        db.session.add(Interface(mac=mac, machine_id=valid_plain_machine.id))
+    db.session.commit()
+    _, data = get_reservations(client)
+    before = data['version']
+
+    for mac in macs:
+        db.session.delete(Interface.query.filter_by(mac=mac).one())
+        db.session.commit()
+    _, data = get_reservations(client, '?since=%d' % before)
+    assert data['deleted'] == macs
+    versions = [t.version for t in ReservationTombstone.query.order_by(ReservationTombstone.version)]
+
+    # The first two are past retention: only the first is deleted, the
+    # second marks how far back changes can still be told.
+    ReservationTombstone.query.filter(ReservationTombstone.version.in_(versions[:2])) \
+        .update({'deleted_at': datetime.utcnow() - timedelta(days=31)}, synchronize_session=False)
+    db.session.commit()
+    assert ReservationTombstone.prune(30) == 1
+    assert ReservationTombstone.prune(30) == 0
+
+    _, data = get_reservations(client, '?since=%d' % before)
+    assert data['full']
+    _, data = get_reservations(client, '?since=%d' % versions[1])
+    assert not data['full']
+    assert data['deleted'] == macs[2:]
+
+
+def post_seen(client, mac, hostname):
+    return client.post('/dhcp/ipv4/seen', data=json.dumps({
+        'discover': True,
+        'mac': mac,
+        'options': [{'option': 12, 'value': hostname}],
+    }))
+
+
+def test_seen(client, db):
+    r = post_seen(client, '00:DE:AD:BE:EF:00', 'foo')
+    assert r.status_code == 202
+    discovered = DiscoveredMAC.by_mac('00:de:ad:be:ef:00')
+    assert discovered.info['hostname'] == 'foo'
+    first_seen = discovered.last_seen
+    assert seen_tracker.writes == 1
+
+    # Same info again: not written until flushed
+    r = post_seen(client, '00:de:ad:be:ef:00', 'foo')
+    assert r.status_code == 202
+    assert seen_tracker.writes == 1
+    assert seen_tracker.debounced == 1
+
+    assert seen_tracker.flush() == 1
+    DiscoveredMAC.query.session.expire_all()
+    assert DiscoveredMAC.by_mac('00:de:ad:be:ef:00').last_seen > first_seen
+    assert seen_tracker.flush() == 0
+
+    # Changed info is written straight away
+    r = post_seen(client, '00:de:ad:be:ef:00', 'bar')
+    assert r.status_code == 202
+    assert seen_tracker.writes == 2
+    DiscoveredMAC.query.session.expire_all()
+    assert DiscoveredMAC.by_mac('00:de:ad:be:ef:00').info['hostname'] == 'bar'
+    assert DiscoveredMAC.query.count() == 1
+
+
+def test_seen_known_mac(client, valid_interface_1):
+    r = post_seen(client, valid_interface_1.mac, 'foo')
+    assert r.status_code == 200
+    assert DiscoveredMAC.query.count() == 0
+
+
+def kea_subnet(subnet_id, prefix, prefix_len, *first_ips):
+    return {
+        'subnetId': subnet_id,
+        'prefix': prefix,
+        'prefixLen': prefix_len,
+        'pools': [{'poolId': i, 'capacity': 10, 'firstIP': ip, 'lastIP': ip} for i, ip in enumerate(first_ips)],
+    }
+
+
+def post_subnet(client, mac, subnets):
+    r = client.post('/dhcp/ipv4/subnet', data=json.dumps({'mac': mac, 'subnets': subnets}))
+    data = json.loads(r.data.decode('utf-8')) if r.status_code == 200 else None
+    return r, data
+
+
+def test_subnet(client, db, valid_plain_machine):
+    network = Network(name='reserved', subnet='10.1.0.0/16', reserved_net='10.1.1.0/24')
+    db.session.add(network)
+    db.session.commit()
+    interface = Interface(mac='00:de:ad:be:ef:00', machine_id=valid_plain_machine.id, network_id=network.id,
+                          reserved_ipv4='10.1.1.5')
+    db.session.add(interface)
+    db.session.commit()
+
+    subnets = [
+        kea_subnet(1, '10.2.0.0', 16, '10.2.1.1'),
+        kea_subnet(2, '10.1.0.0', 16, '10.1.2.1'),
+        kea_subnet(3, '10.1.1.0', 24, '10.1.2.1', '10.1.1.10'),
+        kea_subnet(4, '10.1.0.0', 16, '10.1.1.1'),
+    ]
+    r, data = post_subnet(client, '00:DE:AD:BE:EF:00', subnets)
+    assert r.status_code == 200
+    assert data == {'subnetId': 3}
+
+    r, data = post_subnet(client, '00:de:ad:be:ef:00', subnets[:2])
+    assert data == {}
+
+    # Moving the reserved range clears the reservation
+    network.reserved_net = '10.1.2.0/24'
+    db.session.commit()
+    r, data = post_subnet(client, '00:de:ad:be:ef:00', subnets)
+    assert data == {'subnetId': None}
+
+
+def test_subnet_unknown(client, valid_interface_1):
+    r, _ = post_subnet(client, '00:de:ad:be:ef:00', [kea_subnet(1, '10.0.0.0', 20, '10.0.0.1')])
+    assert r.status_code == 404
+
+    # No reservation
+    r, data = post_subnet(client, valid_interface_1.mac, [kea_subnet(1, '10.0.0.0', 20, '10.0.0.1')])
+    assert r.status_code == 200
+    assert data == {'subnetId': None}
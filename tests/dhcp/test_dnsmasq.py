@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from mr_provisioner.dhcp.dnsmasq import DnsmasqSync, boot_tag, host_entry
+from mr_provisioner.models import Interface
+
+
+@pytest.fixture(scope='function')
+def dnsmasq_sync(tmpdir):
+    return DnsmasqSync(str(tmpdir.mkdir('hosts')), str(tmpdir.mkdir('opts')))
+
+
+def read(directory, name):
+    with open(os.path.join(directory, name)) as f:
+        return f.read()
+
+
+def test_host_entry():
+    assert host_entry({'hw-address': '00:11:22:33:44:55'}) == ('00:11:22:33:44:55\n', None)
+
+    tag = boot_tag('grubaa64.efi', '10.0.0.1')
+    line, (opts_tag, opts) = host_entry({
+        'hw-address': '00:11:22:33:44:55',
+        'ip-address': '10.0.0.5',
+        'next-server': '10.0.0.1',
+        'option-data': [{'name': 'boot-file-name', 'code': 67, 'data': 'grubaa64.efi'}],
+    })
+    assert line == '00:11:22:33:44:55,set:%s,10.0.0.5\n' % tag
+    assert opts_tag == tag
+    assert opts == 'tag:%s,option:bootfile-name,grubaa64.efi\ntag:%s,option:tftp-server,10.0.0.1\n' % (tag, tag)
+
+
+def test_sync(app, db, dnsmasq_sync, valid_interface_1, valid_plain_machine, valid_subarch_bl):
+    other = Interface(mac='00:11:22:33:44:66', machine_id=valid_plain_machine.id)
+    db.session.add(other)
+    db.session.commit()
+
+    # Left over from before
+    open(os.path.join(dnsmasq_sync.hostsdir, '00-de-ad-be-ef-00'), 'w').close()
+
+    assert dnsmasq_sync.sync()
+    assert sorted(os.listdir(dnsmasq_sync.hostsdir)) == ['00-11-22-33-44-55', '00-11-22-33-44-66']
+    assert read(dnsmasq_sync.hostsdir, '00-11-22-33-44-55') == '00:11:22:33:44:55\n'
+    assert os.listdir(dnsmasq_sync.optsdir) == []
+    dnsmasq_sync.needs_reload = False
+
+    written = dnsmasq_sync.written
+    assert not dnsmasq_sync.sync()
+    assert dnsmasq_sync.written == written
+
+    # Only new or changed interfaces are written, and new files don't need a reload
+    db.session.add(Interface(mac='00:11:22:33:44:77', machine_id=valid_plain_machine.id))
+    db.session.commit()
+    assert not dnsmasq_sync.sync()
+    assert dnsmasq_sync.written == written + 1
+    assert read(dnsmasq_sync.hostsdir, '00-11-22-33-44-77') == '00:11:22:33:44:77\n'
+
+    valid_plain_machine.subarch_id = valid_subarch_bl.id
+    valid_plain_machine.netboot_enabled = True
+    db.session.commit()
+    assert dnsmasq_sync.sync()
+    tag = boot_tag(valid_subarch_bl.bootloader.filename, app.config['DHCP_TFTP_PROXY_HOST'])
+    assert read(dnsmasq_sync.hostsdir, '00-11-22-33-44-66') == '00:11:22:33:44:66,set:%s\n' % tag
+    assert os.listdir(dnsmasq_sync.optsdir) == [tag]
+    dnsmasq_sync.needs_reload = False
+
+    db.session.delete(valid_interface_1)
+    db.session.commit()
+    assert dnsmasq_sync.sync()
+    assert sorted(os.listdir(dnsmasq_sync.hostsdir)) == ['00-11-22-33-44-66', '00-11-22-33-44-77']
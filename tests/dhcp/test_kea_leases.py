@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from mr_provisioner.dhcp.kea_leases import LeaseFileTailer, parse_lease
+from mr_provisioner.models import Lease
+
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'kea-leases4.csv')
+ROW = '10.0.0.%d,00:de:ad:be:ef:%02x,,3600,4102444800,1,0,0,,0\n'
+
+
+@pytest.fixture(scope='function')
+def lease_file(tmpdir):
+    path = str(tmpdir.join('kea-leases4.csv'))
+    shutil.copy(SAMPLE, path)
+    return path
+
+
+def active_leases():
+    Lease.query.session.expire_all()
+    return {lease.mac: lease.ipv4 for lease in Lease.active()}
+
+
+def test_parse_lease():
+    with open(SAMPLE) as f:
+        columns = f.readline().strip().split(',')
+        leases = [parse_lease(columns, line, now=4102441200) for line in f]
+
+    assert leases == [
+        {'mac': '00:de:ad:be:ef:01', 'ipv4': '10.0.0.10', 'duration': 3600},
+        {'mac': '00:de:ad:be:ef:02', 'ipv4': '10.0.0.11', 'duration': 3600},
+        None,
+        {'mac': '00:de:ad:be:ef:03', 'ipv4': '10.0.0.13', 'duration': 0},
+        {'mac': '00:de:ad:be:ef:01', 'ipv4': '10.0.0.20', 'duration': 3600},
+        {'mac': '00:de:ad:be:ef:02', 'ipv4': '10.0.0.11', 'duration': 0},
+    ]
+    assert parse_lease(columns, '10.0.0.1,00:de:ad:be:ef:01\n') is None
+
+
+def test_tail(db, lease_file):
+    state_path = lease_file + '.offset'
+    tailer = LeaseFileTailer(lease_file, state_path, batch_size=2)
+    assert tailer.poll() == 6
+    assert active_leases() == {'00:de:ad:be:ef:01': '10.0.0.20'}
+    assert Lease.query.count() == 3
+
+    with open(state_path) as f:
+        assert json.load(f) == {'inode': os.stat(lease_file).st_ino, 'offset': os.path.getsize(lease_file)}
+    assert tailer.poll() == 0
+
+    # An incomplete row is left for later
+    with open(lease_file, 'a') as f:
+        f.write(ROW % (30, 0x30))
+        f.write((ROW % (31, 0x31))[:20])
+    assert tailer.poll() == 1
+
+    # A restarted tailer carries on where the last one stopped
+    with open(lease_file, 'a') as f:
+        f.write((ROW % (31, 0x31))[20:])
+    tailer = LeaseFileTailer(lease_file, state_path)
+    assert tailer.poll() == 1
+    assert active_leases() == {'00:de:ad:be:ef:01': '10.0.0.20', '00:de:ad:be:ef:30': '10.0.0.30',
+                               '00:de:ad:be:ef:31': '10.0.0.31'}
+
+
+def test_tail_rotated(db, lease_file):
+    tailer = LeaseFileTailer(lease_file, lease_file + '.offset')
+    assert tailer.poll() == 6
+
+    # LFC moves the file away and Kea starts a new one
+    with open(lease_file, 'a') as f:
+        f.write(ROW % (40, 0x40))
+    os.rename(lease_file, lease_file + '.2')
+    with open(SAMPLE) as sample, open(lease_file, 'w') as f:
+        f.write(sample.readline())
+        f.write(ROW % (41, 0x41))
+
+    assert tailer.poll() == 2
+    assert set(active_leases()) == {'00:de:ad:be:ef:01', '00:de:ad:be:ef:40', '00:de:ad:be:ef:41'}
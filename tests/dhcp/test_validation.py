@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from mr_provisioner.dhcp.validation import ValidationError, validate_lease, validate_seen, validate_subnet
+
+
+def test_lease():
+    assert validate_lease({'mac': '00:DE:AD:BE:EF:00', 'ipv4': '10.0.0.1', 'duration': 0}) == \
+        {'mac': '00:de:ad:be:ef:00', 'ipv4': '10.0.0.1', 'duration': 0}
+
+    for invalid in ({'mac': '00:de:ad:be:ef', 'ipv4': '10.0.0.1', 'duration': 0},
+                    {'mac': '00:de:ad:be:ef:00:11', 'ipv4': '10.0.0.1', 'duration': 0},
+                    {'mac': '00:de:ad:be:ef:00', 'ipv4': '10.0.0.256', 'duration': 0},
+                    {'mac': '00:de:ad:be:ef:00', 'ipv4': '10.0.0.1', 'duration': -1},
+                    {'mac': '00:de:ad:be:ef:00', 'ipv4': '10.0.0.1'},
+                    {'mac': '00:de:ad:be:ef:00', 'ipv4': '10.0.0.1', 'duration': 0, 'foo': 1},
+                    ['00:de:ad:be:ef:00']):
+        with pytest.raises(ValidationError):
+            validate_lease(invalid)
+
+    with pytest.raises(ValidationError) as e:
+        validate_lease({'mac': '00:de:ad:be:ef:00', 'ipv4': '10.0.0.1'})
+    assert str(e.value) == "Missing keys: 'duration'"
+
+
+def test_seen():
+    data = {'discover': True, 'mac': '00:de:ad:be:ef:00', 'options': [{'option': 12, 'value': 'foo'},
+                                                                       {'option': 93, 'value': 11}]}
+    assert validate_seen(data) == data
+
+    for options in ([{'option': -1, 'value': 'foo'}], [{'option': 12, 'value': 1.5}], [{'option': 12}], {}):
+        with pytest.raises(ValidationError):
+            validate_seen(dict(data, options=options))
+
+    with pytest.raises(ValidationError):
+        validate_seen(dict(data, discover=1))
+
+
+def test_subnet():
+    data = {'mac': '00:de:ad:be:ef:00', 'subnets': [{
+        'subnetId': 1, 'prefix': '10.0.0.0', 'prefixLen': 24,
+        'pools': [{'poolId': 1, 'capacity': 10, 'firstIP': '10.0.0.1', 'lastIP': '10.0.0.10'}],
+    }]}
+    assert validate_subnet(data)['subnets'][0]['pools'][0]['firstIP'] == 0x0a000001
+
+    with pytest.raises(ValidationError) as e:
+        validate_subnet(json.loads(json.dumps(data).replace('10.0.0.10', '10.0.0')))
+    assert str(e.value).splitlines() == ["Key 'subnets' error:", "Key 'pools' error:", "Key 'lastIP' error:",
+                                         "'10.0.0' is not an IPv4 address"]
+
+    with pytest.raises(ValidationError):
+        validate_subnet(dict(data, subnets=[dict(data['subnets'][0], prefixLen=33)]))
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from mr_provisioner.event_partitions import period_start, period_end, partition_name, create_partitions, \
+    list_partitions, maintain
+from mr_provisioner.models import MachineEvent, MachineEventType
+
+
+def test_daily_period():
+    start = period_start(datetime(2018, 6, 13, 17, 42), 'daily')
+    assert start == datetime(2018, 6, 13)
+    assert period_end(start, 'daily') == datetime(2018, 6, 14)
+    assert partition_name(start) == 'machine_event_p20180613'
+
+
+def test_weekly_period_starts_on_monday():
+    start = period_start(datetime(2018, 6, 13, 17, 42), 'weekly')
+    assert start == datetime(2018, 6, 11)
+    assert period_end(start, 'weekly') == datetime(2018, 6, 18)
+    assert partition_name(start) == 'machine_event_p20180611'
+
+
+@pytest.fixture(scope='function')
+def partitioned(db):
+    """
+    machine_event partitioned as by the machine_event_partitioning
+    migration, with only the DEFAULT partition; DDL is transactional, so
+    this is rolled back with the rest of the test.
+    """
+    connection = db.session.connection()
+    if int(connection.execute(text('SHOW server_version_num')).scalar()) < 110000:
+        pytest.skip('partitioning machine_event needs PostgreSQL 11')
+
+    connection.execute(text('ALTER TABLE machine_event RENAME TO machine_event_unpartitioned'))
+    connection.execute(text('ALTER TABLE machine_event_unpartitioned RENAME CONSTRAINT machine_event_pkey '
+                            'TO machine_event_unpartitioned_pkey'))
+    connection.execute(text("""
+        CREATE TABLE machine_event (
+            id INTEGER NOT NULL DEFAULT nextval('machine_event_id_seq'),
+            machine_id INTEGER REFERENCES machine (id) ON DELETE CASCADE,
+            user_id INTEGER REFERENCES "user" (id) ON DELETE SET NULL,
+            username VARCHAR,
+            date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            event_type INTEGER NOT NULL,
+            info JSONB,
+            PRIMARY KEY (id, date)
+        ) PARTITION BY RANGE (date)
+    """))
+    connection.execute(text('CREATE TABLE machine_event_default PARTITION OF machine_event DEFAULT'))
+    return connection
+
+
+def days_from_today(days):
+    return period_start(datetime.utcnow(), 'daily') + timedelta(days=days)
+
+
+def add_event(db, machine, date):
+    event = MachineEvent(event_type=MachineEventType.DHCP_REQ,
+                         info={'discover': True},
+                         machine_id=machine.id,
+                         user=None)
+    event.date = date
+    db.session.add(event)
+    db.session.commit()
+    return event.id
+
+
+def partition_of(connection, event_id):
+    return connection.execute(text('SELECT tableoid::regclass::text FROM machine_event WHERE id = :id'),
+                              id=event_id).scalar()
+
+
+def test_maintain_creates_partitions_ahead(db, partitioned, valid_plain_machine):
+    # Arrived before its partition existed
+    event_id = add_event(db, valid_plain_machine, days_from_today(2) + timedelta(hours=5))
+    assert partition_of(partitioned, event_id) == 'machine_event_default'
+
+    created, dropped = maintain(partitioned, 'daily', 3, 30)
+
+    expected = [partition_name(days_from_today(i)) for i in range(4)]
+    assert created == expected
+    assert dropped == []
+    assert [name for name, start, end in list_partitions(partitioned)] == expected
+    assert partition_of(partitioned, event_id) == partition_name(days_from_today(2))
+
+    assert maintain(partitioned, 'daily', 3, 30) == ([], [])
+
+
+def test_maintain_drops_expired_partitions(db, partitioned, valid_plain_machine):
+    create_partitions(partitioned, 'daily', days_from_today(-40), days_from_today(-38))
+    create_partitions(partitioned, 'daily', days_from_today(-10), days_from_today(-10))
+    old_event = add_event(db, valid_plain_machine, days_from_today(-39))
+    recent_event = add_event(db, valid_plain_machine, days_from_today(-10))
+
+    created, dropped = maintain(partitioned, 'daily', 0, 30)
+
+    assert created == [partition_name(days_from_today(0))]
+    assert dropped == [partition_name(days_from_today(i)) for i in (-40, -39, -38)]
+    assert [name for name, start, end in list_partitions(partitioned)] == \
+        [partition_name(days_from_today(-10)), partition_name(days_from_today(0))]
+    assert partition_of(partitioned, old_event) is None
+    assert partition_of(partitioned, recent_event) == partition_name(days_from_today(-10))
+
+
+def test_maintain_weekly_does_not_overlap_daily(partitioned):
+    create_partitions(partitioned, 'daily', days_from_today(0), days_from_today(0))
+
+    created, dropped = maintain(partitioned, 'weekly', 1, 30)
+
+    # This week already has a (daily) partition for today.
+    next_week = period_start(datetime.utcnow(), 'weekly') + timedelta(days=7)
+    assert created == [partition_name(next_week)]
+    assert dropped == []
@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta
+from mr_provisioner.models import MachineEvent, MachineEventType
+
+
+def add_event(db, machine, age_days):
+    event = MachineEvent(event_type=MachineEventType.DHCP_REQ,
+                         info={'discover': True},
+                         machine_id=machine.id,
+                         user=None)
+    event.date = datetime.utcnow() - timedelta(days=age_days)
+    db.session.add(event)
+    db.session.commit()
+
+
+def test_prune_deletes_only_old_events(db, valid_plain_machine):
+    for age in (0, 1, 29, 31, 40, 90):
+        add_event(db, valid_plain_machine, age)
+
+    deleted = MachineEvent.prune(30)
+    assert deleted == 3
+
+    events = MachineEvent.by_machine_id(valid_plain_machine.id)
+    assert len(events) == 3
+
+
+def test_prune_in_batches(db, valid_plain_machine):
+    for age in range(31, 38):
+        add_event(db, valid_plain_machine, age)
+
+    deleted = MachineEvent.prune(30, batch_size=2)
+    assert deleted == 7
+    assert MachineEvent.by_machine_id(valid_plain_machine.id) == []
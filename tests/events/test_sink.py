@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+from mr_provisioner.events import EventSink
+from mr_provisioner.models import MachineEvent, MachineEventType
+
+
+@pytest.fixture(scope='function')
+def sink(app, db, monkeypatch):
+    # The db fixture has the sink write in savepoints of the test's
+    # transaction.
+    monkeypatch.setitem(app.config, 'EVENTS_ASYNC', True)
+
+    sink = EventSink()
+    yield sink
+    sink.stop()
+
+
+@pytest.fixture(scope='function')
+def writes(sink, monkeypatch):
+    """Number of rows of each batch the sink writes."""
+    writes = []
+    write = sink._write
+
+    def counting_write(rows):
+        if rows:
+            writes.append(len(rows))
+        write(rows)
+
+    monkeypatch.setattr(sink, '_write', counting_write)
+    return writes
+
+
+def event(machine_id):
+    return MachineEvent(event_type=MachineEventType.DHCP_REQ,
+                        info={'discover': True},
+                        machine_id=machine_id,
+                        user=None)
+
+
+def stored(machine):
+    return MachineEvent.query.filter_by(machine_id=machine.id).count()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def block_writes(sink, monkeypatch):
+    """Make the sink's writes wait for the returned event to be set; writing is set while they do."""
+    writing = threading.Event()
+    release = threading.Event()
+    write = sink._write
+
+    def blocking_write(rows):
+        if rows:
+            writing.set()
+            release.wait()
+        write(rows)
+
+    monkeypatch.setattr(sink, '_write', blocking_write)
+    return writing, release
+
+
+def test_batches(app, sink, writes, monkeypatch, valid_plain_machine):
+    monkeypatch.setitem(app.config, 'EVENTS_BATCH_SIZE', 3)
+    monkeypatch.setitem(app.config, 'EVENTS_FLUSH_INTERVAL_MS', 500)
+
+    sink.submit_many([event(valid_plain_machine.id) for i in range(7)])
+
+    # Full batches go out straight away, the rest once the interval is over.
+    wait_for(lambda: len(writes) >= 2)
+    assert writes[:2] == [3, 3]
+    wait_for(lambda: sum(writes) == 7)
+    assert writes == [3, 3, 1]
+
+    sink.stop()
+    assert stored(valid_plain_machine) == 7
+
+
+def test_queue_full(app, sink, monkeypatch, valid_plain_machine):
+    monkeypatch.setitem(app.config, 'EVENTS_BATCH_SIZE', 1)
+    monkeypatch.setitem(app.config, 'EVENTS_QUEUE_SIZE', 2)
+    monkeypatch.setitem(app.config, 'EVENTS_ENQUEUE_TIMEOUT', 0.2)
+    writing, release = block_writes(sink, monkeypatch)
+
+    sink.submit(event(valid_plain_machine.id))
+    wait_for(writing.is_set)
+
+    # The writer is stuck on the first event: two more fit in the queue,
+    # the next one waits for room and is dropped.
+    sink.submit(event(valid_plain_machine.id))
+    sink.submit(event(valid_plain_machine.id))
+    start = time.monotonic()
+    sink.submit(event(valid_plain_machine.id))
+    assert time.monotonic() - start >= 0.2
+    assert sink.dropped == 1
+
+    release.set()
+    sink.stop()
+    assert stored(valid_plain_machine) == 3
+
+
+def test_failed_batch_written_row_by_row(app, sink, writes, monkeypatch, valid_plain_machine):
+    monkeypatch.setitem(app.config, 'EVENTS_BATCH_SIZE', 3)
+
+    # No such machine: fails the multi-row INSERT.
+    sink.submit_many([event(valid_plain_machine.id),
+                      event(valid_plain_machine.id + 1000),
+                      event(valid_plain_machine.id)])
+    sink.stop()
+
+    assert writes == [3]
+    assert stored(valid_plain_machine) == 2
+    assert MachineEvent.query.filter_by(machine_id=valid_plain_machine.id + 1000).count() == 0
+
+
+def test_stop_writes_queued_events(app, sink, writes, monkeypatch, valid_plain_machine):
+    monkeypatch.setitem(app.config, 'EVENTS_BATCH_SIZE', 1)
+    writing, release = block_writes(sink, monkeypatch)
+
+    sink.submit(event(valid_plain_machine.id))
+    wait_for(writing.is_set)
+    sink.submit(event(valid_plain_machine.id))
+    sink.submit(event(valid_plain_machine.id))
+
+    # Let the first write finish once stop() is waiting for the writer.
+    threading.Timer(0.1, release.set).start()
+    sink.stop()
+
+    assert writes == [1, 2]
+    assert stored(valid_plain_machine) == 3
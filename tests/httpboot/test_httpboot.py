@@ -0,0 +1,77 @@
+import os
+import pytest
+
+
+@pytest.fixture(scope='function')
+def kernel(app):
+    content = os.urandom(4096)
+    with open(os.path.join(app.config['TFTP_ROOT'], 'kernel'), 'wb') as f:
+        f.write(content)
+    return content
+
+
+def test_file_not_found(client):
+    r = client.get('/boot/does/not/exist')
+    assert r.status_code == 404
+
+
+def test_path_traversal(client):
+    r = client.get('/boot/../config.py')
+    assert r.status_code == 404
+
+
+def test_full_file(client, kernel):
+    r = client.get('/boot/kernel')
+    assert r.status_code == 200
+    assert r.data == kernel
+    assert r.headers['Content-Length'] == str(len(kernel))
+    assert r.headers['Accept-Ranges'] == 'bytes'
+    assert r.headers['ETag']
+
+
+def test_etag_not_modified(client, kernel):
+    etag = client.get('/boot/kernel').headers['ETag']
+
+    r = client.get('/boot/kernel', headers={'If-None-Match': etag})
+    assert r.status_code == 304
+    assert r.data == b''
+
+
+def test_range(client, kernel):
+    r = client.get('/boot/kernel', headers={'Range': 'bytes=100-199'})
+    assert r.status_code == 206
+    assert r.data == kernel[100:200]
+    assert r.headers['Content-Range'] == 'bytes 100-199/%d' % len(kernel)
+
+    r = client.get('/boot/kernel', headers={'Range': 'bytes=4000-'})
+    assert r.status_code == 206
+    assert r.data == kernel[4000:]
+
+    r = client.get('/boot/kernel', headers={'Range': 'bytes=-10'})
+    assert r.status_code == 206
+    assert r.data == kernel[-10:]
+
+
+def test_range_unsatisfiable(client, kernel):
+    r = client.get('/boot/kernel', headers={'Range': 'bytes=5000-6000'})
+    assert r.status_code == 416
+    assert r.headers['Content-Range'] == 'bytes */%d' % len(kernel)
+
+
+def test_if_range_mismatch(client, kernel):
+    r = client.get('/boot/kernel', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert r.status_code == 200
+    assert r.data == kernel
+
+
+def test_range_empty_file(app, client):
+    open(os.path.join(app.config['TFTP_ROOT'], 'empty'), 'wb').close()
+
+    for byte_range in ('bytes=0-', 'bytes=-10'):
+        r = client.get('/boot/empty', headers={'Range': byte_range})
+        assert r.status_code == 416
+        assert r.headers['Content-Range'] == 'bytes */0'
+
+    r = client.get('/boot/empty')
+    assert r.status_code == 200
+    assert r.data == b''
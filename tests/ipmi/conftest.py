@@ -0,0 +1,26 @@
+import pytest
+
+from mr_provisioner import ipmi_lanplus
+from tests.ipmi.fakebmc import FakeBMC
+
+
+@pytest.yield_fixture(scope='function')
+def lanplus_config(monkeypatch):
+    for name in ('PORT', 'TIMEOUT', 'RETRIES', 'CIPHER_SUITE', 'SESSION_MAX_IDLE'):
+        monkeypatch.setattr(ipmi_lanplus, name, getattr(ipmi_lanplus, name))
+    ipmi_lanplus.configure(timeout=0.2, retries=1, cipher_suite=2)
+
+    yield ipmi_lanplus
+
+    ipmi_lanplus.pool.clear()
+
+
+@pytest.yield_fixture(scope='function')
+def fake_bmc(lanplus_config):
+    bmc = FakeBMC().start()
+    lanplus_config.configure(port=bmc.port)
+
+    yield bmc
+
+    ipmi_lanplus.pool.clear()
+    bmc.stop()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+A stand-in for ipmitool, for use against FakeBMC (see IPMI_PORT below).
+
+Understands the arguments mr_provisioner.ipmi builds (-I lanplus, -H, -U, -P,
+-L, -R, -C, bridging with -b/-t and -B/-T) and the commands it runs:
+chassis power status|on|off|cycle|reset|soft, chassis bootdev, exec and sol
+deactivate. Like ipmitool, every run opens and closes its own RMCP+ session,
+so runs cost about what they do with the real thing, minus the BMC.
+
+The BMC is reached on the port given by the FAKE_IPMITOOL_PORT environment
+variable (default 623), since ipmitool is not told which port to use.
+"""
+
+import getopt
+import importlib.util
+import os
+import shlex
+import sys
+
+
+# Load the client module on its own, without the mr_provisioner package (and
+# with it Flask and SQLAlchemy) on every run.
+_spec = importlib.util.spec_from_file_location(
+    'ipmi_lanplus', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                                 'mr_provisioner', 'ipmi_lanplus.py'))
+lanplus = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(lanplus)
+
+IPMI_PORT = int(os.environ.get('FAKE_IPMITOOL_PORT', lanplus.IPMI_PORT))
+TIMEOUT = float(os.environ.get('FAKE_IPMITOOL_TIMEOUT', 1.0))
+
+POWER_CONTROL_OUTPUT = {
+    'on': 'Up/On',
+    'off': 'Down/Off',
+    'cycle': 'Cycle',
+    'reset': 'Reset',
+    'soft': 'Soft',
+}
+
+
+class UsageError(Exception):
+    pass
+
+
+def run(session, cmd, bridge_info):
+    if cmd[:2] == ['chassis', 'power'] and len(cmd) == 3:
+        if cmd[2] == 'status':
+            return 'Chassis Power is %s' % lanplus._get_power(session, bridge_info)
+        if cmd[2] in POWER_CONTROL_OUTPUT:
+            lanplus._set_power(session, cmd[2], bridge_info)
+            return 'Chassis Power Control: %s' % POWER_CONTROL_OUTPUT[cmd[2]]
+    elif cmd[:2] == ['chassis', 'bootdev'] and len(cmd) in (3, 4):
+        options = None
+        if len(cmd) == 4:
+            if not cmd[3].startswith('options='):
+                raise UsageError('Invalid chassis bootdev option: %s' % cmd[3])
+            options = cmd[3][len('options='):]
+        lanplus._set_bootdev(session, lanplus._boot_flags(cmd[2], options), bridge_info)
+        return 'Set Boot Device to %s' % cmd[2]
+    elif cmd == ['sol', 'deactivate']:
+        return None
+
+    raise UsageError('Invalid command: %s' % ' '.join(cmd))
+
+
+def main(argv):
+    try:
+        opts, cmd = getopt.getopt(argv, 'I:H:U:P:L:R:C:b:t:B:T:')
+    except getopt.GetoptError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    opts = dict(opts)
+
+    if opts.get('-I', 'lanplus') != 'lanplus' or '-H' not in opts:
+        print('Only -I lanplus with -H is supported', file=sys.stderr)
+        return 1
+
+    bridge_info = []
+    if '-B' in opts:
+        bridge_info.append((int(opts['-B']), int(opts['-T'], 0)))
+    if '-b' in opts:
+        bridge_info.append((int(opts['-b']), int(opts['-t'], 0)))
+
+    if cmd[:1] == ['exec']:
+        with open(cmd[1]) as f:
+            cmds = [shlex.split(line) for line in f if line.strip()]
+    else:
+        cmds = [cmd]
+
+    cipher_suite = int(opts.get('-C', 3))
+    if cipher_suite == 3 and lanplus.Cipher is None:
+        cipher_suite = 2
+
+    try:
+        session = lanplus.Session(opts['-H'], username=opts.get('-U'), password=opts.get('-P'),
+                                  privilege_level=opts.get('-L'), port=IPMI_PORT, cipher_suite=cipher_suite,
+                                  timeout=TIMEOUT, retries=int(opts.get('-R', 1)))
+        session.open()
+    except lanplus.LanplusError as e:
+        print('Error: Unable to establish IPMI v2 / RMCP+ session (%s)' % str(e), file=sys.stderr)
+        return 1
+
+    try:
+        for c in cmds:
+            output = run(session, c, bridge_info)
+            if output is not None:
+                print(output)
+    except (UsageError, lanplus.LanplusError) as e:
+        print('Error: %s' % str(e), file=sys.stderr)
+        return 1
+    finally:
+        session.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,317 @@
+"""
+A minimal IPMI v2.0 (RMCP+) BMC listening on a local UDP port.
+
+Implements the session handshake for cipher suites 0-3 and the handful of
+commands mr-provisioner uses: chassis status/control, boot options,
+session privilege, close session and (nested) Send Message bridging to
+virtual targets, each with its own power state and boot flags.
+
+Requests are handled one at a time, each after `latency` (plus up to
+`jitter`) seconds; a `failure_rate` fraction of them gets no answer at all.
+Commands whose (netfn, cmd) is in `drop_replies` are carried out, but not
+answered.
+"""
+
+import hashlib
+import hmac
+import os
+import random
+import socket
+import struct
+import threading
+import time
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    Cipher = None
+
+
+SUITES = {
+    (0, 0, 0): 0,
+    (1, 0, 0): 1,
+    (1, 1, 0): 2,
+    (1, 1, 1): 3,
+}
+
+
+def _hmac(key, data):
+    return hmac.new(key, data, hashlib.sha1).digest()
+
+
+def _checksum(data):
+    return -sum(data) & 0xff
+
+
+class NoReply(Exception):
+    pass
+
+
+class Target:
+    def __init__(self):
+        self.power = False
+        self.boot_flags = None
+        self.controls = []
+
+
+class FakeSession:
+    def __init__(self, console_sid, bmc_sid, algorithms, privilege):
+        self.console_sid = console_sid
+        self.bmc_sid = bmc_sid
+        self.auth, self.integrity, self.conf = algorithms
+        self.max_privilege = privilege
+        self.rm = None
+        self.rc = os.urandom(16)
+        self.role = None
+        self.username = None
+        self.kuid = None
+        self.k1 = None
+        self.k2 = None
+        self.active = False
+        self.seq = 0
+
+
+class FakeBMC:
+    def __init__(self, users=None, cipher_suites=(0, 1, 2, 3), host='127.0.0.1', port=0, respond=True,
+                 latency=0.0, jitter=0.0, failure_rate=0.0):
+        self.users = users if users is not None else {'admin': 'password'}
+        self.cipher_suites = cipher_suites
+        self.guid = os.urandom(16)
+        self.respond = respond
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.dropped = 0
+        self.drop_replies = set()
+
+        self.targets = {}
+        self.sessions = {}
+        self.sessions_opened = 0
+        self.commands = []
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.host, self.port = self.sock.getsockname()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._stopping = False
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping = True
+        self.sock.close()
+
+    def target(self, path=()):
+        """The virtual machine reached via bridging hops path, e.g. ((0, 0x82), (7, 0x72))."""
+        return self.targets.setdefault(tuple(path), Target())
+
+    def forget_sessions(self):
+        self.sessions.clear()
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                packet, addr = self.sock.recvfrom(65536)
+            except OSError:
+                return
+            if self.failure_rate and random.random() < self.failure_rate:
+                self.dropped += 1
+                continue
+            if self.latency or self.jitter:
+                time.sleep(self.latency + random.uniform(0, self.jitter))
+
+            try:
+                reply = self._handle(packet)
+            except NoReply:
+                reply = None
+            except Exception:
+                reply = None
+            if reply is not None and self.respond:
+                try:
+                    self.sock.sendto(reply, addr)
+                except OSError:
+                    return
+
+    # Framing
+
+    def _frame(self, session, payload_type, payload):
+        session_id, seq = 0, 0
+        if session is not None and session.active:
+            session.seq += 1
+            session_id, seq = session.console_sid, session.seq
+            if session.conf:
+                pad = (16 - (len(payload) + 1) % 16) % 16
+                payload += bytes(range(1, pad + 1)) + bytes([pad])
+                iv = os.urandom(16)
+                enc = Cipher(algorithms.AES(session.k2[:16]), modes.CBC(iv),
+                             backend=default_backend()).encryptor()
+                payload = iv + enc.update(payload) + enc.finalize()
+                payload_type |= 0x80
+            if session.integrity:
+                payload_type |= 0x40
+
+        body = bytes([0x06, payload_type]) + struct.pack('<IIH', session_id, seq, len(payload))
+        body += payload
+        if payload_type & 0x40:
+            pad = (4 - (len(body) + 2) % 4) % 4
+            body += b'\xff' * pad + bytes([pad, 0x07])
+            body += _hmac(session.k1, body)[:12]
+        return b'\x06\x00\xff\x07' + body
+
+    def _handle(self, packet):
+        if packet[:4] != b'\x06\x00\xff\x07' or packet[4] != 0x06:
+            return None
+
+        body = packet[4:]
+        payload_type = body[1]
+        session_id, seq, length = struct.unpack('<IIH', body[2:12])
+        payload = body[12:12 + length]
+
+        kind = payload_type & 0x3f
+        if kind == 0x10:
+            return self._open_session(payload)
+        elif kind == 0x12:
+            return self._rakp1(payload)
+        elif kind == 0x14:
+            return self._rakp3(payload)
+        elif kind != 0x00:
+            return None
+
+        session = self.sessions.get(session_id)
+        if session is None or not session.active:
+            return None
+
+        if session.integrity:
+            if not payload_type & 0x40 or _hmac(session.k1, body[:-12])[:12] != body[-12:]:
+                return None
+        if session.conf:
+            if not payload_type & 0x80:
+                return None
+            dec = Cipher(algorithms.AES(session.k2[:16]), modes.CBC(payload[:16]),
+                         backend=default_backend()).decryptor()
+            data = dec.update(payload[16:]) + dec.finalize()
+            payload = data[:-1 - data[-1]]
+
+        response = self._message(session, (), payload)
+        return self._frame(session, 0x00, response)
+
+    # Session setup
+
+    def _open_session(self, payload):
+        tag, privilege = payload[0], payload[1]
+        console_sid = struct.unpack('<I', payload[4:8])[0]
+        algs = (payload[12], payload[20], payload[28])
+
+        status = 0
+        suite = SUITES.get(algs)
+        if suite is None or suite not in self.cipher_suites or (suite == 3 and Cipher is None):
+            status = 0x11
+
+        bmc_sid = struct.unpack('<I', os.urandom(4))[0] | 1
+        if status == 0:
+            self.sessions[bmc_sid] = FakeSession(console_sid, bmc_sid, algs, privilege)
+
+        response = bytes([tag, status, privilege, 0]) + struct.pack('<II', console_sid, bmc_sid) + \
+            payload[8:32]
+        return self._frame(None, 0x11, response)
+
+    def _rakp1(self, payload):
+        tag = payload[0]
+        session = self.sessions.get(struct.unpack('<I', payload[4:8])[0])
+        if session is None:
+            return self._frame(None, 0x13, bytes([tag, 0x02, 0, 0, 0, 0, 0, 0]))
+
+        session.rm = payload[8:24]
+        session.role = payload[24]
+        ulen = payload[27]
+        session.username = payload[28:28 + ulen]
+
+        password = self.users.get(session.username.decode('utf-8'))
+        if password is None:
+            return self._frame(None, 0x13, bytes([tag, 0x0d, 0, 0]) + struct.pack('<I', session.console_sid))
+
+        session.kuid = password.encode('utf-8').ljust(20, b'\0')
+        user_info = bytes([session.role, ulen]) + session.username
+
+        response = bytes([tag, 0, 0, 0]) + struct.pack('<I', session.console_sid) + session.rc + self.guid
+        if session.auth:
+            response += _hmac(session.kuid, struct.pack('<II', session.console_sid, session.bmc_sid) +
+                              session.rm + session.rc + self.guid + user_info)
+            sik = _hmac(session.kuid, session.rm + session.rc + user_info)
+            session.k1 = _hmac(sik, b'\x01' * 20)
+            session.k2 = _hmac(sik, b'\x02' * 20)
+            session.sik = sik
+        return self._frame(None, 0x13, response)
+
+    def _rakp3(self, payload):
+        tag = payload[0]
+        session = self.sessions.get(struct.unpack('<I', payload[4:8])[0])
+        if session is None or session.rm is None:
+            return self._frame(None, 0x15, bytes([tag, 0x02, 0, 0, 0, 0, 0, 0]))
+
+        user_info = bytes([session.role, len(session.username)]) + session.username
+        if session.auth:
+            expected = _hmac(session.kuid, session.rc + struct.pack('<I', session.console_sid) + user_info)
+            if payload[8:28] != expected:
+                del self.sessions[session.bmc_sid]
+                return self._frame(None, 0x15, bytes([tag, 0x0f, 0, 0]) + struct.pack('<I', session.console_sid))
+
+        response = bytes([tag, 0, 0, 0]) + struct.pack('<I', session.console_sid)
+        if session.auth:
+            response += _hmac(session.sik, session.rm + struct.pack('<I', session.bmc_sid) + self.guid)[:12]
+
+        session.active = True
+        self.sessions_opened += 1
+        return self._frame(None, 0x15, response)
+
+    # Commands
+
+    def _message(self, session, path, msg):
+        rs_addr, netfn, rq_addr, rq_seq, cmd = msg[0], msg[1] >> 2, msg[3], msg[4], msg[5]
+        assert _checksum(msg[:2]) == msg[2] and _checksum(msg[3:-1]) == msg[-1]
+        data = msg[6:-1]
+
+        cc, out = self._command(session, path, netfn, cmd, data)
+        self.commands.append((tuple(path), netfn, cmd, bytes(data)))
+        if (netfn, cmd) in self.drop_replies:
+            raise NoReply()
+
+        head = bytes([rq_addr, (netfn + 1) << 2])
+        body = bytes([rs_addr, rq_seq, cmd, cc]) + out
+        return head + bytes([_checksum(head)]) + body + bytes([_checksum(body)])
+
+    def _command(self, session, path, netfn, cmd, data):
+        target = self.target(path)
+
+        if netfn == 0x06 and cmd == 0x34:
+            channel = data[0] & 0x0f
+            inner = data[1:]
+            return 0, self._message(session, path + ((channel, inner[0]),), inner)
+        elif netfn == 0x06 and cmd == 0x3b:
+            if data[0] > session.max_privilege:
+                return 0x80, b''
+            return 0, bytes([data[0]])
+        elif netfn == 0x06 and cmd == 0x3c:
+            self.sessions.pop(struct.unpack('<I', data[:4])[0], None)
+            return 0, b''
+        elif netfn == 0x00 and cmd == 0x01:
+            return 0, bytes([0x01 if target.power else 0x00, 0, 0x40, 0])
+        elif netfn == 0x00 and cmd == 0x02:
+            control = data[0]
+            target.controls.append(control)
+            if control == 0x00 or control == 0x05:
+                target.power = False
+            elif control in (0x01, 0x02, 0x03):
+                target.power = True
+            else:
+                return 0xcc, b''
+            return 0, b''
+        elif netfn == 0x00 and cmd == 0x08:
+            if data[0] == 0x05:
+                target.boot_flags = bytes(data[1:6])
+            return 0, b''
+
+        return 0xc1, b''
@@ -0,0 +1,53 @@
+import os
+import time
+
+import pytest
+
+from mr_provisioner import ipmi
+from mr_provisioner.ipmi_lanplus import LanplusTimeoutError
+from tests.ipmi.fakebmc import FakeBMC
+
+
+@pytest.fixture(scope='function')
+def fake_ipmitool(monkeypatch, fake_bmc):
+    monkeypatch.setattr(ipmi, 'IPMITOOL_CMD', os.path.join(os.path.dirname(__file__), 'fake_ipmitool.py'))
+    monkeypatch.setattr(ipmi, 'IPMITOOL_TIMEOUT', 10)
+    monkeypatch.setenv('FAKE_IPMITOOL_PORT', str(fake_bmc.port))
+    monkeypatch.setenv('FAKE_IPMITOOL_TIMEOUT', '0.2')
+    return fake_bmc
+
+
+def test_ipmitool_commands(fake_ipmitool):
+    bridge_info = [(0, 0x82), (7, 0x72)]
+    kwargs = dict(host='127.0.0.1', username='admin', password='password')
+
+    assert ipmi.get_power(bridge_info=list(bridge_info), **kwargs) == 'off'
+    ipmi.set_power('on', bridge_info=list(bridge_info), **kwargs)
+    assert ipmi.get_power(bridge_info=list(bridge_info), **kwargs) == 'on'
+
+    assert ipmi.boot_and_reset('pxe', 'efiboot', reset='cycle', bridge_info=list(bridge_info), **kwargs) == 'on'
+    target = fake_ipmitool.target(bridge_info)
+    assert target.boot_flags == bytes([0xa0, 0x04, 0, 0, 0])
+    assert target.controls == [0x01, 0x02]
+    assert fake_ipmitool.target().controls == []
+
+    with pytest.raises(ipmi.IPMIError):
+        ipmi.get_power(host='127.0.0.1', username='admin', password='wrong')
+
+
+def test_latency_and_failures(lanplus_config):
+    bmc = FakeBMC(latency=0.05).start()
+    try:
+        lanplus_config.configure(port=bmc.port)
+        start = time.monotonic()
+        assert lanplus_config.get_power(host='127.0.0.1', username='admin', password='password') == 'off'
+        # Session setup and the command itself
+        assert time.monotonic() - start >= 0.05 * 4
+
+        bmc.failure_rate = 1.0
+        lanplus_config.pool.clear()
+        with pytest.raises(LanplusTimeoutError):
+            lanplus_config.get_power(host='127.0.0.1', username='admin', password='password')
+        assert bmc.dropped > 0
+    finally:
+        bmc.stop()
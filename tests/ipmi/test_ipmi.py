@@ -0,0 +1,49 @@
+import pytest
+
+from mr_provisioner import ipmi
+
+
+@pytest.fixture(scope='function')
+def batches(monkeypatch):
+    batches = []
+    outputs = {
+        'status': ['Chassis Power is off\n', 'Chassis Power is on\n'],
+    }
+
+    def run_command(command):
+        assert command[-2] == 'exec'
+        with open(command[-1]) as f:
+            lines = f.read().splitlines()
+        batches.append((command[:-2], lines))
+
+        output = ''
+        for line in lines:
+            if line.startswith('chassis bootdev'):
+                output += 'Set Boot Device to %s\n' % line.split()[2]
+            elif line == 'chassis power status':
+                output += outputs['status'].pop(0)
+        return output.encode('utf-8')
+
+    monkeypatch.setattr(ipmi, 'run_command', run_command)
+    return batches
+
+
+def test_boot_and_reset_batches(batches):
+    bridge_info = [(0, 0x82), (7, 0x72)]
+    state = ipmi.boot_and_reset('pxe', 'efiboot', reset='cycle', host='10.0.0.1', username='admin',
+                                password='secret', bridge_info=bridge_info)
+    assert state == 'on'
+    assert bridge_info == [(0, 0x82), (7, 0x72)]
+
+    assert [lines for command, lines in batches] == [
+        ['chassis bootdev pxe options=efiboot', 'chassis power status'],
+        ['chassis power on', 'chassis power status'],
+    ]
+    for command, lines in batches:
+        assert command[-10:] == ['-B', '0', '-T', '130', '-b', '7', '-t', '114', '-R', '1']
+
+
+def test_parse_power_state():
+    assert ipmi.parse_power_state('Set Boot Device to pxe\nChassis Power is on\n') == 'on'
+    with pytest.raises(ipmi.IPMIError):
+        ipmi.parse_power_state('Error: Unable to establish IPMI v2 / RMCP+ session\n')
@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+
+from mr_provisioner.bmc_types import resolve_bmc_type, BMCError
+from mr_provisioner.jobs import enqueue, enqueue_many, enqueue_power_changes, run_job
+from mr_provisioner.models import Job, MachineEvent
+
+
+def patch_boot_and_reset(monkeypatch, fn):
+    for name in ('plain', 'moonshot'):
+        monkeypatch.setattr(type(resolve_bmc_type(name)), 'boot_and_reset', fn)
+
+
+def test_claim(db, machines_for_reservation, user_nonadmin):
+    m = machines_for_reservation
+    jobs = enqueue_many([m[0], m[1], m[4]], user_nonadmin, 'power', {'state': 'on'})
+
+    assert Job.claim(2) == [jobs[0].id, jobs[1].id]
+    assert Job.claim(2) == [jobs[2].id]
+    assert Job.claim(2) == []
+
+    db.session.refresh(jobs[0])
+    assert jobs[0].status == Job.RUNNING
+    assert jobs[0].started_at is not None
+
+
+def test_claim_one_per_machine(db, machines_for_reservation, user_nonadmin):
+    m = machines_for_reservation
+    first = enqueue(m[0], user_nonadmin, 'power', {'state': 'off'})
+    second = enqueue(m[0], user_nonadmin, 'power', {'state': 'on'})
+    other = enqueue(m[1], user_nonadmin, 'power', {'state': 'on'})
+
+    # Never two jobs for the same machine at once...
+    assert Job.claim(3) == [first.id, other.id]
+    assert Job.claim(3) == []
+
+    # ...and the next one once the previous one is done
+    first.finish(result={'state': 'off'})
+    assert Job.claim(3) == [second.id]
+
+
+def test_enqueue_power_changes(db, machines_for_reservation, user_nonadmin):
+    m = machines_for_reservation
+    results = enqueue_power_changes(m, user_nonadmin, 'pxe_reboot')
+
+    job, error = results[m[1].id]
+    assert (job.action, job.params, job.status, error) == ('power', {'state': 'pxe_reboot'}, Job.QUEUED, None)
+    assert {machine_id: error for machine_id, (job, error) in results.items() if job is None} == {
+        m[0].id: 'permission denied',
+        m[2].id: 'no BMC configured',
+        m[3].id: 'permission denied',
+        m[4].id: 'permission denied',
+    }
+    assert [job.machine_id for job in Job.query.all()] == [m[1].id]
+
+
+def test_run_power_job(db, monkeypatch, machines_for_reservation, user_nonadmin):
+    patch_boot_and_reset(monkeypatch, lambda self, machine, bootdev: 'on')
+
+    m = machines_for_reservation
+    job = enqueue(m[1], user_nonadmin, 'power', {'state': 'pxe_reboot'})
+    Job.claim(1)
+    run_job(job.id)
+
+    db.session.refresh(job)
+    assert job.status == Job.DONE
+    assert job.result == {'state': 'on'}
+    assert job.finished_at is not None
+    assert [e.info for e in MachineEvent.by_machine_id(m[1].id)] == [{'power': 'pxe_reboot'}]
+
+
+def test_run_reboot_job_powered_off(db, monkeypatch, machines_for_reservation, user_nonadmin):
+    sent = []
+    for name in ('plain', 'moonshot'):
+        monkeypatch.setattr(type(resolve_bmc_type(name)), 'get_power', lambda self, machine: 'off')
+        monkeypatch.setattr(type(resolve_bmc_type(name)), 'set_power',
+                            lambda self, machine, state: sent.append(state))
+
+    m = machines_for_reservation
+    job = enqueue(m[1], user_nonadmin, 'power', {'state': 'reboot'})
+    Job.claim(1)
+    run_job(job.id)
+
+    db.session.refresh(job)
+    assert job.status == Job.DONE
+    assert sent == ['on']
+
+
+def test_run_provision_job_failure(db, monkeypatch, machines_for_reservation, user_nonadmin):
+    def boot_and_reset(self, machine, bootdev):
+        raise BMCError('BMC error: no route to host')
+
+    patch_boot_and_reset(monkeypatch, boot_and_reset)
+
+    m = machines_for_reservation
+    m[1].state = 'provisioning'
+    db.session.commit()
+
+    job = enqueue(m[1], user_nonadmin, 'provision')
+    Job.claim(1)
+    run_job(job.id)
+
+    db.session.refresh(job)
+    assert job.status == Job.FAILED
+    assert job.error == 'BMC error: no route to host'
+    db.session.refresh(m[1])
+    assert m[1].state == 'error'
+
+
+def test_fail_stale_and_prune(db, machines_for_reservation, user_nonadmin):
+    m = machines_for_reservation
+    stale, done = enqueue_many([m[0], m[1]], user_nonadmin, 'power', {'state': 'off'})
+    Job.claim(2)
+
+    stale.started_at = datetime.utcnow() - timedelta(hours=1)
+    done.finish(result={'state': None})
+    done.finished_at = datetime.utcnow() - timedelta(days=10)
+    db.session.commit()
+
+    assert Job.fail_stale(600) == 1
+    db.session.refresh(stale)
+    assert (stale.status, stale.error) == (Job.FAILED, 'worker lost')
+
+    assert Job.prune(7) == 1
+    assert Job.query.get(done.id) is None
@@ -0,0 +1,183 @@
+import threading
+import time
+
+from mr_provisioner.bmc_health import OPEN, CLOSED
+from mr_provisioner.bmc_scheduler import scheduler
+from mr_provisioner.bmc_types import resolve_bmc_type, BMCError
+from mr_provisioner.models import PowerState, BMCHealthState
+from mr_provisioner.power import get_power_states, poll_power_states, STATE_UNKNOWN, \
+    STATE_BMC_ERROR, STATE_TIMEOUT, STATE_BMC_UNREACHABLE
+
+
+def patch_get_power(monkeypatch, fn):
+    for name in ('plain', 'moonshot'):
+        monkeypatch.setattr(type(resolve_bmc_type(name)), 'get_power', fn)
+
+
+def test_power_states(monkeypatch, machines_for_reservation):
+    def get_power(self, machine):
+        if self.name == 'plain':
+            raise BMCError('no route to host')
+        return 'on'
+
+    patch_get_power(monkeypatch, get_power)
+
+    states = get_power_states(machines_for_reservation)
+    m = machines_for_reservation
+    assert states == {
+        m[0].id: STATE_BMC_ERROR,
+        m[1].id: 'on',
+        m[2].id: STATE_UNKNOWN,
+        m[3].id: STATE_UNKNOWN,
+        m[4].id: 'on',
+    }
+
+
+def test_unreachable_bmc(monkeypatch, machines_for_reservation):
+    calls = []
+
+    def get_power(self, machine):
+        calls.append(machine.id)
+        if self.name == 'plain':
+            raise BMCError('no route to host')
+        return 'on'
+
+    patch_get_power(monkeypatch, get_power)
+
+    m = machines_for_reservation
+    for i in range(3):
+        assert get_power_states(m, fresh=True)[m[0].id] == STATE_BMC_ERROR
+
+    del calls[:]
+    states = get_power_states(m, fresh=True)
+    assert states[m[0].id] == STATE_BMC_UNREACHABLE
+    assert states[m[1].id] == 'on'
+    assert m[0].id not in calls
+
+
+def test_stored_bmc_health(monkeypatch, machines_for_reservation):
+    def get_power(self, machine):
+        if self.name == 'plain':
+            raise BMCError('no route to host')
+        return 'on'
+
+    patch_get_power(monkeypatch, get_power)
+
+    m = machines_for_reservation
+    for i in range(3):
+        poll_power_states(timeout=1)
+    assert scheduler.health.changed() == []
+
+    plain = BMCHealthState.query.get(m[0].bmc_id)
+    assert plain.state == OPEN
+    assert plain.consecutive_failures == 3
+    assert plain.last_error == 'no route to host'
+    assert plain.last_success is None
+
+    moonshot = BMCHealthState.query.get(m[1].bmc_id)
+    assert moonshot.state == CLOSED
+    assert moonshot.last_success is not None
+    assert moonshot.latency is not None
+
+    BMCHealthState.forget(m[0].bmc_id)
+    assert BMCHealthState.query.get(m[0].bmc_id) is None
+
+
+def test_per_bmc_concurrency(app, monkeypatch, machines_for_reservation):
+    lock = threading.Lock()
+    running = {}
+    peak = {}
+
+    def get_power(self, machine):
+        with lock:
+            running[machine.bmc.id] = running.get(machine.bmc.id, 0) + 1
+            peak[machine.bmc.id] = max(peak.get(machine.bmc.id, 0), running[machine.bmc.id])
+        time.sleep(0.05)
+        with lock:
+            running[machine.bmc.id] -= 1
+        return 'off'
+
+    patch_get_power(monkeypatch, get_power)
+
+    machines = [m for m in machines_for_reservation if m.bmc] * 4
+    get_power_states(machines)
+
+    assert max(peak.values()) <= app.config['POWER_PER_BMC_CONCURRENCY']
+
+
+def test_timeout_partial_results(monkeypatch, machines_for_reservation):
+    def get_power(self, machine):
+        if self.name == 'moonshot':
+            time.sleep(1)
+        return 'on'
+
+    patch_get_power(monkeypatch, get_power)
+
+    start = time.monotonic()
+    states = get_power_states(machines_for_reservation, timeout=0.2)
+    assert time.monotonic() - start < 0.9
+
+    m = machines_for_reservation
+    assert states[m[0].id] == 'on'
+    assert states[m[1].id] == STATE_TIMEOUT
+    assert states[m[4].id] == STATE_TIMEOUT
+
+
+def test_stored_power_states(app, monkeypatch, machines_for_reservation):
+    calls = []
+
+    def get_power(self, machine):
+        calls.append(machine.id)
+        return 'on'
+
+    patch_get_power(monkeypatch, get_power)
+
+    states = poll_power_states(timeout=1)
+    m = machines_for_reservation
+    assert states == {m[0].id: 'on', m[1].id: 'on', m[4].id: 'on'}
+    assert PowerState.by_machine_ids([m[0].id, m[2].id], 60) == {m[0].id: 'on'}
+
+    del calls[:]
+    states = get_power_states(machines_for_reservation)
+    assert calls == []
+    assert states[m[1].id] == 'on'
+
+    states = get_power_states([m[1]], fresh=True)
+    assert calls == [m[1].id]
+
+    # Changing the power state drops the stored one
+    monkeypatch.setattr(type(resolve_bmc_type('moonshot')), 'set_power', lambda self, machine, state: None)
+    m[1].set_power('off')
+    assert PowerState.by_machine_ids([m[1].id], 60) == {}
+
+
+def test_storing_power_states_leaves_session_alone(db, monkeypatch, machines_for_reservation):
+    patch_get_power(monkeypatch, lambda self, machine: 'on')
+
+    m = machines_for_reservation
+    m[0].name = 'renamed'
+    assert get_power_states([m[0]], fresh=True)[m[0].id] == 'on'
+    assert PowerState.by_machine_ids([m[0].id], 60) == {m[0].id: 'on'}
+
+    # Had the power state query committed it, the rename would stay.
+    db.session.rollback()
+    assert m[0].name == 'machine0'
+
+
+def test_stale_power_states(app, monkeypatch, machines_for_reservation):
+    calls = []
+
+    def get_power(self, machine):
+        calls.append(machine.id)
+        return 'off'
+
+    patch_get_power(monkeypatch, get_power)
+
+    m = machines_for_reservation
+    PowerState.record({m[0].id: 'on'})
+    assert m[0].power_state == 'on'
+    assert calls == []
+
+    monkeypatch.setitem(app.config, 'POWER_STATE_MAX_AGE', 0)
+    assert m[0].power_state == 'off'
+    assert calls == [m[0].id]
@@ -0,0 +1,166 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from mr_provisioner.bmc_health import BMCUnreachable, OPEN, CLOSED
+from mr_provisioner.bmc_scheduler import BMCScheduler, SchedulerTimeout
+from mr_provisioner.bmc_types import BMCError, resolve_bmc_type
+
+
+def machine(machine_id, bmc_id, bmc_type='plain'):
+    return SimpleNamespace(id=machine_id, bmc=SimpleNamespace(id=bmc_id, bmc_type=bmc_type))
+
+
+@pytest.fixture(scope='function')
+def scheduler(app):
+    scheduler = BMCScheduler()
+    scheduler.start(4)
+    return scheduler
+
+
+def test_coalesce_reads(scheduler):
+    release = threading.Event()
+    calls = []
+
+    def read(m):
+        calls.append(m.id)
+        return 'on'
+
+    # moonshot BMCs run one operation at a time
+    blocker = scheduler.submit(lambda m: release.wait(), machine(1, 1, 'moonshot'))
+    futures = [scheduler.submit(read, machine(2, 1, 'moonshot'), coalesce='get_power') for i in range(10)]
+    assert len(set(futures)) == 1
+
+    release.set()
+    assert futures[0].result(timeout=1) == 'on'
+    assert blocker.result(timeout=1)
+    assert calls == [2]
+    assert scheduler.coalesced == 9
+
+
+def test_writes_break_coalescing(scheduler):
+    release = threading.Event()
+    calls = []
+
+    scheduler.submit(lambda m: release.wait(), machine(1, 1, 'moonshot'))
+    read1 = scheduler.submit(lambda m: calls.append('read1'), machine(2, 1, 'moonshot'), coalesce='get_power')
+    write = scheduler.submit(lambda m: calls.append('write'), machine(2, 1, 'moonshot'))
+    read2 = scheduler.submit(lambda m: calls.append('read2'), machine(2, 1, 'moonshot'), coalesce='get_power')
+    assert read1 is not read2
+
+    release.set()
+    for f in (read1, write, read2):
+        f.result(timeout=1)
+    assert calls == ['read1', 'write', 'read2']
+
+
+def test_per_bmc_limit_and_fairness(scheduler):
+    lock = threading.Lock()
+    running = {}
+    peak = {}
+    order = []
+
+    def op(m):
+        with lock:
+            running[m.bmc.id] = running.get(m.bmc.id, 0) + 1
+            peak[m.bmc.id] = max(peak.get(m.bmc.id, 0), running[m.bmc.id])
+            order.append(m.bmc.id)
+        time.sleep(0.02)
+        with lock:
+            running[m.bmc.id] -= 1
+
+    busy = [scheduler.submit(op, machine(i, 1)) for i in range(20)]
+    chassis = [scheduler.submit(op, machine(100 + i, 2, 'moonshot')) for i in range(5)]
+    other = scheduler.submit(op, machine(200, 3))
+
+    for f in busy + chassis + [other]:
+        f.result(timeout=5)
+
+    assert peak[1] == 2
+    assert peak[2] == 1
+    # BMC 3 doesn't wait for the 20 operations queued for BMC 1
+    assert order.index(3) < 5
+
+
+def test_deadline(scheduler):
+    release = threading.Event()
+    calls = []
+
+    scheduler.submit(lambda m: release.wait(), machine(1, 1, 'moonshot'))
+    late = scheduler.submit(lambda m: calls.append(m.id), machine(2, 1, 'moonshot'), deadline=time.monotonic() + 0.05)
+
+    time.sleep(0.1)
+    release.set()
+    with pytest.raises(SchedulerTimeout):
+        late.result(timeout=1)
+    assert calls == []
+
+
+def test_breaker(scheduler, monkeypatch):
+    scheduler.health.threshold = 2
+    scheduler.health.cooldown = 0.1
+    calls = []
+    answering = threading.Event()
+
+    def fail(m):
+        calls.append(m.id)
+        raise BMCError('no route to host')
+
+    def get_power(self, m):
+        if not answering.is_set():
+            raise BMCError('still down')
+        return 'on'
+
+    monkeypatch.setattr(type(resolve_bmc_type('plain')), 'get_power', get_power)
+
+    for i in range(2):
+        with pytest.raises(BMCError):
+            scheduler.submit(fail, machine(1, 1)).result(timeout=1)
+    assert scheduler.health.get(1).state == OPEN
+
+    # Fails fast without running anything, and doesn't affect other BMCs
+    with pytest.raises(BMCUnreachable):
+        scheduler.submit(fail, machine(1, 1)).result(timeout=0)
+    assert calls == [1, 1]
+    assert scheduler.submit(lambda m: 'ok', machine(2, 2)).result(timeout=1) == 'ok'
+
+    # A failed probe keeps it open for another cooldown
+    time.sleep(0.15)
+    with pytest.raises(BMCUnreachable):
+        scheduler.submit(fail, machine(1, 1)).result(timeout=0)
+    time.sleep(0.05)
+    assert scheduler.health.get(1).state == OPEN
+
+    answering.set()
+    time.sleep(0.15)
+    with pytest.raises(BMCUnreachable):
+        scheduler.submit(fail, machine(1, 1)).result(timeout=0)
+    time.sleep(0.05)
+
+    health = scheduler.health.get(1)
+    assert health.state == CLOSED
+    assert health.consecutive_failures == 0
+    assert health.last_success is not None
+    assert scheduler.submit(lambda m: 'ok', machine(1, 1)).result(timeout=1) == 'ok'
+    assert calls == [1, 1]
+
+
+def test_breaker_fails_queued_ops(scheduler):
+    scheduler.health.threshold = 1
+    release = threading.Event()
+
+    def fail(m):
+        release.wait()
+        raise BMCError('no route to host')
+
+    failing = scheduler.submit(fail, machine(1, 1, 'moonshot'))
+    queued = [scheduler.submit(lambda m: 'on', machine(2 + i, 1, 'moonshot')) for i in range(5)]
+
+    release.set()
+    with pytest.raises(BMCError):
+        failing.result(timeout=1)
+    for f in queued:
+        with pytest.raises(BMCUnreachable):
+            f.result(timeout=1)
@@ -0,0 +1,20 @@
+import pytest
+from mr_provisioner.models import Token
+from mr_provisioner.tftp.controllers import config_cache
+
+
+@pytest.fixture(scope='function', autouse=True)
+def clear_config_cache():
+    config_cache.invalidate()
+    yield
+    config_cache.invalidate()
+
+
+@pytest.fixture(scope='function')
+def stats_token(db, user_nonadmin):
+    token = Token(user_nonadmin.id, None, 'tftp stats token')
+    db.session.add(token)
+    db.session.commit()
+    db.session.refresh(token)
+
+    return token.token
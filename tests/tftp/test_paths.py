@@ -0,0 +1,36 @@
+import pytest
+
+from mr_provisioner.tftp.paths import classify_path, STATIC, PXELINUX, GRUB, IPXE
+
+
+MAC = 'aa:bb:cc:dd:ee:ff'
+
+
+@pytest.mark.parametrize('filename,expected', [
+    ('pxelinux.cfg/01-aa-bb-cc-dd-ee-ff', (PXELINUX, MAC)),
+    ('boot/pxelinux.cfg/01-AA-BB-CC-DD-EE-FF', (PXELINUX, MAC)),
+    ('pxelinux.cfg/default', (PXELINUX, None)),
+    ('grub/grub.cfg-01-aa-bb-cc-dd-ee-ff', (GRUB, MAC)),
+    ('grub/01-aa-bb-cc-dd-ee-ff', (GRUB, MAC)),
+    ('01-aa-bb-cc-dd-ee-ff', (GRUB, MAC)),
+    ('grub/efidefault', (GRUB, None)),
+    ('ipxe/aa-bb-cc-dd-ee-ff.ipxe', (IPXE, MAC)),
+    ('01-aa-bb-cc-dd-ee-ff.ipxe', (IPXE, MAC)),
+    ('mac-AABBCCDDEEFF.ipxe', (IPXE, MAC)),
+    ('default.ipxe', (IPXE, None)),
+])
+def test_config_paths(filename, expected):
+    assert classify_path(filename) == expected
+
+
+@pytest.mark.parametrize('filename', [
+    'pxelinux.0',
+    'pxelinux.cfg/C0A80001',
+    'grub/grub.cfg',
+    'images/vmlinuz',
+    'xefidefault',
+    'pxelinux.cfg/01-aa-bb-cc-dd-ee-ff.bak',
+    'grub/01-aa-bb-cc-dd-ee',
+])
+def test_static_paths(filename):
+    assert classify_path(filename) == (STATIC, None)
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import socket
+import struct
+import threading
+import pytest
+from mr_provisioner.models import Machine, Interface
+from mr_provisioner.tftp import server
+from mr_provisioner.tftp.server import create_server, OP_RRQ, OP_DATA, OP_ACK, OP_ERROR, OP_OACK
+
+
+@pytest.fixture(scope='function')
+def tftp_server(app):
+    loop = asyncio.new_event_loop()
+    transport, _ = create_server(app, loop, '127.0.0.1', 0)
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    yield transport.get_extra_info('sockname')
+
+    loop.call_soon_threadsafe(transport.close)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def fetch(server, filename, **options):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.settimeout(5)
+
+    request = struct.pack('!H', OP_RRQ) + filename.encode() + b'\0octet\0'
+    for k, v in options.items():
+        request += k.encode() + b'\0' + str(v).encode() + b'\0'
+    s.sendto(request, server)
+
+    oack = {}
+    blksize = 512
+    windowsize = 1
+    expected = 1
+    data = bytearray()
+
+    while True:
+        packet, addr = s.recvfrom(65536)
+        opcode, = struct.unpack('!H', packet[:2])
+
+        if opcode == OP_ERROR:
+            return None, struct.unpack('!H', packet[2:4])[0]
+
+        if opcode == OP_OACK:
+            fields = packet[2:].split(b'\0')[:-1]
+            oack = {k.decode(): int(v) for k, v in zip(fields[::2], fields[1::2])}
+            blksize = oack.get('blksize', blksize)
+            windowsize = oack.get('windowsize', windowsize)
+            s.sendto(struct.pack('!HH', OP_ACK, 0), addr)
+            continue
+
+        assert opcode == OP_DATA
+        block, = struct.unpack('!H', packet[2:4])
+        if block != expected & 0xffff:
+            continue
+
+        data += packet[4:]
+        last = len(packet) - 4 < blksize
+        if last or expected % windowsize == 0:
+            s.sendto(struct.pack('!HH', OP_ACK, expected & 0xffff), addr)
+        if last:
+            return oack, bytes(data)
+        expected += 1
+
+
+def test_static_file(app, tftp_server):
+    content = os.urandom(512 * 10 + 100)
+    with open(os.path.join(app.config['TFTP_ROOT'], 'kernel'), 'wb') as f:
+        f.write(content)
+
+    oack, data = fetch(tftp_server, '/kernel')
+    assert oack == {}
+    assert data == content
+
+
+def test_static_file_options(app, tftp_server):
+    content = os.urandom(1428 * 40)
+    with open(os.path.join(app.config['TFTP_ROOT'], 'initrd'), 'wb') as f:
+        f.write(content)
+
+    oack, data = fetch(tftp_server, 'initrd', blksize=1428, windowsize=8, tsize=0)
+    assert oack == {'blksize': 1428, 'windowsize': 8, 'tsize': len(content)}
+    assert data == content
+
+
+def test_static_file_whole_blocks(app, tftp_server):
+    # Ends with an empty block
+    content = os.urandom(512 * 8)
+    with open(os.path.join(app.config['TFTP_ROOT'], 'kernel'), 'wb') as f:
+        f.write(content)
+
+    oack, data = fetch(tftp_server, '/kernel', windowsize=4)
+    assert oack == {'windowsize': 4}
+    assert data == content
+
+
+def test_transfer_failing_to_start(app, tftp_server, monkeypatch):
+    with open(os.path.join(app.config['TFTP_ROOT'], 'kernel'), 'wb') as f:
+        f.write(os.urandom(512))
+
+    closed = []
+    close = server.FileSource.close
+
+    def recording_close(source):
+        closed.append(source)
+        close(source)
+
+    def failing_transfer(*args, **kwargs):
+        raise OSError('no ports left')
+
+    monkeypatch.setattr(server.FileSource, 'close', recording_close)
+    monkeypatch.setattr(server, 'Transfer', failing_transfer)
+
+    assert fetch(tftp_server, '/kernel') == (None, 0)
+    assert len(closed) == 1
+
+
+def test_file_not_found(client, tftp_server):
+    oack, code = fetch(tftp_server, '/does/not/exist')
+    assert oack is None
+    assert code == 1
+
+
+def test_config_edited_elsewhere(db, tftp_server, valid_interface_1, valid_image_kernel):
+    filename = '/grub/grub.cfg-01-%s' % valid_interface_1.mac.replace(':', '-')
+    unknown = '/grub/grub.cfg-01-de-ad-be-ef-00-00'
+
+    oack, data = fetch(tftp_server, filename)
+    assert valid_image_kernel.filename not in data.decode('utf-8')
+    assert fetch(tftp_server, unknown) == (None, 1)
+
+    # Changed as if through another process: bulk statements bypass the
+    # mapper events this process's caches are invalidated by.
+    Machine.query.filter_by(id=valid_interface_1.machine_id) \
+        .update({'netboot_enabled': True, 'kernel_id': valid_image_kernel.id})
+    db.session.execute(Interface.__table__.insert().values(mac='de:ad:be:ef:00:00',
+                                                           machine_id=valid_interface_1.machine_id))
+    db.session.commit()
+
+    oack, data = fetch(tftp_server, filename)
+    assert valid_image_kernel.filename in data.decode('utf-8')
+    oack, data = fetch(tftp_server, unknown)
+    assert oack is not None
@@ -0,0 +1,79 @@
+import json
+from werkzeug.datastructures import Headers
+
+
+def stats(client, token):
+    d = Headers()
+    d.add('Authorization', 'Bearer %s' % token)
+    r = client.get('/tftp/stats', headers=d)
+    assert r.status_code == 200
+    return json.loads(r.data.decode('utf-8'))
+
+
+def tftp_headers(filename):
+    d = Headers()
+    d.add('X-TFTP-IP', '10.0.0.5')
+    d.add('X-TFTP-File', filename)
+    return d
+
+
+def test_missing_headers(client):
+    r = client.get('/tftp/')
+    assert r.status_code == 400
+
+
+def test_unknown_file(client):
+    r = client.get('/tftp/', headers=tftp_headers('/does/not/exist'))
+    assert r.status_code == 404
+
+
+def test_default_config(client):
+    r = client.get('/tftp/', headers=tftp_headers('/pxelinux.cfg/default'))
+    assert r.status_code == 200
+    assert 'LOCALBOOT' in r.data.decode('utf-8')
+
+
+def test_unknown_mac_config(client):
+    r = client.get('/tftp/', headers=tftp_headers('/grub/grub.cfg-01-de-ad-be-ef-00-00'))
+    assert r.status_code == 404
+
+
+def test_stats_needs_token(client):
+    assert client.get('/tftp/stats').status_code == 401
+
+    d = Headers()
+    d.add('Authorization', 'Bearer INVALID')
+    assert client.get('/tftp/stats', headers=d).status_code == 401
+
+
+def test_machine_config_cached(client, db, stats_token, valid_interface_1, valid_image_kernel):
+    filename = '/grub/grub.cfg-01-%s' % valid_interface_1.mac.replace(':', '-')
+    before = stats(client, stats_token)
+
+    r = client.get('/tftp/', headers=tftp_headers(filename))
+    assert r.status_code == 200
+    assert 'efiquit' in r.data.decode('utf-8')
+
+    r = client.get('/tftp/', headers=tftp_headers(filename))
+    assert r.status_code == 200
+
+    after = stats(client, stats_token)
+    assert after['hits'] - before['hits'] == 1
+    assert after['misses'] - before['misses'] == 1
+
+    machine = valid_interface_1.machine
+    machine.netboot_enabled = True
+    machine.kernel_id = valid_image_kernel.id
+    db.session.commit()
+
+    r = client.get('/tftp/', headers=tftp_headers(filename))
+    assert r.status_code == 200
+    assert valid_image_kernel.filename in r.data.decode('utf-8')
+
+
+def test_ipxe_config(client, db, valid_interface_1):
+    filename = '/ipxe/mac-%s.ipxe' % valid_interface_1.mac.replace(':', '')
+
+    r = client.get('/tftp/', headers=tftp_headers(filename))
+    assert r.status_code == 200
+    assert r.data.decode('utf-8').startswith('#!ipxe')